@@ -6,23 +6,47 @@ pr-read.py: Command-line tool for reading in various file formats and outputting
 Created by Scott Feister, J.T. Laune, and Alemayehu Bogale on Mon Nov 20 14:43:18 2017
 
 Call via "python pr-read.py filename". Will prompt user for additional info.
+Add "--profile" (and optionally "--profile-out FILE", "--profile-memory") to
+run under the profiler and print the top hot spots.
 
 """
 
-import sys
+import argparse
 from pradreader.reader import prad
+from pradreader.profiling import profiler
 
-# TODO: Add optional flags for output files, anything else
-if __name__ == "__main__":
-    pr = prad(sys.argv[1]) # Set the filename, initialize the object
+def pipeline(filename, prof=None):
+    # With a profiler, only the non-interactive steps are profiled (not time spent at prompts)
+    run = prof.runcall if prof is not None else (lambda func: func())
+
+    pr = prad(filename) # Set the filename, initialize the object
     # TODO Insert here: Try and guess the rtype by looking at the file (version 2)
-    pr.read() # Read the file contents; prompt for file type as needed
+    pr.promptRead() # Prompt for file type as needed
+    run(pr.read) # Read the file contents
     pr.show() # Display what was just read in
     pr.prompt() # Fill in the gaps on parameters
-    pr.genmask() # Generate the mask from x/y tuples
-    pr.validate() # Validate that the elements are looking good
-    pr.write(ofile='input.txt') # Write the intermediate prad object file (shared uses)
-    pr.pickle(ofile='input.p') # Write the pickled prad object file (quick and dirty uses)
-    pr.plot(plotdir='plots') # Save some flux plots
 
+    def finish():
+        pr.genmask() # Generate the mask from x/y tuples
+        pr.validate() # Validate that the elements are looking good
+        pr.write(ofile='input.txt') # Write the intermediate prad object file (shared uses)
+        pr.pickle(ofile='input.p') # Write the pickled prad object file (quick and dirty uses)
+        pr.plot(plotdir='plots') # Save some flux plots
+    run(finish)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read a proton radiography file and write a PRR file.")
+    parser.add_argument("filename", help="Input file.")
+    parser.add_argument("--profile", action="store_true", help="Run under the profiler and print the top hot spots.")
+    parser.add_argument("--profile-out", default="pradreader.prof", help="File for the profile statistics (with --profile).")
+    parser.add_argument("--profile-memory", action="store_true", help="With --profile, also trace memory allocations (slower).")
+    args = parser.parse_args()
 
+    if args.profile:
+        prof = profiler(out=args.profile_out, memory=args.profile_memory)
+        try:
+            pipeline(args.filename, prof)
+        finally:
+            prof.report()
+    else:
+        pipeline(args.filename)
@@ -2,4 +2,14 @@
 
 __version__ = '0.0.1'
 
-from . import reader
+import sys
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        """ Import the reader module (and NumPy, pandas, matplotlib) on first use, so light tools like the client start fast """
+        if name == 'reader':
+            import importlib # Not 'from . import reader', which calls back into __getattr__
+            return importlib.import_module(__name__ + '.reader')
+        raise AttributeError("module 'pradreader' has no attribute '" + name + "'")
+else:
+    from . import reader
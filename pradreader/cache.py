@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+cache.py: Content-addressed cache of finished prad read results
+
+A cache entry holds the flux arrays and metadata that prad.read produced for a
+given source file and set of read parameters. Entries are keyed by a hash of the
+source file contents (plus, for FLASH4, its metadata files) and the read
+parameters, stored as uncompressed NumPy .npz files, and evicted least-recently-
+used first once the cache folder grows past its size limit.
+
+Source files are hashed only once: their digests are kept in the cache folder
+under the file's stat fingerprint (path, size, mtime, inode), so later
+processes find a cached result after a stat() rather than re-reading the file.
+
+Usage:
+    from pradreader import cache
+    cache.enable() # Or set the PRADREADER_CACHE environment variable to a folder
+    pr.read() # Later reads of the same file with the same parameters come from the cache
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+import numpy as np
+from .sparse import sparseflux
+
+CACHE_VERSION = 1 # Bump when the reader outputs change, to invalidate old entries
+
+_META_FIELDS = ('s2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um')
+_FLUX_FIELDS = ('flux2D', 'flux2D_ref')
+
+_default = None # Cache used by prad.read when none is specified
+_digests = {} # File fingerprint => content digest, so unchanged files are hashed only once per session
+
+class resultcache(object):
+    """
+    Folder of cached prad read results, bounded in total size.
+
+    Inputs:
+        folder: String, folder holding the cache entries (created if not existing).
+                    Defaults to ~/.cache/pradreader
+        max_bytes: Integer, maximum total size of the entries; the least recently
+                    used entries are deleted beyond this
+    """
+    def __init__(self, folder=None, max_bytes=2*1024**3):
+        if folder is None:
+            folder = os.path.join(os.path.expanduser('~'), '.cache', 'pradreader')
+        self.folder = folder
+        self.max_bytes = int(max_bytes)
+        try: # Python2&3 equivalent of os.makedirs(folder, exist_ok=True)
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+
+    def __repr__(self):
+        return "resultcache('" + self.folder + "', max_bytes=" + str(self.max_bytes) + ")"
+
+    def key(self, filename, rtype, **params):
+        """ Cache key (hex string) for reading 'filename' as 'rtype' with the given read parameters """
+        return readKey(filename, rtype, digest_folder=os.path.join(self.folder, 'digests'), **params)
+
+    def path(self, key):
+        """ Full filename of the entry for a given key """
+        return os.path.join(self.folder, key + '.npz')
+
+    def restore(self, key, pr):
+        """ Fill a prad object from the cache entry for 'key'; returns False if there is none """
+        fn = self.path(key)
+        try:
+            data = np.load(fn)
+        except (IOError, OSError, ValueError):
+            return False
+        with data:
+            for k in _META_FIELDS:
+                val = data[k][()]
+                if not np.isnan(val): # Values the reader did not provide are left as they are
+                    setattr(pr, k, float(val))
+            for k in _FLUX_FIELDS:
+                if k + '_index' in data:
+                    flux = sparseflux(data[k + '_shape'], data[k + '_index'], data[k + '_values'])
+                else:
+                    flux = data[k]
+                setattr(pr, k, flux)
+        os.utime(fn, None) # Mark as recently used
+        return True
+
+    def store(self, key, pr):
+        """ Save the results held by a prad object as the entry for 'key', then enforce the size limit """
+        entry = {}
+        for k in _META_FIELDS:
+            val = getattr(pr, k)
+            entry[k] = np.float64(np.nan if val is None else val)
+        for k in _FLUX_FIELDS:
+            flux = getattr(pr, '_' + k) # Stored form; don't densify sparse maps
+            if isinstance(flux, sparseflux):
+                entry[k + '_shape'] = np.array(flux.shape)
+                entry[k + '_index'] = flux.index
+                entry[k + '_values'] = flux.values
+            else:
+                entry[k] = flux
+
+        # Write to a temporary file first, so readers never see a partial entry
+        fd, tmpfn = tempfile.mkstemp(suffix='.tmp', dir=self.folder)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **entry)
+        replaceFile(tmpfn, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """ List of (mtime, size, filename) for all entries, least recently used first """
+        out = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.npz'):
+                fn = os.path.join(self.folder, name)
+                try:
+                    st = os.stat(fn)
+                except OSError: # Deleted meanwhile by another process
+                    continue
+                out.append((st.st_mtime, st.st_size, fn))
+        return sorted(out)
+
+    def evict(self):
+        """ Delete least recently used entries until the cache fits in max_bytes """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, fn in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """ Delete all entries, and the remembered source file digests """
+        for _, _, fn in self.entries():
+            os.remove(fn)
+        folder = os.path.join(self.folder, 'digests')
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                os.remove(os.path.join(folder, name))
+
+def replaceFile(src, dst):
+    """ Atomically move src onto dst, overwriting dst (os.replace for Python2&3) """
+    try:
+        os.replace(src, dst)
+    except AttributeError: # Python 2
+        os.rename(src, dst)
+
+def readKey(filename, rtype, digest_folder=None, **params):
+    """ Key (hex string) identifying the result of reading 'filename' as 'rtype' with the given read parameters
+    (digest_folder: see fileDigest) """
+    h = hashlib.sha1()
+    h.update(("v" + str(CACHE_VERSION) + " " + str(rtype)).encode())
+    for fn in sourceFiles(filename, rtype):
+        h.update(fileDigest(fn, folder=digest_folder).encode())
+    for k in sorted(params):
+        h.update((" " + k + "=" + repr(params[k])).encode())
+    return h.hexdigest()
+
+def sourceFiles(filename, rtype):
+    """ List of files whose contents determine the result of reading 'filename' as 'rtype' """
+    if rtype != 'flash4':
+        return [filename]
+
+    # FLASH4 reads also depend on the detector and beam setup files of the same simulation
+    folder, name = os.path.split(filename)
+    m = re.match(r'^(\w*?)ProtonDetectorFile', name)
+    if not m:
+        return [filename]
+    basenm = m.group(1)
+    return [filename] + [os.path.join(folder, basenm + suffix)
+                         for suffix in ("ProtonImagingDetectors.txt", "ProtonBeamsPrint.txt")]
+
+def fingerprint(fn):
+    """ Tuple (real path, size, mtime in ns, inode) identifying a file's current contents without reading them """
+    st = os.stat(fn)
+    mtime_ns = getattr(st, 'st_mtime_ns', None) # Python 3.3+
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1e9)
+    return (os.path.realpath(fn), st.st_size, mtime_ns, st.st_ino)
+
+def fileDigest(fn, blocksize=2**20, folder=None):
+    """ SHA1 hex digest of a file's contents, remembered while its fingerprint is unchanged
+    Inputs:
+        fn: String, filename
+        blocksize: Integer, bytes read at a time while hashing
+        folder: String, folder in which to also remember digests across processes (e.g. the
+                    cache's 'digests' folder), or None to remember them in this process only
+    """
+    memokey = fingerprint(fn)
+    digest = _digests.get(memokey)
+    if digest is not None:
+        return digest
+
+    memofn = None
+    if folder is not None:
+        memofn = os.path.join(folder, hashlib.sha1(repr(memokey).encode('utf-8')).hexdigest() + '.txt')
+        try:
+            with open(memofn) as f:
+                digest = f.read().strip()
+        except (IOError, OSError):
+            digest = None
+    if not digest:
+        h = hashlib.sha1()
+        with open(fn, 'rb') as f:
+            block = f.read(blocksize)
+            while block:
+                h.update(block)
+                block = f.read(blocksize)
+        digest = h.hexdigest()
+        if memofn is not None:
+            try: # Python2&3 equivalent of os.makedirs(folder, exist_ok=True)
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+            fd, tmpfn = tempfile.mkstemp(suffix='.tmp', dir=folder)
+            with os.fdopen(fd, 'w') as f:
+                f.write(digest + '\n')
+            replaceFile(tmpfn, memofn)
+    _digests[memokey] = digest
+    return digest
+
+def enable(folder=None, max_bytes=2*1024**3):
+    """ Turn on result caching for all prad.read calls; returns the cache """
+    global _default
+    _default = resultcache(folder, max_bytes)
+    return _default
+
+def disable():
+    """ Turn off result caching for prad.read calls """
+    global _default
+    _default = None
+
+def getDefault():
+    """ The cache used by prad.read when none is given; set by enable() or the PRADREADER_CACHE environment variable """
+    global _default
+    if _default is None and os.environ.get('PRADREADER_CACHE'):
+        _default = resultcache(os.environ['PRADREADER_CACHE'])
+    return _default
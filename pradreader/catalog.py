@@ -0,0 +1,222 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+catalog.py: SQLite index of PRR file headers, for finding radiographs by metadata
+
+Finding the radiographs of a campaign with a given proton energy, geometry or
+shape should not require parsing thousands of flux arrays. A 'prrcatalog' reads
+only the '#' header lines of each PRR file (metadata, array shapes, dtype, mask)
+and records them, with a fingerprint of the header, in a local SQLite
+database. Rescans only re-read files whose size or modification time changed.
+
+Queries take milliseconds and return prad objects with their metadata filled
+in; the flux maps are read only when asked for (pr.read()).
+
+Usage:
+    from pradreader.catalog import prrcatalog
+    cat = prrcatalog('campaign.sqlite')
+    cat.scan('/data/campaign') # Every *.txt PRR file below the folder
+    for pr in cat.query(Ep_MeV=14.7, s2r_cm=(0.5, 2.0), shape=(501, 500)):
+        pr.read()
+        myalgorithm(pr)
+"""
+
+import os
+import re
+import fnmatch
+import hashlib
+import sqlite3
+
+_META_FIELDS = ('s2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um')
+_COLUMNS = (('path', 'TEXT PRIMARY KEY'), ('mtime', 'REAL'), ('size', 'INTEGER'), ('fingerprint', 'TEXT'),
+            ('version', 'TEXT'), ('date', 'TEXT'), ('s2r_cm', 'REAL'), ('s2d_cm', 'REAL'),
+            ('Ep_MeV', 'REAL'), ('bin_um', 'REAL'), ('ny', 'INTEGER'), ('nx', 'INTEGER'),
+            ('sparse', 'INTEGER'), ('dtype', 'TEXT'), ('mask', 'INTEGER'))
+_NAMES = tuple(name for name, _ in _COLUMNS)
+_INDEXED = ('Ep_MeV', 's2r_cm', 's2d_cm', 'bin_um', 'ny, nx')
+
+def readHeader(fn):
+    """
+    Read the header lines of a PRR file (and nothing else)
+    Inputs:
+        fn: String, PRR filename
+    Outputs:
+        header: dict with 'version', 'date', the metadata (s2r_cm, s2d_cm, Ep_MeV,
+                    bin_um; None where not set), 'ny', 'nx' (flux2D shape), 'sparse'
+                    (True if stored as non-zero pixels), 'dtype', 'mask' (True if a
+                    mask is stored) and 'fingerprint' (SHA1 of the header and file
+                    size), or None if the file is not a PRR file
+    """
+    h = hashlib.sha1()
+    header = dict((k, None) for k in _META_FIELDS)
+    header.update({'version': None, 'date': None, 'ny': None, 'nx': None, 'sparse': False,
+                   'dtype': 'float64', 'mask': False})
+    with open(fn, 'rb') as f:
+        line = f.readline()
+        m = re.match(br'# PRadReader \(PRR\) Generated Input File (\S+)', line)
+        if not m:
+            return None
+        header['version'] = m.group(1).decode('ascii')
+        while line.startswith(b'#'):
+            h.update(line)
+            text = line.decode('ascii', 'replace')
+            fields = text.split()
+            if text.startswith('# Date generated:'):
+                header['date'] = text[len('# Date generated:'):].strip()
+            elif len(fields) == 3 and fields[1] in _META_FIELDS:
+                try:
+                    header[fields[1]] = float(fields[2])
+                except ValueError: # Written as 'None'
+                    pass
+            elif text.startswith('# dtype '):
+                header['dtype'] = fields[2]
+            elif text.startswith('# mask '):
+                header['mask'] = True
+            else:
+                m = re.match(r'# flux2D \((\d+), (\d+)\)( sparse)?', text)
+                if m:
+                    header['ny'], header['nx'] = int(m.group(1)), int(m.group(2))
+                    header['sparse'] = m.group(3) is not None
+            line = f.readline()
+    h.update(str(os.path.getsize(fn)).encode('ascii'))
+    header['fingerprint'] = h.hexdigest()
+    return header
+
+class prrcatalog(object):
+    """
+    SQLite catalog of PRR file headers.
+
+    Inputs:
+        dbfile: String, SQLite database file (created if not existing), or ':memory:'
+    """
+    def __init__(self, dbfile='prrcatalog.sqlite'):
+        self.dbfile = dbfile
+        self._db = sqlite3.connect(dbfile)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS prr ("
+                             + ", ".join(name + " " + kind for name, kind in _COLUMNS) + ")")
+            for cols in _INDEXED:
+                self._db.execute("CREATE INDEX IF NOT EXISTS prr_" + re.sub(r'\W+', '_', cols)
+                                 + " ON prr (" + cols + ")")
+
+    def __repr__(self):
+        return "prrcatalog('" + self.dbfile + "', " + str(len(self)) + " files)"
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM prr").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Close the database """
+        self._db.close()
+
+    def scan(self, paths, pattern='*.txt', prune=True):
+        """
+        Add new and changed PRR files to the catalog, reading their headers only
+        Inputs:
+            paths: String or list of strings, PRR files and/or folders (searched
+                        recursively for files matching 'pattern')
+            pattern: String, filename pattern of PRR files in folders
+            prune: Boolean, if True, remove entries of files in the scanned folders
+                        (or given by name) that no longer exist
+        Outputs:
+            counts: dict with the number of files 'added' (new or changed),
+                        'unchanged', 'skipped' (not PRR files) and 'removed'
+        Files whose size and modification time match their entry are not opened.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        files, folders = [], []
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                folders.append(path)
+                for root, _, names in os.walk(path):
+                    files.extend(os.path.join(root, name) for name in sorted(fnmatch.filter(names, pattern)))
+            else:
+                files.append(path)
+
+        known = dict((row['path'], (row['mtime'], row['size']))
+                     for row in self._db.execute("SELECT path, mtime, size FROM prr"))
+        counts = {'added': 0, 'unchanged': 0, 'skipped': 0, 'removed': 0}
+        with self._db:
+            for fn in files:
+                try:
+                    st = os.stat(fn)
+                except OSError: # Missing; pruned below
+                    continue
+                if known.get(fn) == (st.st_mtime, st.st_size):
+                    counts['unchanged'] += 1
+                    continue
+                header = readHeader(fn)
+                if header is None:
+                    if fn in known: # No longer a PRR file
+                        self._db.execute("DELETE FROM prr WHERE path = ?", (fn,))
+                        counts['removed'] += 1
+                    counts['skipped'] += 1
+                    continue
+                header.update({'path': fn, 'mtime': st.st_mtime, 'size': st.st_size})
+                self._db.execute("INSERT OR REPLACE INTO prr (" + ", ".join(_NAMES) + ") VALUES ("
+                                 + ", ".join("?" * len(_NAMES)) + ")", [header[k] for k in _NAMES])
+                counts['added'] += 1
+
+            if prune:
+                scanned = set(files)
+                for fn in known:
+                    inside = fn in scanned or any(fn.startswith(folder + os.sep) for folder in folders)
+                    if inside and not os.path.isfile(fn):
+                        self._db.execute("DELETE FROM prr WHERE path = ?", (fn,))
+                        counts['removed'] += 1
+        return counts
+
+    def records(self, **conditions):
+        """
+        Catalog entries (list of dicts, ordered by path) matching all conditions
+        Inputs:
+            conditions: column=value for an exact match, column=(low, high) for
+                        low <= value <= high (None for an open end), or
+                        shape=(ny, nx). Columns: path, version, s2r_cm, s2d_cm, Ep_MeV,
+                        bin_um, ny, nx, sparse, dtype, mask
+        """
+        if 'shape' in conditions:
+            conditions['ny'], conditions['nx'] = conditions.pop('shape')
+        clauses, args = [], []
+        for k, val in sorted(conditions.items()):
+            if k not in _NAMES:
+                raise(Exception("Catalog has no column '" + str(k) + "'; options are shape, " + ", ".join(_NAMES)))
+            if isinstance(val, (tuple, list)):
+                low, high = val
+                if low is not None:
+                    clauses.append(k + " >= ?")
+                    args.append(low)
+                if high is not None:
+                    clauses.append(k + " <= ?")
+                    args.append(high)
+            elif val is None:
+                clauses.append(k + " IS NULL")
+            else:
+                clauses.append(k + " = ?")
+                args.append(val)
+        sql = "SELECT * FROM prr" + (" WHERE " + " AND ".join(clauses) if clauses else "") + " ORDER BY path"
+        return [dict(zip(row.keys(), row)) for row in self._db.execute(sql, args)]
+
+    def query(self, **conditions):
+        """
+        prad objects (metadata only) of the catalogued PRR files matching all conditions (see records)
+        Each has its filename, rtype 'prr' and metadata set; call read() to load its flux maps.
+        """
+        from .reader import prad # Late import: scan() and records() need no NumPy or matplotlib
+        out = []
+        for rec in self.records(**conditions):
+            pr = prad(rec['path'])
+            pr.rtype = 'prr'
+            for k in _META_FIELDS:
+                setattr(pr, k, rec[k])
+            out.append(pr)
+        return out
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+client.py: Client for the pradreader conversion server (see server.py)
+
+Requests and responses are single lines of JSON over a Unix socket (or a
+localhost TCP port, for addresses of the form 'host:port'). This module imports
+nothing heavy (no NumPy, pandas or matplotlib) until a loaded radiograph is
+attached, so short-lived tools talking to a running server start quickly.
+
+The server reads and writes files as its own user, so only that user may talk
+to it: the Unix socket is private to the user, and over TCP (which any local
+user can reach) every request carries the server's token, which the server
+writes to a file only its user can read (see tokenFile).
+
+Usage:
+    from pradreader.client import pradclient
+    c = pradclient()
+    c.convert('run/lasslab_ProtonDetectorFile01_2.200E-09', 'flash4', bin_um=320, out='run/dump01_prr.txt')
+    pr, hid = c.load('rad1.csv', 'csv') # Flux maps in shared memory, no copy
+    ...
+    c.release(hid) # Let the server free the shared memory
+"""
+
+import os
+import json
+import socket
+
+def defaultAddress():
+    """ Server address used when none is given: $PRADREADER_SERVER, or a socket in ~/.cache/pradreader """
+    return os.environ.get('PRADREADER_SERVER') or os.path.join(os.path.expanduser('~'), '.cache', 'pradreader', 'server.sock')
+
+LOCAL_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+def parseAddress(address):
+    """ (family, address) of a server address: a Unix socket path, or 'host:port' for TCP on a local host """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in address:
+        host = host.strip('[]') or '127.0.0.1'
+        if host not in LOCAL_HOSTS: # The protocol has no encryption; keep it on this machine
+            raise(Exception("pradreader server address '" + address + "' is not local; use one of "
+                            + ", ".join(LOCAL_HOSTS)))
+        return (socket.AF_INET6 if host == '::1' else socket.AF_INET), (host, int(port))
+    return socket.AF_UNIX, address
+
+def tokenFile(address):
+    """ File holding the token of the TCP server at 'address' (readable only by the server's user) """
+    port = parseAddress(address)[1][1]
+    return os.path.join(os.path.expanduser('~'), '.cache', 'pradreader', 'server-' + str(port) + '.token')
+
+def readToken(address):
+    """ Token for requests to a TCP server: $PRADREADER_TOKEN, or its tokenFile() (None for Unix sockets) """
+    if parseAddress(address)[0] == socket.AF_UNIX:
+        return None
+    if os.environ.get('PRADREADER_TOKEN'):
+        return os.environ['PRADREADER_TOKEN']
+    try:
+        with open(tokenFile(address)) as f:
+            return f.read().strip()
+    except IOError:
+        raise(Exception("No token for the pradreader server at '" + address + "' (" + tokenFile(address)
+                        + " is not readable); set PRADREADER_TOKEN"))
+
+class pradclient(object):
+    """
+    Connection to a running pradreader server.
+
+    Inputs:
+        address: String, Unix socket path or 'host:port' (default: defaultAddress())
+        timeout: Float, seconds to wait for a response (None: wait as long as needed)
+    """
+    def __init__(self, address=None, timeout=None):
+        self.address = address or defaultAddress()
+        family, addr = parseAddress(self.address)
+        self._token = readToken(self.address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(addr)
+        self._file = self._sock.makefile('rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Close the connection (the server keeps running) """
+        self._file.close()
+        self._sock.close()
+
+    def request(self, op, **params):
+        """ Send one request and return the response (dict); raises Exception if the server reports an error """
+        params['op'] = op
+        if self._token is not None:
+            params['token'] = self._token
+        self._sock.sendall((json.dumps(params) + '\n').encode('utf-8'))
+        line = self._file.readline()
+        if not line:
+            raise(Exception("Connection to pradreader server at '" + self.address + "' closed"))
+        response = json.loads(line.decode('utf-8'))
+        if not response.get('ok'):
+            raise(Exception("pradreader server: " + str(response.get('error'))))
+        return response
+
+    def ping(self):
+        """ Server status (dict with pid, cached results and open handles) """
+        return self.request('ping')
+
+    def convert(self, filename, rtype, out=None, **params):
+        """ Have the server read a file and write it as a PRR file; returns the PRR filename
+        Inputs:
+            filename: String, file to read
+            rtype: String, file format ('prr', 'carlo', 'mitcsv', 'csv', 'flash4')
+            out: String, PRR filename to write, in the same folder as the input file
+                        (default: filename + '_prr.txt')
+            params: Other read parameters (bin_um, s2r_cm, s2d_cm, Ep_MeV, sparse, roi, reference, ...)
+        """
+        return self.request('convert', file=os.path.abspath(filename), rtype=rtype,
+                            out=None if out is None else os.path.abspath(out), **params)['output']
+
+    def load(self, filename, rtype, backend='shm', **params):
+        """ Have the server read a file and hand its flux maps over through shared memory
+        Inputs: as convert(), plus backend ('shm' or 'mmap'; see shmem.py)
+        Outputs:
+            pr: prad object whose flux maps are read-only views of the shared memory
+            hid: String, handle id; call release(hid) when done with pr
+        """
+        response = self.request('load', file=os.path.abspath(filename), rtype=rtype, backend=backend, **params)
+        from .shmem import attach # Late import: only loading needs NumPy
+        return attach(response['handle']), response['id']
+
+    def release(self, hid):
+        """ Tell the server to free the shared memory of a loaded radiograph """
+        self.request('release', id=hid)
+
+    def shutdown(self):
+        """ Stop the server """
+        self.request('shutdown')
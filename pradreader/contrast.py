@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+contrast.py: Fluence contrast maps, (flux2D - flux2D_ref) / flux2D_ref
+
+The contrast is computed in bands of rows, each written once into the output
+array (no full-size temporaries), and the statistics of the valid pixels (min,
+max, mean and percentiles) are gathered in the same pass. Pixels where the
+reference flux is not positive (e.g. outside the FLASH4 beam), where the flux is
+not finite, or that are outside the mask, are NaN in the map and left out of
+the statistics, rather than dividing by zero.
+
+prad.contrast() keeps the result on the prad object, so plots and
+reconstructions reuse it until the flux maps or mask are replaced.
+"""
+
+import numpy as np
+from .mask import fluxmask
+
+def contrastMap(flux2D, flux2D_ref, mask=None, percentiles=(1, 50, 99), chunk_rows=256, dtype=None):
+    """
+    Fluence contrast map and its statistics, in one pass
+    Inputs:
+        flux2D: 2D NumPy array of proton flux (counts/bin)
+        flux2D_ref: 2D NumPy array of reference proton flux (counts/bin), same shape
+        mask: fluxmask object or 2D boolean array of the pixels to use, or None for all
+        percentiles: Sequence of percentiles (0 to 100) of the contrast to report
+        chunk_rows: Integer, number of rows computed at a time
+        dtype: NumPy float dtype of the map (default: that of the flux arrays)
+    Outputs:
+        contrast: 2D NumPy array, (flux2D - flux2D_ref) / flux2D_ref; NaN at unused pixels
+        stats: dict with 'pixels' (number of valid pixels), 'min', 'max', 'mean', and
+                'percentiles' (dict of percentile => value); NaN if no pixel is valid
+    """
+    flux2D = np.asarray(flux2D)
+    flux2D_ref = np.asarray(flux2D_ref)
+    if flux2D.shape != flux2D_ref.shape:
+        raise(ValueError("Flux shape " + str(flux2D.shape) + " does not match reference flux shape "
+                         + str(flux2D_ref.shape)))
+    if dtype is None:
+        dtype = np.result_type(flux2D.dtype, flux2D_ref.dtype)
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+    if mask is not None and not isinstance(mask, fluxmask):
+        mask = fluxmask(mask)
+    if mask is not None and mask.shape != flux2D.shape:
+        raise(ValueError("Mask shape " + str(mask.shape) + " does not match flux shape " + str(flux2D.shape)))
+
+    ny = flux2D.shape[0]
+    y0, y1 = (mask.bbox[0], mask.bbox[1]) if mask is not None else (0, ny)
+    out = np.empty(flux2D.shape, dtype=dtype)
+    vals = np.empty(mask.npix if mask is not None else flux2D.size, dtype=dtype) # Valid values, for percentiles
+    n = 0
+    total = 0.0
+    vmin, vmax = np.inf, -np.inf
+    for i in range(0, ny, chunk_rows):
+        j = min(i + chunk_rows, ny)
+        o = out[i:j]
+        if j <= y0 or i >= y1: # No pixel of the mask in these rows
+            o[...] = np.nan
+            continue
+        f, r = flux2D[i:j], flux2D_ref[i:j]
+        valid = (r > 0) & np.isfinite(f)
+        if mask is not None:
+            valid &= mask.bits[i:j]
+        np.subtract(f, r, out=o)
+        np.divide(o, r, out=o, where=valid)
+        np.copyto(o, np.nan, where=~valid)
+        v = o[valid]
+        if v.size:
+            vmin = min(vmin, v.min())
+            vmax = max(vmax, v.max())
+            total += v.sum(dtype=np.float64)
+            vals[n:n + v.size] = v
+            n += v.size
+
+    percentiles = tuple(percentiles)
+    if n:
+        pvals = np.percentile(vals[:n], percentiles, overwrite_input=True) if percentiles else []
+        stats = {'pixels': n, 'min': float(vmin), 'max': float(vmax), 'mean': total / n,
+                 'percentiles': dict(zip(percentiles, [float(p) for p in pvals]))}
+    else:
+        stats = {'pixels': 0, 'min': np.nan, 'max': np.nan, 'mean': np.nan,
+                 'percentiles': dict((p, np.nan) for p in percentiles)}
+    return out, stats
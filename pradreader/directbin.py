@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+directbin.py: Fast column extraction from fixed-width text proton lists
+
+FLASH4 detector files and Carlo's blob.out files are written by Fortran-style
+formatted output, so every data line has the same length and every column sits
+at the same byte positions. Such files can be read in large binary blocks, viewed
+as a 2D byte array (one row per line), and only the needed columns converted to
+floats, in C, without splitting lines in Python.
+
+Readers use iterColumns() to histogram the protons chunk by chunk ("direct-bin"
+mode), never holding the full coordinate arrays. Any irregularity in the file
+(varying line lengths, fields shifted off the layout, unparsable fields) raises
+IrregularFormat, upon which the readers fall back to their standard path.
+"""
+
+import re
+import gzip
+import numpy as np
+from .fluxmap import fluxAccumulator
+
+_BLANK = np.zeros(256, dtype=bool) # Byte values separating fields
+_BLANK[[ord(c) for c in ' \t\r\n']] = True
+
+class IrregularFormat(Exception):
+    """ The file is not a fixed-width text table; use a general-purpose parser instead """
+    pass
+
+def _open(fn):
+    """ (Private) Open a possibly gzipped file for binary reading """
+    if fn.endswith('.gz'):
+        return gzip.open(fn, 'rb')
+    return open(fn, 'rb')
+
+def fixedWidthLayout(lines):
+    """ Find the byte spans of the columns of fixed-width text lines
+    Inputs:
+        lines: List of data lines (bytes, including the trailing newline)
+    Outputs:
+        linelen: Integer, length of every line in bytes (including the newline)
+        spans: List of (start, end) byte positions of each column. Columns are taken
+                as right-aligned: each spans from the end of the previous column.
+    Raises IrregularFormat if the lines differ in length or column positions.
+    """
+    if not lines:
+        raise(IrregularFormat("No data lines"))
+    linelen = len(lines[0])
+    ends = None
+    for line in lines:
+        if len(line) != linelen or not line.endswith(b'\n'):
+            raise(IrregularFormat("Lines differ in length"))
+        lineends = [m.end() for m in re.finditer(br'\S+', line)]
+        if ends is None:
+            ends = lineends
+        elif lineends != ends:
+            raise(IrregularFormat("Columns are not aligned"))
+    starts = [0] + ends[:-1]
+    return linelen, list(zip(starts, ends))
+
+def iterColumns(fn, cols, chunk_lines=2**18, comment=b'#', nsample=64):
+    """ Iterate over blocks of selected columns of a fixed-width text table
+    Inputs:
+        fn: String, filename (may be gzipped, with a '.gz' extension)
+        cols: List of integers, zero-based column numbers to extract (None: all columns)
+        chunk_lines: Integer, number of lines per block
+        comment: Bytes, prefix of header lines to skip at the top of the file
+        nsample: Integer, number of lines used to determine the column layout
+                    (every later block is checked against it)
+    Outputs:
+        Yields 2D float64 NumPy arrays of shape (lines in block, number of columns)
+    Raises IrregularFormat (possibly after some blocks were yielded) if the
+    file turns out not to be a fixed-width table.
+    """
+    with _open(fn) as f:
+        line = f.readline()
+        while line.startswith(comment):
+            line = f.readline()
+        sample = [line] + [f.readline() for _ in range(nsample - 1)]
+        sample = [s for s in sample if s] # File may be shorter than the sample
+        linelen, spans = fixedWidthLayout(sample)
+        try:
+            colspans = spans if cols is None else [spans[c] for c in cols]
+        except IndexError:
+            raise(IrregularFormat("File has only " + str(len(spans)) + " columns"))
+
+        leftover = b''.join(sample)
+        while True:
+            block = leftover + f.read(chunk_lines * linelen)
+            if not block:
+                break
+            nlines = len(block) // linelen
+            if nlines == 0: # Last line without a newline
+                if len(block) == linelen - 1:
+                    block += b'\n'
+                    nlines = 1
+                else:
+                    raise(IrregularFormat("Truncated last line"))
+            leftover = block[nlines * linelen:]
+            yield _parseBlock(block[:nlines * linelen], nlines, linelen, colspans)
+
+def _parseBlock(block, nlines, linelen, colspans):
+    """ (Private) Convert the selected columns of a block of fixed-width lines to floats """
+    arr = np.frombuffer(block, dtype=np.uint8).reshape(nlines, linelen)
+    if np.any(arr[:, -1] != ord('\n')):
+        raise(IrregularFormat("Lines differ in length"))
+    # Each selected field must still be one whole value where the layout says: a blank before it
+    # (except at the line start), a non-blank last byte, and a blank after it. Otherwise a value
+    # shifted off the layout could be read truncated.
+    seps = [start for start, _ in colspans if start > 0] + [end for _, end in colspans]
+    lasts = [end - 1 for _, end in colspans]
+    if not np.all(_BLANK[arr[:, seps]]) or np.any(_BLANK[arr[:, lasts]]):
+        raise(IrregularFormat("Columns are not aligned beyond the first lines"))
+    out = np.empty((nlines, len(colspans)))
+    for j, (start, end) in enumerate(colspans):
+        field = np.ascontiguousarray(arr[:, start:end]).view('S' + str(end - start)).ravel()
+        try:
+            out[:, j] = field.astype(np.float64)
+        except ValueError:
+            raise(IrregularFormat("Unparsable field in column bytes " + str(start) + "-" + str(end)))
+    return out
+
+def directFluxMap(fn, xcol, ycol, width_cm, bin_um, scale=1.0, offset=0.0, chunk_lines=2**18, dtype=np.float64):
+    """ Histogram a fixed-width text proton list straight into a flux map, one block of lines at a time
+    Inputs:
+        fn: String, filename of the proton list (may be gzipped)
+        xcol, ycol: Integers, zero-based columns holding the proton x and y positions
+        width_cm: float, total width of the square detector, in cm
+        bin_um: float, desired bin size for the 2D histogram, in microns
+        scale, offset: Floats; positions in cm are (column value - offset) * scale
+        chunk_lines: Integer, number of lines parsed per block
+        dtype: NumPy float dtype of flux2D (see precision.py)
+    Outputs:
+        flux2D: 2D Histogram of proton flux, in units of protons/bin (as fluxMap)
+        bins_cm: 1D NumPy array of bin edges (same for x and y), in cm
+        nprot: Integer, number of protons in the file
+    Raises IrregularFormat if the file is not a fixed-width table.
+    """
+    acc = fluxAccumulator(width_cm, bin_um)
+    for block in iterColumns(fn, [xcol, ycol], chunk_lines=chunk_lines):
+        if scale == 1.0 and offset == 0.0:
+            acc.add(block[:,0], block[:,1])
+        else:
+            acc.add((block[:,0] - offset) * scale, (block[:,1] - offset) * scale)
+    return acc.flux2D(dtype), acc.bins_cm, acc.nprot
@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+equivalence.py: Harness checking the (faster) read engines against the original readers
+
+Each case reads one input file twice or more: once with the frozen original
+reader for its format (legacy.py, the reference), and once with each engine
+that applies to it: the standard reader (the default prad.read), direct-bin,
+out-of-core, sparse, float32, sidecar, or any function given by the caller.
+Every flux array and metadata field of the results is compared, bit for bit or
+within the engine's relative tolerance, and the read times are reported side by
+side, so a faster mode can be adopted knowing its output matches. For Carlo
+files, rdcarlo.path_parse is also checked against the original line-by-line
+path_parse.
+
+Inputs can be real files or synthetic ones made by generate() (a FLASH4 run, a
+Carlo blob.out, csv and whitespace grids, an MIT csv and a PRR file). Reads
+never use the result cache, and files that reads leave behind (FLASH4 .npz,
+csv .npy sidecars) are removed again unless they existed beforehand.
+
+Usage:
+    from pradreader import equivalence
+    cases = equivalence.generate('/tmp/equiv', nprot=10**6)
+    results = equivalence.runHarness(cases, bin_um=100)
+    print(all(r['ok'] for r in results))
+"""
+
+import os
+import io
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+from .reader import prad
+from .sparse import sparseflux
+from . import legacy
+from . import rdcarlo
+
+# Engines: name => (prad.read parameters, relative tolerance, file types it applies to).
+# 'path_parse' instead checks rdcarlo.path_parse against legacy.path_parse.
+ENGINES = {
+    'standard': ({}, 0.0, ('flash4', 'carlo', 'csv', 'mitcsv', 'prr')),
+    'directbin': ({'directbin': True}, 0.0, ('flash4', 'carlo')),
+    'outofcore': ({'outofcore': True, 'workers': 2}, 0.0, ('flash4', 'carlo')),
+    'sparse': ({'sparse': True}, 0.0, ('flash4', 'carlo', 'csv', 'mitcsv', 'prr')),
+    'float32': ({'dtype': 'float32'}, 2.0**-24, ('flash4', 'carlo', 'csv', 'mitcsv', 'prr')),
+    'sidecar': ({'sidecar': True}, 0.0, ('csv',)),
+    'path_parse': (None, 0.0, ('carlo',)),
+}
+
+_META_FIELDS = ('s2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um')
+_ARRAY_FIELDS = ('flux2D', 'flux2D_ref', 'mask')
+
+def compareArrays(a, b, rtol=0.0):
+    """
+    Compare two arrays (dense, sparseflux or None) value by value
+    Inputs:
+        a: Array from the reference (original) reader
+        b: Array from the engine checked
+        rtol: Float, largest allowed difference relative to |a| (0 for bit-identical)
+    Outputs:
+        result: dict with 'ok', 'equal' (bit-identical values), 'max_abs', 'max_rel',
+                    'mismatches' (number of pixels beyond the tolerance), and 'note'
+    """
+    if a is None or b is None:
+        same = a is None and b is None
+        return {'ok': same, 'equal': same, 'max_abs': 0.0, 'max_rel': 0.0, 'mismatches': 0,
+                'note': '' if same else 'missing in one result'}
+    a = a.todense() if isinstance(a, sparseflux) else np.asarray(a)
+    b = b.todense() if isinstance(b, sparseflux) else np.asarray(b)
+    if a.shape != b.shape:
+        return {'ok': False, 'equal': False, 'max_abs': np.nan, 'max_rel': np.nan, 'mismatches': -1,
+                'note': 'shape ' + str(a.shape) + ' vs ' + str(b.shape)}
+    a64, b64 = a.astype(np.float64), b.astype(np.float64)
+    nan = np.isnan(a64)
+    equal = bool(np.array_equal(nan, np.isnan(b64)) and np.array_equal(a64[~nan], b64[~nan]))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        diff = np.abs(a64 - b64)
+        rel = np.where(a64 != 0, diff / np.abs(a64), np.where(diff > 0, np.inf, 0.0))
+        both = nan & np.isnan(b64) # NaN in both counts as equal
+        diff[both], rel[both] = 0.0, 0.0
+    bad = int(np.count_nonzero(~(rel <= rtol)))
+    note = '' if a.dtype == b.dtype else str(a.dtype) + ' vs ' + str(b.dtype)
+    return {'ok': equal or bad == 0, 'equal': equal,
+            'max_abs': float(np.nanmax(diff)) if diff.size else 0.0,
+            'max_rel': float(np.nanmax(rel)) if rel.size else 0.0,
+            'mismatches': bad, 'note': note}
+
+def comparePrads(a, b, rtol=0.0):
+    """
+    Compare the flux arrays, mask and metadata of two prad objects (reference a, engine b)
+    Outputs:
+        fields: dict of field name => compareArrays-style result
+    """
+    fields = {}
+    for k in _ARRAY_FIELDS: # Flux maps as stored (sparse maps are compared without densifying the prads)
+        fields[k] = compareArrays(a.mask if k == 'mask' else a._stored(k),
+                                  b.mask if k == 'mask' else b._stored(k), rtol)
+    for k in _META_FIELDS:
+        va, vb = getattr(a, k), getattr(b, k)
+        same = va == vb
+        fields[k] = {'ok': same, 'equal': same, 'max_abs': 0.0 if same else np.nan,
+                     'max_rel': 0.0 if same else np.nan, 'mismatches': 0 if same else 1,
+                     'note': '' if same else str(va) + ' vs ' + str(vb)}
+    return fields
+
+@contextmanager
+def _quiet():
+    """ (Private) Silence the readers' progress messages (contextlib.redirect_stdout for Python2&3) """
+    stdout, sys.stdout = sys.stdout, io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+def _leftovers(fn, rtype):
+    """ (Private) Files a read of fn may create next to it """
+    if rtype == 'flash4':
+        return [fn.replace('.gz', '') + '.npz']
+    if rtype == 'csv':
+        return [fn + '.npy']
+    return []
+
+def _read(fn, rtype, bin_um, engine):
+    """ (Private) Read a file with an engine (read parameters dict, or function), quietly; returns (prad, seconds) """
+    with _quiet():
+        t0 = time.time()
+        if callable(engine):
+            pr = engine(fn, rtype, bin_um)
+        else:
+            pr = prad(fn)
+            pr.rtype = rtype
+            pr.bin_um = bin_um
+            pr.read(cache=False, **engine)
+        seconds = time.time() - t0
+    return pr, seconds
+
+def _pathParse(func, fn, bin_um):
+    """ (Private) path_parse results as a dict of arrays, quietly """
+    with _quiet(), np.errstate(invalid='ignore', divide='ignore'): # Empty pixels are NaN
+        Bperp, J, avg_fluence, im_fluence = func(fn, bin_um)
+    return {'Bperp': Bperp, 'J': J, 'avg_fluence': np.array([avg_fluence]), 'im_fluence': np.array([im_fluence])}
+
+def runCase(fn, rtype, bin_um=None, engines=None, repeat=1):
+    """
+    Read one file with the original reader (legacy.read) and with each engine, and compare
+    Inputs:
+        fn: String, input filename
+        rtype: String, file type ('flash4', 'carlo', 'csv', 'mitcsv', 'prr')
+        bin_um: Float, bin size for proton lists (flash4, carlo)
+        engines: dict of name => (read parameters, rtol, file types), or name => function
+                    (filename, rtype, bin_um) returning a prad object (rtol 0); default ENGINES
+        repeat: Integer, number of timed reads per engine (the fastest is reported)
+    Outputs:
+        results: List of dicts, one per engine that applies: 'file', 'rtype', 'engine',
+                    'ok', 'time_reference', 'time_engine' (seconds), and 'fields'
+                    (see comparePrads)
+    """
+    engines = ENGINES if engines is None else engines
+    existed = [path for path in _leftovers(fn, rtype) if os.path.exists(path)]
+    if rtype == 'flash4' and existed:
+        print("Note: '" + existed[0] + "' exists; every engine reads it instead of the FLASH4 text file.")
+
+    def cleanup():
+        for path in _leftovers(fn, rtype):
+            if path not in existed and os.path.exists(path):
+                os.remove(path)
+
+    def timed(engine, warm=False, read=_read):
+        if warm: # E.g. the sidecar engine: the first read writes the sidecar, later reads use it
+            read(fn, rtype, bin_um, engine)
+        best = None
+        for i in range(max(int(repeat), 1)):
+            if not warm:
+                cleanup() # Each read starts from the original file, not what the previous read left
+            pr, seconds = read(fn, rtype, bin_um, engine)
+            best = seconds if best is None else min(best, seconds)
+        return pr, best
+
+    def pathParse(fn, rtype, bin_um, func):
+        t0 = time.time()
+        out = _pathParse(func, fn, bin_um)
+        return out, time.time() - t0
+
+    try:
+        reference, tref = timed(legacy.read)
+        if rtype == 'prr': # The original reader predates PRR masks; take the standard reader's
+            reference.mask = _read(fn, rtype, bin_um, {})[0].mask
+        results = []
+        for name in sorted(engines):
+            spec = engines[name]
+            if callable(spec):
+                engine, rtol = spec, 0.0
+            else:
+                engine, rtol, rtypes = spec
+                if rtype not in rtypes:
+                    continue
+            cleanup()
+            if name == 'path_parse':
+                ref, tpath = timed(legacy.path_parse, read=pathParse)
+                out, seconds = timed(rdcarlo.path_parse, read=pathParse)
+                fields = dict((k, compareArrays(ref[k], out[k], rtol)) for k in ref)
+                results.append({'file': fn, 'rtype': rtype, 'engine': name,
+                                'ok': all(f['ok'] for f in fields.values()),
+                                'time_reference': tpath, 'time_engine': seconds, 'fields': fields})
+                continue
+            pr, seconds = timed(engine, warm=not callable(engine) and bool(engine.get('sidecar')))
+            fields = comparePrads(reference, pr, rtol)
+            results.append({'file': fn, 'rtype': rtype, 'engine': name,
+                            'ok': all(f['ok'] for f in fields.values()),
+                            'time_reference': tref, 'time_engine': seconds, 'fields': fields})
+    finally:
+        cleanup()
+    return results
+
+def runHarness(cases, bin_um=100, engines=None, repeat=1, verbose=True):
+    """
+    Run runCase on several inputs and print a report
+    Inputs:
+        cases: List of (filename, rtype) pairs (e.g. from generate())
+        bin_um, engines, repeat: As in runCase
+        verbose: Boolean, if True, print the report (see report())
+    Outputs:
+        results: List of runCase result dicts, for all cases
+    """
+    results = []
+    for fn, rtype in cases:
+        results.extend(runCase(fn, rtype, bin_um=bin_um, engines=engines, repeat=repeat))
+    if verbose:
+        print(report(results))
+    return results
+
+def report(results):
+    """ Text table of runCase results: timings per engine, and the fields that differ """
+    lines = ["%-34s %-7s %-10s %9s %9s %7s  %s" % ('file', 'rtype', 'engine', 'ref (s)', 'eng (s)',
+                                                   'speedup', 'result')]
+    for r in results:
+        name = os.path.basename(r['file'])
+        speedup = r['time_reference'] / r['time_engine'] if r['time_engine'] > 0 else np.inf
+        if all(f['equal'] for f in r['fields'].values()):
+            status = 'identical'
+        elif r['ok']:
+            status = 'within tolerance (max rel. diff. ' + '%.2g' % max(f['max_rel'] for f in r['fields'].values()) + ')'
+        else:
+            status = 'DIFFERENT: ' + ', '.join(
+                k + (' (' + f['note'] + ')' if f['note'] else ' (' + str(f['mismatches']) + ' pixels, max abs. diff. '
+                     + '%.3g' % f['max_abs'] + ')')
+                for k, f in sorted(r['fields'].items()) if not f['ok'])
+        lines.append("%-34s %-7s %-10s %9.3f %9.3f %6.2fx  %s" % (name[-34:], r['rtype'], r['engine'],
+                                                                 r['time_reference'], r['time_engine'],
+                                                                 speedup, status))
+    nbad = sum(1 for r in results if not r['ok'])
+    lines.append(str(len(results)) + " comparisons, " + str(nbad) + " with differences beyond tolerance.")
+    return '\n'.join(lines)
+
+def generate(folder, nprot=200000, shape=(501, 500), seed=0):
+    """
+    Write synthetic input files of every supported format
+    Inputs:
+        folder: String, output folder (created if not existing)
+        nprot: Integer, number of protons in the FLASH4 and Carlo proton lists
+        shape: Tuple (ny, nx), size of the gridded (csv, mitcsv, prr) flux maps
+        seed: Integer, random seed
+    Outputs:
+        cases: List of (filename, rtype) pairs
+    """
+    try: # Python2&3 equivalent of os.makedirs(folder, exist_ok=True)
+        os.makedirs(folder)
+    except OSError:
+        if not os.path.isdir(folder):
+            raise
+    rng = np.random.RandomState(seed)
+    cases = []
+
+    # FLASH4: detector setup, beam setup and proton list (positions on a 0 to 1 grid)
+    with open(os.path.join(folder, 'equiv_ProtonImagingDetectors.txt'), 'w') as f:
+        f.write("PROTON DETECTOR NR  1\n"
+                "   Detector distance from beam capsule center = 30.0\n"
+                "   Detector square side length (cm) = 4.0\n")
+    with open(os.path.join(folder, 'equiv_ProtonBeamsPrint.txt'), 'w') as f:
+        f.write("PROTON BEAM NR  1\n"
+                "   Proton energy (in MeV) = 14.7\n"
+                "   Distance capsule center --> target center = 1.0\n"
+                "   Beam aperture angle (rad) = 0.1\n"
+                "   Number of protons in beam = " + str(nprot) + "\n")
+    fn = os.path.join(folder, 'equiv_ProtonDetectorFile01_2.200E-09')
+    np.savetxt(fn, np.column_stack([rng.normal(0.5, 0.15, nprot), rng.normal(0.5, 0.15, nprot),
+                                    rng.random_sample(nprot)]), fmt='%20.12E')
+    cases.append((fn, 'flash4'))
+
+    # Carlo: header, then columns with the x/y positions in columns 3 and 4 (some beyond the detector)
+    fn = os.path.join(folder, 'blob.out')
+    dat = rng.normal(0, 1.0, (nprot, 11))
+    with open(fn, 'w') as f:
+        f.write("# Tkin: 14.7\n# rs: 30.0\n# ri: 1.0\n# raperture: 0.1\n# Columns: see Carlo's documentation\n")
+        np.savetxt(f, dat, fmt='%14.6E')
+    cases.append((fn, 'carlo'))
+
+    # Gridded flux maps
+    flux2D = rng.poisson(100, shape) * rng.uniform(0.9, 1.1, shape)
+    fn = os.path.join(folder, 'grid.csv')
+    np.savetxt(fn, flux2D, delimiter=',')
+    cases.append((fn, 'csv'))
+    fn = os.path.join(folder, 'grid_ws.txt')
+    np.savetxt(fn, flux2D, fmt='%.6f')
+    cases.append((fn, 'csv'))
+
+    fn = os.path.join(folder, 'mit.csv')
+    with open(fn, 'w') as f:
+        f.write("MIT CR-39 scan\nDims = " + str(shape[1]) + " x " + str(shape[0]) + "\nPixel = 1.50 um\nx\ny\n")
+        np.savetxt(f, np.round(flux2D), fmt='%d', delimiter=',')
+    cases.append((fn, 'mitcsv'))
+
+    pr = prad(os.path.join(folder, 'grid.prr.txt'))
+    pr.flux2D, pr.flux2D_ref = flux2D, np.full(shape, flux2D.mean())
+    pr.s2r_cm, pr.s2d_cm, pr.Ep_MeV, pr.bin_um = 1.0, 30.0, 14.7, 100.0
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    pr.mask = np.hypot(yy - shape[0] / 2.0, xx - shape[1] / 2.0) < min(shape) / 3.0 # A mask to carry along
+    with _quiet():
+        pr.write(ofile=pr.filename)
+    cases.append((pr.filename, 'prr'))
+    return cases
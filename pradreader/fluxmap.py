@@ -5,24 +5,33 @@ fluxmap.py: Tools for generating and plotting flux maps
 
 Covers:
 * Generating flux maps (2D histograms) from proton x/y lists
+* Generating sparse flux maps (non-zero pixels only) from proton x/y lists
+* Accumulating flux maps from proton x/y lists that arrive in chunks
+* Per-pixel sums, means and variances of per-proton quantities (weighted flux maps)
+* Reusable binning plans (bin edges, centers, reference disks) for repeated detector geometries
 * Plotting flux maps to bitmap using matplotlib
 
 Created by Scott Feister & J.T. Laune on Fri Jul 28 18:11:48 2017
 """
 
+import threading
+from collections import OrderedDict
 import numpy as np
 import matplotlib
 matplotlib.use('Agg') # Headless plotting (avoids python-tk GUI requirement)
                       # Note: throws warning if another matplotlib engine is already initialized
 import matplotlib.pyplot as plt # For flux map plots
+from .sparse import sparseflux
+from .contrast import contrastMap
 
-def fluxMap(xp_cm, yp_cm, width_cm, bin_um):
+def fluxMap(xp_cm, yp_cm, width_cm, bin_um, dtype=np.float64):
     """ Make flux map from a list of proton x,y positions
     Inputs:
         xp_cm: 1D NumPy array of proton x positions on detector (center of detector is x = 0)
         yp_cm: 1D NumPy array of proton y positions on detector (center of detector is y = 0)
         width_cm: float, total width of the square detector, in cm
         bin_um: float, desired bin size for the 2D histogram, in microns
+        dtype: NumPy float dtype of the output arrays (see precision.py)
     Outputs:
         flux2D: 2D Histogram of proton flux, in units of protons/bin
         flux2D_cm2: 2D Histogram of proton flux, in units of protons/cm2
@@ -32,10 +41,10 @@ def fluxMap(xp_cm, yp_cm, width_cm, bin_um):
     Written by Scott Feister 2017-08-03
     """
     
-    bins_cm = np.arange(-width_cm/2, width_cm/2, bin_um*1e-4) # 1D array of bin edges, in centimetres
+    bins_cm = getPlan(width_cm, bin_um).bins_cm # 1D array of bin edges, in centimetres
     H, xedges_cm, yedges_cm = np.histogram2d(xp_cm, yp_cm, bins=bins_cm) # Histogram the x/y data
 
-    flux2D = H.T # Perform a transpose (flip x/y axis) on the histogram so that it is in 'xy' indexing rather than 'ij' indexing
+    flux2D = H.T.astype(dtype, copy=False) # Perform a transpose (flip x/y axis) on the histogram so that it is in 'xy' indexing rather than 'ij' indexing
     
     # Convert H to proton fluence (protons/cm2)
     bin_cm2 = (bin_um*1e-4)**2 # Area of each bin
@@ -43,6 +52,228 @@ def fluxMap(xp_cm, yp_cm, width_cm, bin_um):
     
     return flux2D, flux2D_cm2, xedges_cm, yedges_cm
 
+def _binIndex(p_cm, edges_cm):
+    """ (Private) Bin number of each position, with the same edge conventions as np.histogram2d
+    Inputs:
+        p_cm: 1D NumPy array of proton positions along one axis
+        edges_cm: 1D NumPy array of monotonically increasing bin edges
+    Outputs:
+        ix: 1D NumPy integer array of bin numbers; -1 or len(edges_cm)-1 for positions outside the edges
+    
+    Bins are half-open [left, right), except the last bin, which also includes its right edge.
+    """
+    ix = np.searchsorted(edges_cm, p_cm, side='right') - 1
+    ix[p_cm == edges_cm[-1]] -= 1 # Right-most edge belongs to the last bin
+    return ix
+
+class binplan(object):
+    """
+    Precomputed binning of a square detector: bin edges and centers, plus memoized
+    reference disks. Get plans through getPlan(), which keeps recently used ones
+    (within PLAN_CACHE_SIZE plans and PLAN_CACHE_BYTES), so reading many dumps with
+    the same detector and bin size sets them up once. Plans are shared between threads.
+
+    Inputs:
+        width_cm: float, total width of the square detector, in cm
+        bin_um: float, desired bin size for the 2D histogram, in microns
+
+    Attributes (read-only arrays):
+        bins_cm: 1D NumPy array of bin edges (same for x and y), in cm
+        nbins: Integer, number of bins along each axis
+        centers_cm: 1D NumPy array of bin centers, in cm
+    """
+    def __init__(self, width_cm, bin_um):
+        self.width_cm = width_cm
+        self.bin_um = bin_um
+        self.bins_cm = np.arange(-width_cm/2, width_cm/2, bin_um*1e-4) # 1D array of bin edges, in centimetres
+        self.nbins = len(self.bins_cm) - 1
+        self.centers_cm = (self.bins_cm[:-1] + self.bins_cm[1:]) / 2.0
+        for arr in (self.bins_cm, self.centers_cm):
+            arr.setflags(write=False) # Shared between all users of the plan
+        self._disks = OrderedDict() # radius_cm => flat indices of bins inside that radius (guarded by _planLock)
+
+    def index(self, xp_cm, yp_cm):
+        """ Row-major bin numbers of the protons on the detector, with np.histogram2d edge conventions
+        Inputs:
+            xp_cm, yp_cm: 1D NumPy arrays of proton x, y positions, in cm
+        Outputs:
+            flat: 1D NumPy integer array, iy * nbins + ix for each proton inside the detector
+            inside: 1D NumPy boolean array, which protons are inside the detector
+        """
+        ix = _binIndex(np.asarray(xp_cm), self.bins_cm)
+        iy = _binIndex(np.asarray(yp_cm), self.bins_cm)
+        inside = (ix >= 0) & (ix < self.nbins) & (iy >= 0) & (iy < self.nbins)
+        return iy[inside] * self.nbins + ix[inside], inside
+
+    @property
+    def nbytes(self):
+        """ Memory held by the plan, in bytes """
+        with _planLock:
+            disks = list(self._disks.values())
+        return self.bins_cm.nbytes + self.centers_cm.nbytes + sum(index.nbytes for index in disks)
+
+    def disk(self, radius_cm):
+        """ Flat (row-major) indices of the bins whose centers lie within radius_cm of the detector center """
+        with _planLock:
+            index = self._disks.pop(radius_cm, None)
+            if index is not None:
+                self._disks[radius_cm] = index # (Re-)insert as most recently used
+                return index
+
+        # Distance of each bin center from the detector center, a band of rows at a time
+        c2 = self.centers_cm**2
+        band = max(1, 2**20 // max(self.nbins, 1))
+        index = np.concatenate([np.flatnonzero(np.sqrt(c2[np.newaxis, :] + c2[j:j + band, np.newaxis]) < radius_cm)
+                                + j * self.nbins for j in range(0, self.nbins, band)] or [np.zeros(0, dtype=np.intp)])
+        index.setflags(write=False)
+
+        with _planLock:
+            self._disks[radius_cm] = index
+            while len(self._disks) > 4: # A run rarely has more than one beam geometry
+                self._disks.popitem(last=False)
+        _trimPlans()
+        return index
+
+PLAN_CACHE_SIZE = 16 # Number of binning plans kept by getPlan()
+PLAN_CACHE_BYTES = 2**28 # Memory kept by cached plans (their reference disks, mostly)
+_plans = OrderedDict() # (width_cm, bin_um) => binplan, least recently used first
+_planLock = threading.Lock() # Guards _plans and the plans' disks (readers run on pool threads)
+
+def getPlan(width_cm, bin_um):
+    """ Binning plan for a detector width and bin size, reused from a small LRU cache when possible """
+    key = (float(width_cm), float(bin_um))
+    with _planLock:
+        plan = _plans.pop(key, None)
+        if plan is None:
+            plan = binplan(width_cm, bin_um)
+        _plans[key] = plan # (Re-)insert as most recently used
+    _trimPlans()
+    return plan
+
+def _trimPlans():
+    """ (Private) Drop the least recently used plans beyond PLAN_CACHE_SIZE or PLAN_CACHE_BYTES
+    (plans already handed out stay usable; they are just not reused) """
+    with _planLock:
+        plans = list(_plans.items())
+    sizes = [(key, plan.nbytes) for key, plan in plans]
+    total = sum(n for _, n in sizes)
+    drop = []
+    for key, n in sizes:
+        if len(sizes) - len(drop) <= PLAN_CACHE_SIZE and total <= PLAN_CACHE_BYTES:
+            break
+        drop.append(key)
+        total -= n
+    with _planLock:
+        for key in drop:
+            _plans.pop(key, None)
+
+def fluxMapSparse(xp_cm, yp_cm, width_cm, bin_um, dtype=np.float64):
+    """ Make a sparse flux map from a list of proton x,y positions, without allocating the dense histogram
+    Inputs:
+        xp_cm: 1D NumPy array of proton x positions on detector (center of detector is x = 0)
+        yp_cm: 1D NumPy array of proton y positions on detector (center of detector is y = 0)
+        width_cm: float, total width of the square detector, in cm
+        bin_um: float, desired bin size for the 2D histogram, in microns
+        dtype: NumPy float dtype of the flux values (see precision.py)
+    Outputs:
+        flux2D: sparseflux object, proton flux in units of protons/bin (only non-zero bins are stored)
+        xedges_cm, yedges_cm: 1D NumPy arrays of bin edges, in cm
+
+    Bins exactly as fluxMap does, so flux2D.todense() equals the flux2D returned by fluxMap.
+    """
+    plan = getPlan(width_cm, bin_um)
+    nbins = plan.nbins
+    flat, inside = plan.index(xp_cm, yp_cm) # Row-major index into the 'xy'-indexed (ny, nx) array
+    index, counts = np.unique(flat, return_counts=True)
+    flux2D = sparseflux((nbins, nbins), index, counts.astype(dtype))
+
+    return flux2D, plan.bins_cm, plan.bins_cm
+
+def binStats(index, nbins, weights=None):
+    """ Per-bin proton counts and statistics of per-proton quantities, from precomputed bin numbers
+    Inputs:
+        index: 1D NumPy integer array, bin number (0 to nbins-1) of each proton
+        nbins: Integer, total number of bins
+        weights: dict of name => 1D NumPy array of a per-proton quantity (same length as index)
+    Outputs:
+        counts: 1D NumPy float array, number of protons in each bin
+        stats: dict of name => dict with 1D NumPy arrays 'sum', 'mean' and 'var' (population variance)
+                of that quantity in each bin; 'mean' and 'var' are NaN in empty bins
+
+    Each statistic is a single np.bincount over all protons, so any number of quantities
+    costs one pass each rather than a Python loop over protons.
+    """
+    index = np.asarray(index)
+    counts = np.bincount(index, minlength=nbins).astype(np.float64)
+    stats = {}
+    with np.errstate(invalid='ignore', divide='ignore'): # Empty bins give NaN
+        for name, w in (weights or {}).items():
+            w = np.asarray(w, dtype=np.float64)
+            total = np.bincount(index, weights=w, minlength=nbins)
+            mean = total / counts
+            dev = w - mean[index] # Two-pass variance; sum of squares minus squared sum loses precision
+            var = np.bincount(index, weights=dev * dev, minlength=nbins) / counts
+            stats[name] = {'sum': total, 'mean': mean, 'var': var}
+    return counts, stats
+
+def fluxMapStats(xp_cm, yp_cm, width_cm, bin_um, weights=None):
+    """ Make a flux map and per-pixel statistics of per-proton quantities from a list of proton x,y positions
+    Inputs:
+        xp_cm: 1D NumPy array of proton x positions on detector (center of detector is x = 0)
+        yp_cm: 1D NumPy array of proton y positions on detector (center of detector is y = 0)
+        width_cm: float, total width of the square detector, in cm
+        bin_um: float, desired bin size for the 2D histogram, in microns
+        weights: dict of name => 1D NumPy array of a per-proton quantity (e.g. path-integrated B field)
+    Outputs:
+        flux2D: 2D Histogram of proton flux, in units of protons/bin (equal to that of fluxMap)
+        stats: dict of name => dict with 2D arrays 'sum', 'mean' and 'var' of that quantity in each pixel
+        xedges_cm, yedges_cm: 1D NumPy arrays of bin edges, in cm
+
+    Outputs 2D arrays with 'xy' indexing (axis 0 is y axis, axis 1 is x axis), not 'ij'
+    """
+    plan = getPlan(width_cm, bin_um)
+    nbins = plan.nbins
+    flat, inside = plan.index(xp_cm, yp_cm) # Row-major index into the 'xy'-indexed (ny, nx) array
+
+    weights = dict((name, np.asarray(w)[inside]) for name, w in (weights or {}).items())
+    counts, stats = binStats(flat, nbins**2, weights)
+    for name in stats:
+        for k in stats[name]:
+            stats[name][k] = stats[name][k].reshape(nbins, nbins)
+
+    return counts.reshape(nbins, nbins), stats, plan.bins_cm, plan.bins_cm
+
+class fluxAccumulator(object):
+    """ Flux map built up from chunks of proton x,y positions, so the full proton list never has to be in memory
+    Inputs:
+        width_cm: float, total width of the square detector, in cm
+        bin_um: float, desired bin size for the 2D histogram, in microns
+
+    Bins exactly as fluxMap does; after adding all chunks, flux2D() equals the flux2D returned by fluxMap.
+
+    Example:
+        acc = fluxAccumulator(width_cm, bin_um)
+        for xp_cm, yp_cm in chunks:
+            acc.add(xp_cm, yp_cm)
+        flux2D = acc.flux2D()
+    """
+    def __init__(self, width_cm, bin_um):
+        self.plan = getPlan(width_cm, bin_um)
+        self.bins_cm = self.plan.bins_cm # 1D array of bin edges, in centimetres
+        self.nbins = self.plan.nbins
+        self.counts = np.zeros(self.nbins**2, dtype=np.int64) # Flattened, row-major 'xy' histogram
+        self.nprot = 0 # Number of protons added (inside or outside the detector)
+
+    def add(self, xp_cm, yp_cm):
+        """ Add a chunk of proton x,y positions (1D NumPy arrays, in cm) to the flux map """
+        flat, inside = self.plan.index(xp_cm, yp_cm)
+        self.counts += np.bincount(flat, minlength=self.nbins**2)
+        self.nprot += inside.size
+
+    def flux2D(self, dtype=np.float64):
+        """ 2D Histogram of proton flux so far, in units of protons/bin ('xy' indexing), as a 'dtype' array """
+        return self.counts.reshape(self.nbins, self.nbins).astype(dtype)
+
 def fluxPlot(outfn, flux2D, bin_um):
     """ Example plotting function for a radiograph, using matplotlib
     Inputs:
@@ -85,7 +316,7 @@ def fluxPlot(outfn, flux2D, bin_um):
     plt.close(fig)
     return
 
-def fluenceContrast(outfn, flux2D, flux2D_ref, bin_um, vmin=None, vmax=None, cmap='viridis'):
+def fluenceContrast(outfn, flux2D, flux2D_ref, bin_um, vmin=None, vmax=None, cmap='viridis', contrast=None):
     """ Example plotting function for a radiograph, using matplotlib
     Inputs:
         outfn: String, full filename (including path) of the image file to write, e.g. "/home/myouts/myradiograph.png"
@@ -94,8 +325,11 @@ def fluenceContrast(outfn, flux2D, flux2D_ref, bin_um, vmin=None, vmax=None, cma
         bin_um: Float, size of the square edge lengths with which to divide the detector for binning
         vmin, vmax: Max and min for the colorplot
         cmap: Colormap for colorplot
+        contrast: Tuple (map, stats), contrast already computed by contrast.contrastMap
+                    (e.g. from prad.contrast()); flux2D and flux2D_ref are then not used
     Outputs:
         Saves a fluence contrast map plot  [ (flux - flux_ref) / flux_ref ] to the specified input file.
+        Pixels with no positive reference flux are left blank.
     
     Assume 'xy' indexing (axis 0 is y axis, axis 1 is x axis), not 'ij'
     
@@ -104,15 +338,17 @@ def fluenceContrast(outfn, flux2D, flux2D_ref, bin_um, vmin=None, vmax=None, cma
     fig = plt.figure(figsize=(6,5))
     ax = fig.add_subplot(111)
     
-    xmax = (flux2D.shape[1] + 1) * bin_um*1.0e-4 # X/ length of detector in cm
-    ymax = (flux2D.shape[0] + 1) * bin_um*1.0e-4 # Y/ width of detector in cm
+    if contrast is None:
+        contrast = contrastMap(flux2D, flux2D_ref, percentiles=())
+    fluence_contrast, stats = contrast
+
+    xmax = (fluence_contrast.shape[1] + 1) * bin_um*1.0e-4 # X/ length of detector in cm
+    ymax = (fluence_contrast.shape[0] + 1) * bin_um*1.0e-4 # Y/ width of detector in cm
 
-    fluence_contrast = (flux2D - flux2D_ref) / flux2D_ref
-    
     if vmin is None:
-        vmin = np.min(fluence_contrast)
+        vmin = stats['min']
     if vmax is None:
-        vmax = np.max(fluence_contrast)
+        vmax = stats['max']
         
     cax = ax.pcolorfast([0, xmax], [0, ymax], fluence_contrast, cmap=cmap, vmin=vmin, vmax=vmax)
     cbar = fig.colorbar(cax, label='Fluence contrast (unitless)')
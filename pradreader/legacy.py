@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+legacy.py: Frozen copies of the original (pre-optimization) readers
+
+The readers in rdflash.py, rdcarlo.py, rdmit.py, rdgeneric.py, fluxmap.py and
+reader.py have since been rewritten for speed (vectorized binning, direct-bin
+parsing, sparse maps, chunked PRR reads, ...). The functions here are the
+originals, kept unchanged apart from Python 3 / pandas API updates and not
+writing .npz files, so that equivalence.py can check every engine against the
+results the package gave before any of that work, not against its own current
+code. Do not optimize them.
+
+The FLASH4 metadata parsers (rdflash.detParse, rdflash.beamParse) are shared, as
+they have not changed.
+"""
+
+import os
+import re
+import csv
+import math
+import numpy as np
+import pandas as pd
+from .rdflash import detParse, beamParse
+
+def fluxMap(xp_cm, yp_cm, width_cm, bin_um):
+    """ Original fluxMap: histogram2d on np.arange bin edges
+    Outputs:
+        flux2D, flux2D_cm2, xedges_cm, yedges_cm
+    """
+    bins_cm = np.arange(-width_cm/2, width_cm/2, bin_um*1e-4) # 1D array of bin edges, in centimetres
+    H, xedges_cm, yedges_cm = np.histogram2d(xp_cm, yp_cm, bins=bins_cm) # Histogram the x/y data
+    flux2D = H.T # 'xy' indexing
+    bin_cm2 = (bin_um*1e-4)**2 # Area of each bin
+    flux2D_cm2 = flux2D / bin_cm2
+    return flux2D, flux2D_cm2, xedges_cm, yedges_cm
+
+def readFlash4(fn, bin_um = 320):
+    """ Original readFlash4 (without saving an .npz file for next time)
+    Outputs:
+        s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref
+    """
+    if os.path.isfile(fn.replace('.gz', '') + '.npz'):
+        fn = fn.replace('.gz', '') + '.npz'
+
+    folder, name = os.path.split(fn)
+    p = re.compile(r'^(\w*?)ProtonDetectorFile([0-9]+)_(\S*?)(\.[npgz]*?){0,1}$')
+    m = p.findall(name)
+    if not m:
+        raise(Exception("Input filename does not match the known '[basename]ProtonDetectorFile[number]_[time] (+ optional .gz or .npz) pattern."))
+    basenm = m[0][0]
+    detnum = int(m[0][1])
+    ext = m[0][3]
+
+    _, s2d_cm, width_cm = detParse(folder, basenm, detnum)
+    _, Ep_MeV, s2r_cm, ap_deg, nprot = beamParse(folder, basenm, detnum)
+
+    if ext == '' or ext == '.gz':
+        dat = np.genfromtxt(fn)
+    elif ext == '.npz':
+        with np.load(fn) as data:
+            dat = data['dat']
+    else:
+        raise(Exception("Filename extension not recognized as blank, '.gz', or '.npz'"))
+
+    [xp_cm, yp_cm] = (dat[:,(0,1)].T - 0.5) * width_cm # From 0 to 1 grid into -x to +x centimeters
+    flux2D, flux2D_cm2, xedges_cm, yedges_cm = fluxMap(xp_cm, yp_cm, width_cm, bin_um)
+
+    # Reference: undeflected cone (small angle approximation)
+    protrad_cm = s2d_cm * np.tan(np.deg2rad(ap_deg/2.0))
+    prot_cm2 = nprot / (np.pi * protrad_cm**2)
+    prot_bin = prot_cm2 * (bin_um * 1.0e-4)**2
+    X, Y = np.meshgrid((xedges_cm[:-1] + xedges_cm[1:]) / 2.0, (yedges_cm[:-1] + yedges_cm[1:]) / 2.0)
+    R = np.sqrt(X**2 + Y**2)
+    flux2D_ref = np.zeros(flux2D.shape)
+    flux2D_ref[R < protrad_cm] = prot_bin
+
+    return s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref
+
+def _carloHeader(fname, bin_um):
+    """ (Private) Original blob.out header parsing and detector geometry """
+    fd = open(fname, 'r')
+    line = fd.readline()
+    while not re.match('# Columns:', line):
+        if re.search('^# Tkin:', line):
+            Ep_MeV = float(line.split()[2])
+        if re.match('# rs:', line):
+            s2d_cm = float(line.split()[2])
+        if re.match('# ri:', line):
+            s2r_cm = float(line.split()[2])
+        if re.match('# raperture:', line):
+            rap = float(line.split()[2])
+        line = fd.readline()
+    while re.match('#', line): line = fd.readline()
+
+    radius = rap * s2d_cm / s2r_cm  # radius of undeflected image of aperture at screen
+    dmax = 0.98 * radius / math.sqrt(2.0) # half the width of the detector
+    nbins = int(dmax * 2 / (bin_um/10000.0)) # number of bins per dimensions
+    delta = 2.0 * dmax / nbins # width of a bin
+    return fd, line, s2r_cm, s2d_cm, Ep_MeV, radius, dmax, nbins, delta
+
+def readCarlo(fname, bin_um = 320):
+    """ Original readCarlo, including its clipping of out-of-range bin numbers
+    Outputs:
+        s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref
+    """
+    fd, line, s2r_cm, s2d_cm, Ep_MeV, radius, dmax, nbins, delta = _carloHeader(fname, bin_um)
+    fd.close()
+
+    coord_xy = pd.read_csv(fname, header=None, sep=r'\s+', comment='#', usecols=[3,4]).values
+
+    num_prot = coord_xy.shape[0]
+    coord_ij = np.zeros(coord_xy.shape)
+    coord_ij[:,0] = ((coord_xy[:,0] +(dmax))/(bin_um*1e-4)).astype(int)
+    coord_ij[:,1] = ((coord_xy[:,1] +(dmax))/(bin_um*1e-4)).astype(int)
+
+    coord_xy = coord_xy[~((coord_ij > nbins).any(axis=1))]
+    coord_ij = coord_ij[~((coord_ij > nbins).any(axis=1))]
+    coord_xy = coord_xy[~((coord_ij < 0).any(axis=1))]
+
+    mean = (num_prot * delta**2) / (math.pi * radius**2) # average fluence distrubution
+    flux2D_ref = np.zeros((nbins,nbins))
+    flux2D_ref[:] = mean
+
+    flux2D, flux2D_cm2, xedges_cm, yedges_cm = fluxMap(coord_xy[:,0], coord_xy[:,1], (dmax * 2), bin_um)
+
+    return s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref
+
+def path_parse(fname, bin_um = 320):
+    """ Original path_parse: one blob.out line at a time, then a per-pixel division loop
+    (pixels without protons come out NaN, with a NumPy warning)
+    Outputs:
+        Bperp, J, avg_fluence, im_fluence
+    """
+    fd, line, s2r_cm, s2d_cm, Ep_MeV, radius, dmax, nbins, delta = _carloHeader(fname, bin_um)
+
+    flux = np.zeros((nbins,nbins)) # num. of protons per bin
+    Bperp = np.zeros((nbins,nbins,2)) # B Path Integral
+    J = np.zeros((nbins,nbins)) # Current Path Integral
+
+    nprot = 0
+    while line:
+        nprot +=  1
+        xx= float(line.split()[3])
+        yy= float(line.split()[4])
+        jj = float(line.split()[8])
+        b0 = float(line.split()[9])
+        b1 = float(line.split()[10])
+        i = int((xx + dmax)/delta)
+        j = int((yy + dmax)/delta)
+
+        if (xx + dmax)/delta >= 0 and i < nbins and (yy + dmax)/delta >= 0 and j < nbins:
+            flux[i,j] += 1
+            Bperp[i,j,0] += b0
+            Bperp[i,j,1] += b1
+            J[i,j] += jj
+
+        line = fd.readline()
+    fd.close()
+
+    avg_fluence = nprot / (math.pi * radius**2)
+    im_fluence = flux.sum() / (4 * dmax**2)
+
+    for i in range(nbins):
+        for j in range(nbins):
+            Bperp[i,j,:] /= flux[i,j]
+            J[i,j] /= flux[i,j]
+
+    return Bperp, J, avg_fluence, im_fluence
+
+def readmitcsv(fn):
+    """ Original readmitcsv: csv.reader, one value at a time
+    Outputs:
+        flux2D, flux2D_ref, bin_um
+    """
+    with open(fn, 'r') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        next(reader)
+        dim_str = next(reader)[0]
+        dim2 = int(re.search(r'(?<=\= )\w+', dim_str).group(0))
+        dim1 = int(re.search(r'(?<=x )\w+', dim_str).group(0))
+        flux2D = np.zeros((dim1, dim2))
+        pxl_str = next(reader)[0]
+        bin_um = float(re.search(r'(?<=\= )\w+\.\w+', pxl_str).group(0))
+        for i in range(2):
+            next(reader)
+        for i, row in enumerate(reader):
+            for j, word in enumerate(row):
+                flux2D[i,j] = float(word)
+        flux2D = np.flipud(flux2D)
+        flux2D_ref = np.zeros((dim1, dim2))
+        flux2D_ref[:] = np.mean(flux2D)
+    return(flux2D, flux2D_ref, bin_um)
+
+def readtxt(fn):
+    """ Original csv reading: np.loadtxt, comma-delimited or else whitespace-delimited
+    Outputs:
+        flux2D, flux2D_ref
+    """
+    try:
+        flux2D = np.loadtxt(fn, delimiter=',')
+    except(ValueError):
+        flux2D = np.loadtxt(fn)
+    flux2D_ref = np.zeros(flux2D.shape)
+    flux2D_ref[:] = np.mean(flux2D)
+    return(flux2D, flux2D_ref)
+
+def readPRR(fn):
+    """ Original PRR reading: header lines, then np.loadtxt of both arrays (masks are not read)
+    Outputs:
+        meta: dict of s2r_cm, s2d_cm, Ep_MeV, bin_um found in the header
+        flux2D, flux2D_ref
+    """
+    meta = {}
+    with open(fn) as f:
+        line = f.readline()
+        while re.match('#', line):
+            for k in ('s2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um'):
+                if re.match('# ' + k, line):
+                    meta[k] = float(line.split()[2])
+            line = f.readline()
+    tot_arr = np.loadtxt(fn, comments="#", delimiter=",")
+    flux2D, flux2D_ref = np.split(tot_arr, 2, axis=0)
+    return meta, flux2D, flux2D_ref
+
+def read(fn, rtype, bin_um=None):
+    """
+    Read a file with the original reader for its type, into a prad object
+    Inputs:
+        fn: String, input filename
+        rtype: String, file type ('flash4', 'carlo', 'csv', 'mitcsv', 'prr')
+        bin_um: Float, bin size for proton lists (flash4, carlo)
+    Outputs:
+        pr: prad object (dense float64 arrays; mask None)
+    """
+    from .reader import prad
+    pr = prad(fn)
+    pr.rtype = rtype
+    pr.bin_um = bin_um
+    if rtype == 'flash4':
+        pr.s2r_cm, pr.s2d_cm, pr.Ep_MeV, pr.flux2D, pr.flux2D_ref = readFlash4(fn, bin_um)
+    elif rtype == 'carlo':
+        pr.s2r_cm, pr.s2d_cm, pr.Ep_MeV, pr.flux2D, pr.flux2D_ref = readCarlo(fn, bin_um)
+    elif rtype == 'mitcsv':
+        pr.flux2D, pr.flux2D_ref, pr.bin_um = readmitcsv(fn)
+    elif rtype == 'csv':
+        pr.flux2D, pr.flux2D_ref = readtxt(fn)
+    elif rtype == 'prr':
+        meta, pr.flux2D, pr.flux2D_ref = readPRR(fn)
+        for k, v in meta.items():
+            setattr(pr, k, v)
+    else:
+        raise(Exception("No legacy reader for file type '" + str(rtype) + "'"))
+    return pr
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+mask.py: Pixel masks selecting the part of a radiograph used in an analysis
+
+A mask is built from simple geometry, in pixel coordinates of the 'xy'-indexed
+flux array (x along axis 1, y along axis 0; pixel [i, j] spans x from j to j+1
+and y from i to i+1, with its center at (j + 0.5, i + 0.5)):
+* x and y ranges (a rectangle)
+* circles (xc, yc, radius)
+* polygons (lists of (x, y) vertices)
+
+A pixel is included if its center lies within the x/y ranges and inside any of
+the circles or polygons (or anywhere, if none are given). Rasterization is
+vectorized over rows and columns; polygons are filled by toggling pixel
+runs at their edge crossings, without testing pixels one by one.
+
+Masks with the same geometry and shape are built once and reused. They are
+applied lazily: the flux arrays are left untouched, and masked reductions
+only look at the pixels inside the mask's bounding box.
+"""
+
+import zlib
+import base64
+from collections import OrderedDict
+import numpy as np
+from .sparse import sparseflux
+from .roi import roiBounds
+
+MASK_CACHE_SIZE = 16 # Number of rasterized masks kept for reuse
+_masks = OrderedDict() # (shape, geometry) => fluxmask, least recently used first
+
+class fluxmask(object):
+    """
+    Boolean pixel mask of a flux map (True: pixel is used).
+
+    Inputs:
+        bits: 2D boolean NumPy array
+
+    Attributes:
+        bits: 2D boolean NumPy array (read-only)
+        shape: Tuple (ny, nx)
+        bbox: Tuple (y0, y1, x0, x1), smallest region holding every included pixel
+        npix: Integer, number of included pixels
+    """
+    def __init__(self, bits):
+        bits = np.array(bits, dtype=bool)
+        bits.setflags(write=False) # Masks may be shared through the cache
+        self.bits = bits
+        self.shape = bits.shape
+        self.npix = int(np.count_nonzero(bits))
+        rows = np.flatnonzero(bits.any(axis=1))
+        cols = np.flatnonzero(bits.any(axis=0))
+        if rows.size:
+            self.bbox = (int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1)
+        else:
+            self.bbox = (0, 0, 0, 0)
+
+    def __repr__(self):
+        return ("fluxmask(shape=" + str(self.shape) + ", " + str(self.npix) + " of "
+                + str(self.shape[0] * self.shape[1]) + " pixels)")
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'packed': np.packbits(self.bits, axis=None)}
+
+    def __setstate__(self, state):
+        self.__init__(unpackMask(state['packed'], state['shape']))
+
+    def values(self, flux):
+        """ 1D array of the flux values of the included pixels (dense array or sparseflux object) """
+        if tuple(flux.shape) != tuple(self.shape):
+            raise(ValueError("Mask shape " + str(self.shape) + " does not match flux shape " + str(tuple(flux.shape))))
+        if isinstance(flux, sparseflux): # Stored pixels inside the mask, plus the excluded zeros
+            vals = flux.values[self.bits[flux.rows, flux.cols]]
+            return np.concatenate([vals, np.zeros(self.npix - vals.size)])
+        y0, y1, x0, x1 = self.bbox
+        return flux[y0:y1, x0:x1][self.bits[y0:y1, x0:x1]] # Pixels outside the bounding box are never touched
+
+    def reduce(self, flux):
+        """ Sum, mean, min and max of a flux map over the included pixels (dict) """
+        vals = self.values(flux)
+        if vals.size == 0:
+            return {'pixels': 0, 'sum': 0.0, 'mean': np.nan, 'min': np.nan, 'max': np.nan}
+        return {'pixels': vals.size, 'sum': float(vals.sum()), 'mean': float(vals.mean()),
+                'min': float(vals.min()), 'max': float(vals.max())}
+
+    def apply(self, flux, fill=np.nan):
+        """ Dense copy of a flux map with the excluded pixels set to 'fill' """
+        if isinstance(flux, sparseflux):
+            flux = flux.todense()
+        out = np.array(flux, dtype=np.float64)
+        out[~self.bits] = fill
+        return out
+
+    def crop(self, roi):
+        """ Mask of a region of interest (y0, y1, x0, x1) of the flux map """
+        y0, y1, x0, x1 = roiBounds(roi, self.shape)
+        return fluxmask(self.bits[y0:y1, x0:x1])
+
+    def encode(self):
+        """ Compact text form of the mask: bit-packed, compressed and base64-encoded """
+        packed = np.packbits(self.bits, axis=None).tobytes()
+        return base64.b64encode(zlib.compress(packed, 9)).decode('ascii')
+
+    @classmethod
+    def decode(cls, text, shape):
+        """ Mask from the text form written by encode() """
+        packed = np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=np.uint8)
+        return cls(unpackMask(packed, shape))
+
+def unpackMask(packed, shape):
+    """ 2D boolean array from bits packed by np.packbits(..., axis=None) """
+    n = shape[0] * shape[1]
+    return np.unpackbits(np.asarray(packed, dtype=np.uint8))[:n].reshape(shape).astype(bool)
+
+def _rangeMask(ny, nx, xrange, yrange):
+    """ (Private) Pixels whose centers lie within the x and y ranges (None: no limit) """
+    xc = np.arange(nx) + 0.5
+    yc = np.arange(ny) + 0.5
+    inx = np.ones(nx, dtype=bool)
+    iny = np.ones(ny, dtype=bool)
+    if xrange is not None:
+        inx = (xc >= xrange[0]) & (xc <= xrange[1])
+    if yrange is not None:
+        iny = (yc >= yrange[0]) & (yc <= yrange[1])
+    return iny[:, np.newaxis] & inx[np.newaxis, :]
+
+def _circleMask(bits, xc, yc, r):
+    """ (Private) Add the pixels whose centers lie in a circle to bits, looking only at its bounding box """
+    ny, nx = bits.shape
+    i0, i1 = max(int(np.floor(yc - r)), 0), min(int(np.ceil(yc + r)) + 1, ny)
+    j0, j1 = max(int(np.floor(xc - r)), 0), min(int(np.ceil(xc + r)) + 1, nx)
+    if i0 >= i1 or j0 >= j1:
+        return
+    dy2 = (np.arange(i0, i1) + 0.5 - yc)**2
+    dx2 = (np.arange(j0, j1) + 0.5 - xc)**2
+    bits[i0:i1, j0:j1] |= (dy2[:, np.newaxis] + dx2[np.newaxis, :]) <= r**2
+
+def _polygonMask(bits, vertices):
+    """ (Private) Add the pixels whose centers lie inside a polygon (even-odd rule) to bits """
+    ny, nx = bits.shape
+    v = np.asarray(vertices, dtype=np.float64)
+    x0, y0 = v[:, 0], v[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1) # Edges from each vertex to the next (closing the polygon)
+    yc = np.arange(ny) + 0.5
+
+    # Crossings of every edge with every row's center line; half-open in y so shared vertices count once
+    Y = yc[:, np.newaxis]
+    crosses = ((y0 <= Y) & (Y < y1)) | ((y1 <= Y) & (Y < y0))
+    rows, edges = np.nonzero(crosses)
+    if rows.size == 0:
+        return
+    t = (yc[rows] - y0[edges]) / (y1[edges] - y0[edges])
+    xcross = x0[edges] + t * (x1[edges] - x0[edges])
+
+    # Each crossing toggles inside/outside for the pixels whose centers are to its right
+    first = np.clip(np.floor(xcross - 0.5).astype(np.int64) + 1, 0, nx)
+    toggles = np.zeros((ny, nx + 1), dtype=np.int32)
+    np.add.at(toggles, (rows, first), 1)
+    bits |= (np.cumsum(toggles, axis=1)[:, :nx] % 2).astype(bool)
+
+def _geometryKey(xrange, yrange, circles, polygons):
+    """ (Private) Hashable description of a mask geometry """
+    def tup(seq):
+        return None if seq is None else tuple(float(v) for v in seq)
+    return (tup(xrange), tup(yrange),
+            tuple(tup(c) for c in (circles or [])),
+            tuple(tuple(tup(p) for p in poly) for poly in (polygons or [])))
+
+def genmask(shape, xrange=None, yrange=None, circles=None, polygons=None):
+    """ Build (or reuse) a pixel mask from x/y ranges, circles and polygons
+    Inputs:
+        shape: Tuple (ny, nx), shape of the flux map
+        xrange, yrange: Tuples (low, high), pixel coordinate ranges to keep (None: no limit)
+        circles: List of (xc, yc, radius) tuples, in pixels
+        polygons: List of polygons, each a list of (x, y) vertices, in pixels
+    Outputs:
+        mask: fluxmask object
+    """
+    shape = (int(shape[0]), int(shape[1]))
+    key = (shape, _geometryKey(xrange, yrange, circles, polygons))
+    mask = _masks.pop(key, None)
+    if mask is None:
+        bits = _rangeMask(shape[0], shape[1], xrange, yrange)
+        if circles or polygons:
+            shapes = np.zeros(shape, dtype=bool)
+            for xc, yc, r in (circles or []):
+                _circleMask(shapes, xc, yc, r)
+            for poly in (polygons or []):
+                _polygonMask(shapes, poly)
+            bits &= shapes
+        mask = fluxmask(bits)
+        while len(_masks) >= MASK_CACHE_SIZE:
+            _masks.popitem(last=False)
+    _masks[key] = mask # (Re-)insert as most recently used
+    return mask
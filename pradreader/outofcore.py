@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+outofcore.py: Histogramming proton lists larger than memory
+
+The text file is split into partitions by byte ranges, aligned to line
+boundaries. Each partition is read and parsed in chunks of a fixed number of
+bytes, its protons binned into a partial flux map, and running statistics
+(count, min, max, sum) of the position columns kept on the way. Partitions
+are independent, so they can be reduced on several processes; the partial
+maps and statistics are then merged.
+
+Memory use is about workers * (a few times chunk_bytes) plus one flux map per
+worker, whatever the file size.
+"""
+
+import os
+import io
+import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .fluxmap import fluxAccumulator
+from .rdgeneric import _parse
+
+def partitions(fn, nparts):
+    """ Split a text file into byte ranges that start and end on line boundaries
+    Inputs:
+        fn: String, filename
+        nparts: Integer, number of partitions wanted (fewer are returned for small files)
+    Outputs:
+        List of (start, end) byte offsets, covering the whole file in order
+    """
+    size = os.path.getsize(fn)
+    bounds = [0]
+    with open(fn, 'rb') as f:
+        for i in range(1, nparts):
+            approx = size * i // nparts
+            if approx <= bounds[-1]:
+                continue
+            f.seek(approx - 1)
+            f.readline() # Move on to the start of the next line
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _iterChunks(fn, start, end, chunk_bytes):
+    """ (Private) Yield the bytes between start and end in pieces of about chunk_bytes, ending on line boundaries """
+    if fn.endswith('.gz'): # Not seekable in practice; always a single partition
+        import gzip
+        f = gzip.open(fn, 'rb')
+        end = None
+    else:
+        f = open(fn, 'rb')
+        f.seek(start)
+    with f:
+        pos = start
+        while end is None or pos < end:
+            chunk = f.read(chunk_bytes if end is None else min(chunk_bytes, end - pos))
+            if not chunk:
+                break
+            if not chunk.endswith(b'\n'):
+                chunk += f.readline() # Finish the last line (never beyond 'end', which is a line boundary)
+            pos += len(chunk)
+            yield chunk
+
+def _newStats(ncols):
+    """ (Private) Empty running statistics of ncols columns """
+    return {'count': 0,
+            'min': np.full(ncols, np.inf),
+            'max': np.full(ncols, -np.inf),
+            'sum': np.zeros(ncols)}
+
+def _mergeStats(a, b):
+    """ (Private) Combine two sets of running statistics """
+    return {'count': a['count'] + b['count'],
+            'min': np.minimum(a['min'], b['min']),
+            'max': np.maximum(a['max'], b['max']),
+            'sum': a['sum'] + b['sum']}
+
+def reducePartition(fn, start, end, cols, width_cm, bin_um, scale=1.0, offset=0.0, chunk_bytes=2**24):
+    """ Histogram the protons of one byte range of a proton list
+    Inputs:
+        fn: String, filename of the whitespace-delimited proton list (may be gzipped)
+        start, end: Integers, byte range (on line boundaries) to reduce
+        cols: Pair of integers, zero-based columns holding the proton x and y positions
+        width_cm: float, total width of the square detector, in cm
+        bin_um: float, desired bin size for the 2D histogram, in microns
+        scale, offset: Floats; positions in cm are (column value - offset) * scale
+        chunk_bytes: Integer, number of bytes parsed at a time
+    Outputs:
+        counts: 1D NumPy int64 array, flattened (row-major, 'xy' indexed) partial flux map
+        stats: dict of running statistics ('count', and 'min', 'max', 'sum' per position column, in cm)
+    """
+    acc = fluxAccumulator(width_cm, bin_um)
+    stats = _newStats(2)
+    for chunk in _iterChunks(fn, start, end, chunk_bytes):
+        if not re.search(br'^[ \t]*[^#\s]', chunk, re.M): # Only comment or blank lines
+            continue
+        xy = _parse(io.BytesIO(chunk), None, usecols=list(cols))
+        if scale != 1.0 or offset != 0.0:
+            xy = (xy - offset) * scale
+        acc.add(xy[:,0], xy[:,1])
+        stats = _mergeStats(stats, {'count': xy.shape[0], 'min': xy.min(axis=0),
+                                    'max': xy.max(axis=0), 'sum': xy.sum(axis=0)})
+    return acc.counts, stats
+
+def _reducePartitionArgs(args):
+    """ (Private) reducePartition with packed arguments, for process pools """
+    return reducePartition(*args)
+
+def outOfCoreFluxMap(fn, cols, width_cm, bin_um, scale=1.0, offset=0.0, workers=1,
+                     part_bytes=2**28, chunk_bytes=2**24, dtype=np.float64):
+    """ Histogram a proton list of any size, within a fixed memory budget
+    Inputs:
+        fn: String, filename of the whitespace-delimited proton list (may be gzipped)
+        cols: Pair of integers, zero-based columns holding the proton x and y positions
+        width_cm: float, total width of the square detector, in cm
+        bin_um: float, desired bin size for the 2D histogram, in microns
+        scale, offset: Floats; positions in cm are (column value - offset) * scale
+        workers: Integer, number of processes reducing partitions in parallel
+        part_bytes: Integer, approximate size of a partition in bytes
+        chunk_bytes: Integer, number of bytes parsed at a time by each process
+        dtype: NumPy float dtype of flux2D (see precision.py)
+    Outputs:
+        flux2D: 2D Histogram of proton flux, in units of protons/bin (as fluxMap)
+        bins_cm: 1D NumPy array of bin edges (same for x and y), in cm
+        stats: dict with 'nprot' (number of protons in the file) and 'min', 'max', 'mean'
+                (NumPy arrays of the x and y positions, in cm)
+    """
+    if fn.endswith('.gz'):
+        parts = [(0, None)]
+    else:
+        nparts = max(workers, int(np.ceil(os.path.getsize(fn) / float(part_bytes))))
+        parts = partitions(fn, nparts)
+    args = [(fn, start, end, cols, width_cm, bin_um, scale, offset, chunk_bytes) for start, end in parts]
+
+    acc = fluxAccumulator(width_cm, bin_um)
+    stats = _newStats(2)
+    if workers > 1 and len(parts) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_reducePartitionArgs, args)
+            for counts, pstats in results: # Merge partial maps as they complete (in order)
+                acc.counts += counts
+                stats = _mergeStats(stats, pstats)
+    else:
+        for a in args:
+            counts, pstats = reducePartition(*a)
+            acc.counts += counts
+            stats = _mergeStats(stats, pstats)
+
+    n = stats['count']
+    summary = {'nprot': n,
+               'min': stats['min'] if n else np.full(2, np.nan),
+               'max': stats['max'] if n else np.full(2, np.nan),
+               'mean': stats['sum'] / n if n else np.full(2, np.nan)}
+    return acc.flux2D(dtype), acc.bins_cm, summary
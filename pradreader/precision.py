@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+precision.py: Floating-point precision (dtype) of the flux maps read by pradreader
+
+Flux maps hold proton counts per bin, which float32 stores exactly up to 2**24
+(about 16.7 million) counts per bin; other values (smooth reference fluxes,
+gridded scans) keep about 7 significant digits, a relative rounding error of at
+most 2**-24 (6e-8). That is far below the counting noise of any radiograph, and
+float32 halves the memory of every flux map and shortens PRR files.
+
+Every reader, the histogramming, the reference flux estimates and the PRR
+writer and reader respect the dtype. It is chosen per call (prad.read(dtype=...)),
+or for all calls by setDtype() or the PRADREADER_DTYPE environment variable.
+The default stays float64. Use roundoff() to check what float32 changes for a
+given radiograph.
+
+Usage:
+    from pradreader import precision
+    precision.setDtype('float32')
+    pr.read() # Flux maps are float32
+"""
+
+import os
+import numpy as np
+from .sparse import sparseflux
+
+DTYPES = ('float64', 'float32')
+
+# Text format of one value in PRR files: enough digits to read back the same value
+VALUE_FORMATS = {'float64': '%.18e', 'float32': '%.8e'}
+
+_default = None # dtype set by setDtype(), or None for the environment/float64
+
+def setDtype(dtype=None):
+    """ Set the dtype of flux maps for all later reads ('float64', 'float32', or None for the default) """
+    global _default
+    _default = None if dtype is None else checkDtype(dtype)
+
+def checkDtype(dtype):
+    """ The NumPy dtype for a dtype name or object; raises an Exception for unsupported dtypes """
+    dt = np.dtype(dtype)
+    if dt.name not in DTYPES:
+        raise(Exception("Flux map dtype '" + str(dtype) + "' not supported; options are "
+                        + ", ".join(DTYPES)))
+    return dt
+
+def getDtype(dtype=None):
+    """ The dtype to use: 'dtype' if given, else the one set by setDtype() or PRADREADER_DTYPE, else float64 """
+    if dtype is not None:
+        return checkDtype(dtype)
+    if _default is not None:
+        return _default
+    return checkDtype(os.environ.get('PRADREADER_DTYPE') or 'float64')
+
+def asDtype(flux, dtype=None):
+    """ A flux map (dense array, sparseflux, or None) in the given dtype (no copy if it already is) """
+    dt = getDtype(dtype)
+    if flux is None:
+        return None
+    if isinstance(flux, sparseflux):
+        if flux.values.dtype == dt:
+            return flux
+        return sparseflux(flux.shape, flux.index, flux.values.astype(dt))
+    return np.asarray(flux).astype(dt, copy=False)
+
+def valueFormat(dtype):
+    """ printf format of a single value written to a PRR file for arrays of this dtype """
+    return VALUE_FORMATS.get(np.dtype(dtype).name, VALUE_FORMATS['float64'])
+
+def roundoff(flux2D, dtype='float32'):
+    """
+    Accuracy check: what storing a float64 flux map in a lower precision changes
+    Inputs:
+        flux2D: 2D NumPy array (float64) of flux values
+        dtype: dtype to compare against
+    Outputs:
+        report: dict with 'max_abs' and 'max_rel' (largest absolute and relative
+                    change of any pixel), and 'exact' (True if no pixel changed)
+    """
+    ref = np.asarray(flux2D, dtype=np.float64)
+    diff = np.abs(ref.astype(checkDtype(dtype)).astype(np.float64) - ref)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel = np.where(ref != 0, diff / np.abs(ref), 0.0)
+    return {'max_abs': float(diff.max()) if diff.size else 0.0,
+            'max_rel': float(rel.max()) if rel.size else 0.0,
+            'exact': not np.any(diff)}
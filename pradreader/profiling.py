@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+profiling.py: Run a pradreader pipeline under the profiler, for slowness reports
+
+Runs a function (or several, skipping what lies between them, such as prompts
+for user input) under cProfile and optionally tracemalloc, saves the profile
+statistics to a file (viewable with 'python -m pstats FILE' or snakeviz), and
+prints a ranked summary of the hot spots and of the largest allocation sites.
+"""
+
+import cProfile
+import pstats
+try:
+    import tracemalloc # Python 3.4+
+except ImportError:
+    tracemalloc = None
+
+class profiler(object):
+    """
+    cProfile (and optionally tracemalloc) profile accumulated over several calls,
+    so that interactive steps between them (prompts) stay out of the rankings.
+
+    Inputs:
+        out: String, file for the cProfile statistics
+        memory: Boolean, if True, also trace memory allocations with tracemalloc
+                    (slows the run down) and report the largest allocation sites
+        top: Integer, number of entries in each printed ranking
+
+    Example:
+        prof = profiler()
+        prof.runcall(pr.read)
+        pr.prompt() # Not profiled
+        prof.runcall(pr.write)
+        prof.report()
+    """
+    def __init__(self, out='pradreader.prof', memory=False, top=20):
+        if memory and tracemalloc is None:
+            print("Note: tracemalloc needs Python 3.4+; profiling time only.")
+            memory = False
+        self.out = out
+        self.memory = memory
+        self.top = top
+        self._prof = cProfile.Profile()
+
+    def runcall(self, func, *args, **kwargs):
+        """ Call func(*args, **kwargs) under the profiler; returns its return value """
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self._prof.runcall(func, *args, **kwargs)
+
+    def report(self):
+        """ Save the statistics to the 'out' file and print the rankings """
+        top, out = self.top, self.out
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            snapshot = None
+
+        self._prof.dump_stats(out)
+        print("~~~~~~~ PROFILE (top " + str(top) + " by cumulative time) ~~~~~~~")
+        stats = pstats.Stats(self._prof)
+        stats.sort_stats('cumulative').print_stats(top)
+        print("~~~~~~~ PROFILE (top " + str(top) + " by own time) ~~~~~~~")
+        stats.sort_stats('tottime').print_stats(top)
+
+        if snapshot is not None:
+            print("~~~~~~~ MEMORY (top " + str(top) + " allocation sites still held; peak "
+                  + str(round(peak / 1024.0**2, 1)) + " MB) ~~~~~~~")
+            for stat in snapshot.statistics('lineno')[:top]:
+                print(stat)
+        print("Profile statistics saved to '" + out + "' (view with: python -m pstats " + out + ")")
+
+def profiled(func, out='pradreader.prof', memory=False, top=20):
+    """
+    Call func() under cProfile and report where the time (and memory) went
+    Inputs:
+        func: Function of no arguments, the pipeline to profile (without
+                    interactive steps; see profiler for profiling around them)
+        out, memory, top: As for profiler
+    Outputs:
+        result: Return value of func()
+    """
+    prof = profiler(out=out, memory=memory, top=top)
+    try:
+        return prof.runcall(func)
+    finally:
+        prof.report()
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+prr.py: Writer for the pradreader (PRR) intermediate text file format
+
+A PRR file is a block of '#' header lines (version, date, metadata, array shapes,
+and optionally a bit-packed pixel mask) followed by the flux arrays as
+comma-delimited text, one image row per line.
+
+Converting numbers to text dominates the cost of writing, so each block of rows
+is formatted as follows:
+    - Blocks with few distinct values (histogrammed counts, the flat FLASH4
+      reference) format each distinct value once and assemble the text from
+      that table (about 8x faster than np.savetxt for count maps).
+    - Other blocks are formatted with a single C-level string formatting call,
+      optionally spread over several processes (workers; see autoWorkers).
+Text is written through a buffered binary handle. Output is byte-for-byte what
+np.savetxt writes, so files stay readable by any v1.01a reader.
+
+Arrays can also be streamed in bands of rows, or bands of side-by-side tiles,
+through a 'prrwriter', so a large radiograph never has to exist as a full array
+in memory.
+
+float32 arrays are written with 9 significant digits (enough to read back the
+same float32 values) instead of 19, under a '# dtype float32' header line.
+"""
+
+import os
+import datetime
+from collections import deque
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .sparse import sparseflux
+from .precision import checkDtype, valueFormat
+
+PRR_VERSION = 'v1.01a' # Dense arrays
+PRR_VERSION_SPARSE = 'v1.02a' # Sparse (row,col,value) arrays
+
+_META_FIELDS = ('s2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um')
+
+_TABLE_SAMPLE = 4096 # Values sampled to decide whether a block has few distinct values
+_INT_TABLE = 4096 # Largest range of whole-number values formatted through a directly indexed table
+_PARALLEL_MIN = 2**20 # Arrays with at least this many values are worth formatting in parallel
+_MAX_WORKERS = 8
+
+def formatRows(block, fmt='%.18e', delimiter=','):
+    """ Format a 2D array as delimited text lines, exactly as np.savetxt would
+    Inputs:
+        block: 2D NumPy array
+        fmt: String, format of a single value
+        delimiter: String, separator between values of a row
+    Outputs:
+        text: String of block.shape[0] newline-terminated lines
+    """
+    return _formatBlock(block, fmt, delimiter).decode('ascii')
+
+def _formatBlock(block, fmt='%.18e', delimiter=','):
+    """ (Private) formatRows, as ASCII bytes ready for the file """
+    block = np.asarray(block)
+    if block.size == 0:
+        return b''
+    if block.dtype.kind == 'f' and _fewValues(block):
+        return _formatTable(block, fmt, delimiter)
+    rowfmt = delimiter.join([fmt] * block.shape[1]) + '\n'
+    return ((rowfmt * block.shape[0]) % tuple(block.ravel().tolist())).encode('ascii')
+
+def _fewValues(block):
+    """ (Private) True if a sample of the block suggests at most 1 in 4 of its values are distinct """
+    flat = block.ravel()
+    if flat.size < _TABLE_SAMPLE:
+        return False
+    sample = flat[::flat.size // _TABLE_SAMPLE]
+    return len(np.unique(sample)) <= sample.size // 4
+
+def _formatTable(block, fmt, delimiter):
+    """ (Private) formatRows for blocks with few distinct values: format each value once, then look up """
+    ny, nx = block.shape
+    lo, hi = block.min(), block.max()
+    if (np.isfinite(lo) and np.isfinite(hi) and hi - lo < _INT_TABLE
+            and np.array_equal(block, np.floor(block)) and not np.signbit(block).any()):
+        # Counts: whole numbers in a small range (none negative, so no -0.0) index the table directly
+        vals = np.arange(lo, hi + 1, dtype=block.dtype)
+        codes = (block - lo).astype(np.intp)
+    else:
+        # Distinct bit patterns rather than values, so that 0.0 and -0.0 keep their own text
+        bits = np.ascontiguousarray(block).ravel().view('u' + str(block.dtype.itemsize))
+        uniq = np.unique(bits[::max(bits.size // _TABLE_SAMPLE, 1)]) # Often already all of them
+        codes = np.minimum(np.searchsorted(uniq, bits), len(uniq) - 1)
+        if not np.array_equal(uniq[codes], bits): # Some values missed by the sample
+            uniq, codes = np.unique(bits, return_inverse=True)
+        vals = uniq.view(block.dtype)
+        codes = codes.reshape(ny, nx)
+    texts = [(fmt % val).encode('ascii') for val in vals.tolist()]
+    tokens = [t + delimiter.encode('ascii') for t in texts] + [t + b'\n' for t in texts]
+    codes[:, -1] += len(texts) # Last value of each row ends the line
+    if len(set(len(t) for t in tokens)) == 1: # Equal widths (the usual case): a fixed-width byte table
+        return np.array(tokens)[codes.ravel()].tobytes()
+    return b''.join(np.array(tokens, dtype=object)[codes.ravel()].tolist())
+
+def autoWorkers(nvalues):
+    """ Suggested number of formatting processes (writePRR workers) for arrays of nvalues values in total
+    Parallel writes are opt-in: they start processes, which on spawn platforms (macOS, Windows)
+    need the calling script to be guarded by "if __name__ == '__main__':", and should not be
+    started from threaded programs.
+    """
+    if nvalues < _PARALLEL_MIN:
+        return 1
+    return max(1, min(os.cpu_count() or 1, _MAX_WORKERS))
+
+def formatSparse(rows, cols, values, fmt='%.18e', delimiter=','):
+    """ Format sparse pixels as 'row,col,value' text lines """
+    n = len(values)
+    flat = [None] * (3 * n) # Interleave the three columns
+    flat[0::3] = np.asarray(rows).tolist()
+    flat[1::3] = np.asarray(cols).tolist()
+    flat[2::3] = np.asarray(values).tolist()
+    return (delimiter.join(['%d', '%d', fmt]) + '\n') * n % tuple(flat)
+
+class prrwriter(object):
+    """
+    Streaming writer for a PRR file.
+
+    The header (metadata and array shapes) is written on creation; the arrays
+    then follow, in order, either whole or in bands of rows. The writer checks
+    that every array receives exactly the rows announced in the header.
+
+    Inputs:
+        ofile: String, output filepath
+        shapes: List of (name, (ny, nx)) pairs, the arrays to be written, in order
+                    (e.g. [('flux2D', (501, 500)), ('flux2D_ref', (501, 500))])
+        meta: dict of metadata values (s2r_cm, s2d_cm, Ep_MeV, bin_um)
+        sparse: dict of name => number of non-zero pixels, for arrays written in sparse form
+        chunk_rows: Integer, number of rows formatted per string formatting call
+        buffering: Integer, size of the file write buffer in bytes
+        workers: Integer, number of processes formatting blocks of rows in parallel
+                    (number formatting, not disk, is usually the bottleneck; see autoWorkers).
+                    At most two blocks per process are in flight at a time.
+        mask: fluxmask object to store in the header (see mask.py), or None
+        dtype: Float dtype of the arrays ('float64' or 'float32'), which sets the
+                    number of digits written per value
+
+    Example:
+        with prrwriter('input.txt', [('flux2D', shape), ('flux2D_ref', shape)], meta) as w:
+            for band in flux_bands:
+                w.writerows(band)
+            for tiles in reference_tile_bands: # E.g. [left_tile, right_tile] per band of rows
+                w.writetiles(tiles)
+    """
+    def __init__(self, ofile, shapes, meta, sparse=None, chunk_rows=128, buffering=2**22, workers=1, mask=None,
+                 dtype='float64'):
+        self.ofile = ofile
+        self.chunk_rows = int(chunk_rows)
+        self.dtype = checkDtype(dtype)
+        self.fmt = valueFormat(self.dtype)
+        self._workers = int(workers)
+        self._pool = ProcessPoolExecutor(max_workers=self._workers) if self._workers > 1 else None
+        self._sparse = sparse or {}
+        self._todo = [] # (name, remaining lines) for each array still to be written
+        self._widths = {} # Row length of each dense array
+        for name, shape in shapes:
+            self._todo.append([name, self._sparse[name] if name in self._sparse else int(shape[0])])
+            if name not in self._sparse:
+                self._widths[name] = int(shape[1])
+
+        self._f = open(ofile, 'wb', buffering)
+        version = PRR_VERSION_SPARSE if self._sparse else PRR_VERSION
+        now = datetime.datetime.now()
+        lines = ['# PRadReader (PRR) Generated Input File ' + version,
+                 '# Date generated: ' + str(now.date()) + ' ' + str(now.time())]
+        for k in _META_FIELDS:
+            lines.append("# " + k + " " + str(meta.get(k)))
+        for name, shape in shapes:
+            line = "# " + name + " " + str(tuple(int(n) for n in shape))
+            if name in self._sparse:
+                line += " sparse " + str(self._sparse[name])
+            lines.append(line)
+        if self.dtype != np.float64: # A comment line to older readers, which ignore it
+            lines.append("# dtype " + self.dtype.name)
+        if mask is not None: # A comment line to older readers, which ignore it
+            lines.append("# mask " + str(tuple(int(n) for n in mask.shape)) + " " + mask.encode())
+        self._write('\n'.join(lines) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else: # Don't mask the original error with an incompleteness error
+            self._shutdown()
+
+    def _write(self, text):
+        self._f.write(text if isinstance(text, bytes) else text.encode('ascii'))
+
+    def _take(self, n):
+        """ (Private) Account for n more lines of the current array """
+        if not self._todo:
+            raise(ValueError("All arrays announced in the PRR header are already written"))
+        name, remaining = self._todo[0]
+        if n > remaining:
+            raise(ValueError("Too many rows for array '" + name + "' (" + str(remaining) + " remaining)"))
+        self._todo[0][1] -= n
+        return name
+
+    def _next(self):
+        """ (Private) Move on to the next array once the current one is complete """
+        if self._todo and self._todo[0][1] == 0:
+            self._todo.pop(0)
+
+    def writerows(self, rows):
+        """ Write a band of rows (2D array) of the current dense array """
+        rows = np.asarray(rows)
+        if rows.ndim == 1:
+            rows = rows[np.newaxis, :]
+        if self._todo and self._todo[0][0] in self._widths and rows.shape[1] != self._widths[self._todo[0][0]]:
+            raise(ValueError("Rows of array '" + self._todo[0][0] + "' must have "
+                             + str(self._widths[self._todo[0][0]]) + " values, not " + str(rows.shape[1])))
+        step = self.chunk_rows
+        if not self._pool:
+            for i in range(0, rows.shape[0], step):
+                block = rows[i:i + step]
+                self._take(block.shape[0])
+                self._write(_formatBlock(block, self.fmt))
+                self._next()
+            return
+        step = max(1, min(step, -(-rows.shape[0] // (2 * self._workers)))) # At least two blocks per process
+        window = deque() # (rows, future) of blocks being formatted, oldest first; bounds the memory in flight
+        for i in range(0, rows.shape[0], step):
+            if len(window) >= 2 * self._workers:
+                self._finish(*window.popleft())
+            window.append((min(step, rows.shape[0] - i), self._pool.submit(_formatBlock, rows[i:i + step], self.fmt)))
+        while window:
+            self._finish(*window.popleft())
+
+    def _finish(self, nrows, future):
+        """ (Private) Write a block of rows formatted by a worker process, in order """
+        self._take(nrows)
+        self._write(future.result())
+        self._next()
+
+    def writetiles(self, tiles):
+        """ Write a band of rows of the current dense array, given as side-by-side tiles
+        Inputs:
+            tiles: Sequence of 2D arrays of equal height, left to right, together spanning the full width
+        Only the band is assembled in memory, never the full array.
+        """
+        tiles = [np.atleast_2d(tile) for tile in tiles]
+        if len(set(tile.shape[0] for tile in tiles)) > 1:
+            raise(ValueError("Tiles of one band must have the same number of rows"))
+        self.writerows(np.hstack(tiles))
+
+    def writearray(self, arr):
+        """ Write a whole array (dense array or sparseflux object) as the current array """
+        if isinstance(arr, sparseflux):
+            self.writesparse(arr.rows, arr.cols, arr.values)
+        else:
+            self.writerows(arr)
+
+    def writesparse(self, rows, cols, values):
+        """ Write non-zero pixels (row, col, value) of the current sparse array """
+        n = len(values)
+        for i in range(0, n, self.chunk_rows * 64):
+            j = min(i + self.chunk_rows * 64, n)
+            self._take(j - i)
+            self._write(formatSparse(rows[i:j], cols[i:j], values[i:j], fmt=self.fmt))
+        if n == 0:
+            self._take(0)
+        self._next()
+
+    def _shutdown(self):
+        """ (Private) Close the file and stop the formatting processes """
+        self._f.close()
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+
+    def close(self):
+        """ Flush and close the file, checking that all announced arrays were written """
+        self._shutdown()
+        self._next()
+        if self._todo:
+            raise(ValueError("PRR file '" + self.ofile + "' is incomplete; missing rows of array '"
+                             + self._todo[0][0] + "'"))
+
+def writePRR(ofile, pr, sparse=False, chunk_rows=128, workers=1):
+    """ Write the contents of a prad object to a PRR file
+    Inputs:
+        ofile: String, output filepath
+        pr: prad object
+        sparse: Boolean, if True, store the flux arrays as 'row,col,value' lines of
+                    their non-zero pixels (PRR v1.02a)
+        chunk_rows: Integer, number of rows formatted per string formatting call
+        workers: Integer, number of processes formatting rows of dense maps in parallel
+                    (opt-in; e.g. autoWorkers(pr.flux2D.size * 2)), or None for autoWorkers' choice
+    The arrays are written as float32 (shorter lines) only if both are float32.
+    """
+    names = ('flux2D', 'flux2D_ref')
+    if sparse:
+        arrays = [pr.flux2D_sparse, pr.flux2D_ref_sparse]
+        counts = dict((name, arr.nnz) for name, arr in zip(names, arrays))
+    else:
+        arrays = [pr.flux2D, pr.flux2D_ref]
+        counts = None
+    meta = dict((k, getattr(pr, k)) for k in _META_FIELDS)
+    dtype = np.result_type(*[arr.dtype for arr in arrays])
+    if dtype.name not in ('float64', 'float32'): # E.g. integer counts set by hand
+        dtype = np.float64
+    if sparse:
+        workers = 1 # Sparse lines are formatted in this process
+    elif workers is None:
+        workers = autoWorkers(sum(arr.size for arr in arrays))
+
+    with prrwriter(ofile, [(name, arr.shape) for name, arr in zip(names, arrays)],
+                   meta, sparse=counts, chunk_rows=chunk_rows, workers=workers,
+                   mask=pr._stored('mask'), dtype=dtype) as w:
+        for arr in arrays:
+            w.writearray(arr)
@@ -17,9 +17,15 @@ import os
 import math
 import numpy as np
 import pandas as pd
-from .fluxmap import fluxMap # For binning the proton list x/y values
-
-def readCarlo(fname, bin_um = 320):
+from .fluxmap import fluxMap, fluxMapSparse # For binning the proton list x/y values
+from .sparse import sparseflux
+from .directbin import directFluxMap, iterColumns, IrregularFormat
+from .outofcore import outOfCoreFluxMap
+from .fluxmap import fluxAccumulator, binStats
+from .precision import getDtype
+
+def readCarlo(fname, bin_um = 320, sparse = False, directbin = False, selections = None, outofcore = False, workers = 1,
+              dtype = None):
     """ Read in and histogram a Carlo's blob.out proton radiography file.
     Looks for a file in the same directory which specifies the detector setup.
     Histograms the list of proton positions into a flux array
@@ -27,12 +33,27 @@ def readCarlo(fname, bin_um = 320):
     Inputs:
         fn: String, full filename (including path) of the proton detector file; e.g. "/home/myouts/blob.out", where "blob.out" is the basename
         bin_um: Float, size of the square edge lengths with which to divide the detector for binning
+        sparse: Boolean, if True, return flux as a sparseflux object (non-zero bins only); flux_ref stays dense
+        directbin: Boolean, if True, histogram the protons block by block straight from the (fixed-width)
+                    text file, without loading the coordinate columns; falls back to the standard reader
+                    if the file is not fixed-width
+        selections: List of proton selections; if given, one flux map (and reference) is made per
+                    selection, all from a single pass over the file. Each selection is either
+                    a tuple (column, low, high), picking protons with low <= value < high in that
+                    zero-based file column (None for an open end), or a function taking a 2D array
+                    of all file columns (one row per proton) and returning a boolean mask
+        outofcore: Boolean, if True, histogram the protons partition by partition within a fixed
+                    memory budget (for files larger than memory; see outofcore.py). Not used with selections.
+        workers: Integer, number of processes reducing partitions in out-of-core mode
+        dtype: String, float dtype of the flux maps, 'float64' or 'float32' (default: see precision.py)
     Outputs:
         s2r_cm: Distance from the proton source to the interaction region, in cm
         s2d_cm: Distance from the proton source to the detector, in cm
         Ep_MeV: Proton energy in MeV
         flux: Numpy array, 2D, proton flux at the detector (counts/bin)
         flux_ref: Numpy array, 2D, REFERENCE proton flux at the detector (counts/bin) (flux2D_ref equals what flux2D would be in the absence of magnetic fields)
+        (With selections, flux and flux_ref are lists with one entry per selection; each reference
+        is scaled to the number of protons in its selection)
 
     Ws2r_Cmtten by Almeyahehu 2017-08-17
     """
@@ -64,42 +85,139 @@ def readCarlo(fname, bin_um = 320):
     delta = 2.0 * dmax / nbins # width of a bin
 
     num_prot = 0
+    dtype = getDtype(dtype)
 
     fd.close()
 
-
-    # Read in the file and grab the third and fourth columns for the x and y
-    # coordinates.
-    coord_xy = pd.read_csv(fname, header=None,
-                               delim_whitespace=True, comment='#',
-                               usecols=[3,4]).as_matrix()
-
-    # Initialize an array that is the correct size and then assign bin numbers
-    # to the initial coordinate matrix.
-    num_prot = coord_xy.shape[0]
-    coord_ij = np.zeros(coord_xy.shape)
-    coord_ij[:,0] = ((coord_xy[:,0] +(dmax))/(bin_um*1e-4)).astype(int)
-    coord_ij[:,1] = ((coord_xy[:,1] +(dmax))/(bin_um*1e-4)).astype(int)
-
-    # Now we need to get rid of entries that are too large/too small.
-    coord_xy = coord_xy[~((coord_ij > nbins).any(axis=1))]
-    coord_ij = coord_ij[~((coord_ij > nbins).any(axis=1))]
-    coord_xy = coord_xy[~((coord_ij < 0).any(axis=1))]
-
+    if selections is not None:
+        fluxes, counts = _histogramSelections(fname, selections, dmax, bin_um, sparse, directbin, dtype)
+        print("Calculating reference fluxes...")
+        refs = []
+        for n in counts:
+            flux2D_ref = np.zeros((nbins,nbins), dtype=dtype)
+            flux2D_ref[:] = (n * delta**2) / (math.pi * radius**2) # mean flux image of this selection
+            refs.append(flux2D_ref)
+        return s2r_cm, s2d_cm, Ep_MeV, fluxes, refs
+
+
+    flux2D = None
+    if outofcore:
+        print("Histogramming protons out of core, " + str(workers) + " process(es)...")
+        flux2D, xedges_cm, stats = outOfCoreFluxMap(fname, (3, 4), (dmax * 2), bin_um, workers=workers,
+                                                    dtype=dtype)
+        yedges_cm = xedges_cm
+        num_prot = stats['nprot']
+        print("Protons: " + str(num_prot) + "; x range (cm) " + str(stats['min'][0]) + " to " + str(stats['max'][0])
+              + ", y range (cm) " + str(stats['min'][1]) + " to " + str(stats['max'][1]))
+        if sparse:
+            flux2D = sparseflux.fromdense(flux2D)
+    elif directbin:
+        print("Histogramming protons straight from the file (direct-bin mode)...")
+        try:
+            flux2D, xedges_cm, num_prot = directFluxMap(fname, 3, 4, (dmax * 2), bin_um, dtype=dtype)
+            yedges_cm = xedges_cm
+            if sparse:
+                flux2D = sparseflux.fromdense(flux2D)
+        except IrregularFormat as e:
+            print("Note: File is not fixed-width (" + str(e) + "); using the standard reader instead...")
+            flux2D = None
+
+    if flux2D is None:
+        # Read in the file and grab the third and fourth columns for the x and y
+        # coordinates.
+        coord_xy = pd.read_csv(fname, header=None,
+                                   sep=r'\s+', comment='#',
+                                   usecols=[3,4]).values
+
+        # Initialize an array that is the correct size and then assign bin numbers
+        # to the initial coordinate matrix.
+        num_prot = coord_xy.shape[0]
+        coord_ij = np.zeros(coord_xy.shape)
+        coord_ij[:,0] = ((coord_xy[:,0] +(dmax))/(bin_um*1e-4)).astype(int)
+        coord_ij[:,1] = ((coord_xy[:,1] +(dmax))/(bin_um*1e-4)).astype(int)
+
+        # Now we need to get rid of entries that are too large/too small.
+        coord_xy = coord_xy[~((coord_ij > nbins).any(axis=1))]
+        coord_ij = coord_ij[~((coord_ij > nbins).any(axis=1))]
+        coord_xy = coord_xy[~((coord_ij < 0).any(axis=1))]
+
+        print("Histogramming protons...")
+        if sparse:
+            flux2D, xedges_cm, yedges_cm = fluxMapSparse(coord_xy[:,0], coord_xy[:,1], (dmax * 2), bin_um, dtype)
+        else:
+            flux2D, flux2D_cm2, xedges_cm, yedges_cm = fluxMap(coord_xy[:,0], coord_xy[:,1], (dmax * 2), bin_um, dtype)
 
     print("Calculating reference flux...")
     mean = (num_prot * delta**2) / (math.pi * radius**2) # average fluence distrubution
-    flux2D_ref = np.zeros((nbins,nbins))
+    flux2D_ref = np.zeros((nbins,nbins), dtype=dtype)
     flux2D_ref[:] = mean # mean flux image
 
 
-    print("Histogramming protons...")
-    flux2D, flux2D_cm2, xedges_cm, yedges_cm = fluxMap(coord_xy[:,0], coord_xy[:,1], (dmax * 2), bin_um)
-
-
     return s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref
 
 
+def _selectionMask(dat, cols, sel):
+    """ (Private) Boolean mask of the protons (rows of dat, holding file columns 'cols') picked by one selection """
+    if callable(sel):
+        return np.asarray(sel(dat), dtype=bool)
+    col, low, high = sel
+    vals = dat[:, cols.index(col)]
+    mask = np.ones(vals.shape, dtype=bool)
+    if low is not None:
+        mask &= vals >= low
+    if high is not None:
+        mask &= vals < high
+    return mask
+
+def _histogramSelections(fname, selections, dmax, bin_um, sparse=False, directbin=False, dtype=np.float64):
+    """ (Private) Histogram several selections of a Carlo proton list, parsing the file once
+    Outputs:
+        fluxes: List of flux maps (2D arrays, or sparseflux objects if sparse), one per selection
+        counts: List of integers, number of protons in each selection (on or off the detector)
+    """
+    if any(callable(sel) for sel in selections):
+        cols = None # Functions see every column
+    else:
+        cols = sorted(set([3, 4] + [sel[0] for sel in selections]))
+    xi, yi = (3, 4) if cols is None else (cols.index(3), cols.index(4))
+    allcols = cols # File column numbers of the parsed columns; all of them if cols is None
+
+    if directbin:
+        print("Histogramming " + str(len(selections)) + " selections straight from the file (direct-bin mode)...")
+        try:
+            accs = [fluxAccumulator(dmax * 2, bin_um) for sel in selections]
+            counts = [0] * len(selections)
+            for block in iterColumns(fname, cols):
+                if cols is None:
+                    allcols = list(range(block.shape[1]))
+                for k, sel in enumerate(selections):
+                    mask = _selectionMask(block, allcols, sel)
+                    counts[k] += int(np.count_nonzero(mask))
+                    accs[k].add(block[mask, xi], block[mask, yi])
+            fluxes = [acc.flux2D(dtype) for acc in accs]
+            if sparse:
+                fluxes = [sparseflux.fromdense(flux2D) for flux2D in fluxes]
+            return fluxes, counts
+        except IrregularFormat as e:
+            print("Note: File is not fixed-width (" + str(e) + "); using the standard reader instead...")
+
+    # One parse of all needed columns, shared by every selection
+    dat = pd.read_csv(fname, header=None, sep=r'\s+', comment='#', usecols=cols).values
+    if cols is None:
+        allcols = list(range(dat.shape[1]))
+
+    print("Histogramming " + str(len(selections)) + " selections of protons...")
+    fluxes, counts = [], []
+    for sel in selections:
+        mask = _selectionMask(dat, allcols, sel)
+        counts.append(int(np.count_nonzero(mask)))
+        if sparse:
+            flux2D, xedges_cm, yedges_cm = fluxMapSparse(dat[mask, xi], dat[mask, yi], (dmax * 2), bin_um, dtype)
+        else:
+            flux2D, flux2D_cm2, xedges_cm, yedges_cm = fluxMap(dat[mask, xi], dat[mask, yi], (dmax * 2), bin_um, dtype)
+        fluxes.append(flux2D)
+    return fluxes, counts
+
 def path_parse(fname, bin_um = 320):
     '''
     Parses input file and Returns the 2D array relevant to the actual magnetic
@@ -142,34 +260,24 @@ def path_parse(fname, bin_um = 320):
     nbins = int(dmax * 2 / (bin_um/10000.0)) # number of bins per dimensions
     delta = 2.0 * dmax / nbins # width of a bin
 
-    num_prot = 0
-
-    flux = np.zeros((nbins,nbins)) # num. of protons per bin
-    Bperp = np.zeros((nbins,nbins,2)) # B Path Integral
-    J = np.zeros((nbins,nbins)) # Current Path Integral
-
-    nprot = 0
-    while line:
-
-        nprot +=  1
-        xx= float(line.split()[3])
-        yy= float(line.split()[4])
-        jj = float(line.split()[8])
-        b0 = float(line.split()[9])
-        b1 = float(line.split()[10])
-        i = int((xx + dmax)/delta)
-        j = int((yy + dmax)/delta)
-
+    fd.close()
 
-        if (xx + dmax)/delta >= 0 and i < nbins and (yy + dmax)/delta >= 0 and j < nbins:
-            flux[i,j] += 1
-            Bperp[i,j,0] += b0
-            Bperp[i,j,1] += b1
-            J[i,j] += jj
+    # Proton x, y (columns 3, 4), current path integral (8) and perpendicular B path integrals (9, 10)
+    dat = pd.read_csv(fname, header=None, sep=r'\s+', comment='#', usecols=[3,4,8,9,10]).values
+    nprot = dat.shape[0]
 
-        line = fd.readline()
+    # Bin with this function's own grid ('ij' indexing: axis 0 is x); positions exactly at
+    # the low edge belong to the first bin, positions at or beyond the high edge are dropped
+    u = (dat[:,0] + dmax) / delta
+    v = (dat[:,1] + dmax) / delta
+    inside = (u >= 0) & (u < nbins) & (v >= 0) & (v < nbins)
+    index = u[inside].astype(int) * nbins + v[inside].astype(int)
 
-    fd.close()
+    # Counts, and per-pixel means of the path integrals, in a single binning pass
+    counts, stats = binStats(index, nbins**2, {'J': dat[inside,2], 'B0': dat[inside,3], 'B1': dat[inside,4]})
+    flux = counts.reshape(nbins, nbins) # num. of protons per bin
+    Bperp = np.stack([stats['B0']['mean'], stats['B1']['mean']], axis=-1).reshape(nbins, nbins, 2) # B Path Integral
+    J = stats['J']['mean'].reshape(nbins, nbins) # Current Path Integral
 
     print("Min, max, mean pixel counts, and delta: ")
     print(flux.min(), flux.max(), flux.mean(), delta)
@@ -177,13 +285,7 @@ def path_parse(fname, bin_um = 320):
     avg_fluence = nprot / (math.pi * radius**2)
     im_fluence = flux.sum() / (4 * dmax**2)
 
-    for i in range(nbins):
-        for j in range(nbins):
-            try:
-                Bperp[i,j,:] /= flux[i,j]
-                J[i,j] /= flux[i,j]
-            except ZeroDivisionError:
-                print("Zero pixel, will screw everything up.")
-                raise ValueError
+    if not flux.all():
+        print("Zero pixel, will screw everything up.") # Path integrals are NaN there
 
     return Bperp, J, avg_fluence, im_fluence
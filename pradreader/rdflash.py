@@ -14,9 +14,13 @@ TODO:
 import re
 import os
 import numpy as np
-from .fluxmap import fluxMap # For binning the proton list x/y values
+from .fluxmap import fluxMap, fluxMapSparse, getPlan # For binning the proton list x/y values
+from .sparse import sparseflux
+from .directbin import directFluxMap, IrregularFormat
+from .outofcore import outOfCoreFluxMap
+from .precision import getDtype
 
-def readFlash4(fn, bin_um = 320):
+def readFlash4(fn, bin_um = 320, sparse = False, directbin = False, outofcore = False, workers = 1, dtype = None):
     """ Read in and histogram a FLASH4 proton radiography file.
     Looks for a file in the same directory which specifies the detector setup.
     Histograms the list of proton positions into a flux array
@@ -25,6 +29,14 @@ def readFlash4(fn, bin_um = 320):
         fn: String, full filename (including path) of the proton detector file; e.g. "/home/myouts/lasslab_ProtonDetectorFile01_2.201E-09", where "lasslab_" can be any basename
             Note: The folder must also contain "lasslab_ProtonImagingDetectors.txt", "lasslab_ProtonBeamsPrint.txt", and "lasslab_ProtonImagingMainPrint.txt",  where "lasslab_" is the same basename as above
         bin_um: Float, size of the square edge lengths with which to divide the detector for binning
+        sparse: Boolean, if True, return flux2D and flux2D_ref as sparseflux objects (non-zero bins only)
+        directbin: Boolean, if True, histogram the protons block by block straight from the
+                    (fixed-width) text file, never holding the full proton list in memory; no .npz
+                    file is saved. Falls back to the standard reader if the file is not fixed-width.
+        outofcore: Boolean, if True, histogram the protons partition by partition within a fixed
+                    memory budget (for files larger than memory; see outofcore.py); no .npz file is saved
+        workers: Integer, number of processes reducing partitions in out-of-core mode
+        dtype: String, float dtype of the flux maps, 'float64' or 'float32' (default: see precision.py)
     Outputs:
         s2r_cm: Distance from the proton source to the interaction region, in cm
         s2d_cm: Distance from the proton source to the detector, in cm
@@ -57,22 +69,50 @@ def readFlash4(fn, bin_um = 320):
     _, Ep_MeV, s2r_cm, ap_deg, nprot = beamParse(folder, basenm, detnum)
 
     print("Reading the list of protons...")
-    # Read the file as a whole into memory
-    if ext == '' or ext == '.gz': # filename has no extension or '.gz', so it's the native FLASH output or a gzipped version of it
-        print("Note: Using original FLASH file this time (slow) but saving a faster NumPy .npz file for next time...")
-        dat = np.genfromtxt(fn)
-        np.savez_compressed(fn.replace('.gz', '') + '.npz', dat=dat) # Store it in .npz format for faster read-in next time
-    elif ext == '.npz': # filename has '.npz' extension; the FLASH output has been loaded into NumPy once before, then saved back in NumPy format (not a native FLASH output)
-        print("Note: Using the NumPy .npz file (fast)...")
-        with np.load(fn) as data:
-            dat = data['dat']
-    else:
-        raise(Exception("Filename extension not recognized as blank, '.gz', or '.npz'"))
-
-    [xp_cm, yp_cm] = (dat[:,(0,1)].T - 0.5) * width_cm # Convert scatter points from 0 to 1 grid into -x to +x centimeters
-
-    print("Histogramming protons...")
-    flux2D, flux2D_cm2, xedges_cm, yedges_cm = fluxMap(xp_cm, yp_cm, width_cm, bin_um)
+    dtype = getDtype(dtype)
+    flux2D = None
+    if outofcore and ext != '.npz':
+        print("Note: Histogramming protons out of core, " + str(workers) + " process(es)...")
+        # Convert scatter points from 0 to 1 grid into -x to +x centimeters, partition by partition
+        flux2D, xedges_cm, stats = outOfCoreFluxMap(fn, (0, 1), width_cm, bin_um, scale=width_cm,
+                                                    offset=0.5, workers=workers, dtype=dtype)
+        yedges_cm = xedges_cm
+        print("Protons: " + str(stats['nprot']) + "; x range (cm) " + str(stats['min'][0]) + " to " + str(stats['max'][0])
+              + ", y range (cm) " + str(stats['min'][1]) + " to " + str(stats['max'][1]))
+        if sparse:
+            flux2D = sparseflux.fromdense(flux2D)
+    elif directbin and ext != '.npz':
+        print("Note: Histogramming protons straight from the FLASH file (direct-bin mode)...")
+        try:
+            # Convert scatter points from 0 to 1 grid into -x to +x centimeters, block by block
+            flux2D, xedges_cm, _ = directFluxMap(fn, 0, 1, width_cm, bin_um, scale=width_cm, offset=0.5, dtype=dtype)
+            yedges_cm = xedges_cm
+            if sparse:
+                flux2D = sparseflux.fromdense(flux2D)
+        except IrregularFormat as e:
+            print("Note: FLASH file is not fixed-width (" + str(e) + "); using the standard reader instead...")
+            flux2D = None
+
+    if flux2D is None:
+        # Read the file as a whole into memory
+        if ext == '' or ext == '.gz': # filename has no extension or '.gz', so it's the native FLASH output or a gzipped version of it
+            print("Note: Using original FLASH file this time (slow) but saving a faster NumPy .npz file for next time...")
+            dat = np.genfromtxt(fn)
+            np.savez_compressed(fn.replace('.gz', '') + '.npz', dat=dat) # Store it in .npz format for faster read-in next time
+        elif ext == '.npz': # filename has '.npz' extension; the FLASH output has been loaded into NumPy once before, then saved back in NumPy format (not a native FLASH output)
+            print("Note: Using the NumPy .npz file (fast)...")
+            with np.load(fn) as data:
+                dat = data['dat']
+        else:
+            raise(Exception("Filename extension not recognized as blank, '.gz', or '.npz'"))
+
+        [xp_cm, yp_cm] = (dat[:,(0,1)].T - 0.5) * width_cm # Convert scatter points from 0 to 1 grid into -x to +x centimeters
+
+        print("Histogramming protons...")
+        if sparse:
+            flux2D, xedges_cm, yedges_cm = fluxMapSparse(xp_cm, yp_cm, width_cm, bin_um, dtype)
+        else:
+            flux2D, flux2D_cm2, xedges_cm, yedges_cm = fluxMap(xp_cm, yp_cm, width_cm, bin_um, dtype)
 
     print("Calculating reference flux (small angle approx.)...")
     # TODO: Lose the small angle approximation
@@ -93,11 +133,13 @@ def readFlash4(fn, bin_um = 320):
 
     prot_bin = prot_cm2 * (bin_um * 1.0e-4)**2 # Beam protons per flux bin
 
-    X, Y = np.meshgrid((xedges_cm[:-1] + xedges_cm[1:]) / 2.0, (yedges_cm[:-1] + yedges_cm[1:]) / 2.0)
-    R = np.sqrt(X**2 + Y**2)
+    index = getPlan(width_cm, bin_um).disk(protrad_cm) # Bins inside the undeflected beam (memoized per geometry)
 
-    flux2D_ref = np.zeros(flux2D.shape)
-    flux2D_ref[R < protrad_cm] = prot_bin
+    if sparse: # Store only the bins inside the undeflected beam
+        flux2D_ref = sparseflux(flux2D.shape, index.copy(), np.full(index.size, prot_bin, dtype=dtype))
+    else:
+        flux2D_ref = np.zeros(flux2D.shape, dtype=dtype)
+        flux2D_ref.flat[index] = prot_bin
 
     return s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref
 
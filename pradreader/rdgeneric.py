@@ -1,19 +1,91 @@
 """
 rdgeneric.py: Proton radiography readers for generic formats, like CSV.
 
-Currently only supports readers for the csv-style file format (np.loadtxt).
+Currently only supports readers for the csv-style file format (comma or
+whitespace delimited). Files are parsed in bulk by a C parser (np.loadtxt on
+NumPy 1.23 and later, pandas on older NumPy, whose loadtxt is pure Python), and
+can optionally be cached in a NumPy '.npy' sidecar file for near-instant re-reads.
 
 Created by Scott Feister on Fri Oct 20 14:00:22 2017
 """
 
+import os
+import tempfile
 import numpy as np
+import pandas as pd
+from .reference import referenceFlux
+from .precision import getDtype
 
-def readtxt(fn, delimiter=None):
+_LOADTXT_IN_C = tuple(int(v) for v in np.__version__.split('.')[:2]) >= (1, 23) # np.loadtxt rewritten in C
+
+def sniffDelimiter(fn):
+    """
+    Guess the value delimiter of a text file from its first data line.
+
+    Inputs:
+        fn (str): Full file name.
+
+    Outputs:
+        delimiter (str): ',' for comma-delimited files; None for whitespace.
+    """
+    _, line = _firstDataLine(fn)
+    if line is None:
+        return None
+    return ',' if ',' in line else None
+
+def _firstDataLine(fn):
+    """ (Private) Number of comment and blank lines at the top of a text file, and its first data line
+    (without comment or surrounding whitespace; None if there is none) """
+    with open(fn) as f:
+        for nskip, line in enumerate(f):
+            line = line.split('#')[0].strip()
+            if line:
+                return nskip, line
+    return 0, None
+
+def sidecarName(fn):
+    """ Name of the binary (.npy) sidecar cache of a text file """
+    return fn + '.npy'
+
+def _loadSidecar(fn):
+    """ (Private) Memory-map the sidecar of fn, or return None if there is none or it is older than fn """
+    scfn = sidecarName(fn)
+    try:
+        if os.path.getmtime(scfn) < os.path.getmtime(fn):
+            return None
+    except OSError: # No sidecar
+        return None
+    return np.load(scfn, mmap_mode='r')
+
+def _saveSidecar(fn, flux2D):
+    """ (Private) Write the sidecar of fn (atomically; skipped with a note if the folder is read-only) """
+    from .cache import replaceFile
+    try:
+        fd, tmpfn = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(fn)))
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, flux2D)
+        replaceFile(tmpfn, sidecarName(fn))
+    except (IOError, OSError) as e:
+        print("Note: Could not write sidecar file for '" + fn + "': " + str(e))
+
+def readtxt(fn, delimiter=None, roi=None, sidecar=False, reference='mean', dtype=None):
     """
     Read in a generic text file containing a 2D flux array as delimited values.
 
     Inputs:
         fn (str): Full file name.
+        delimiter (str): Value delimiter; None for whitespace; 'auto' to guess
+                         it from the first line (see sniffDelimiter).
+        roi (tuple): Optional region of interest (y0, y1, x0, x1) to read (see
+                     roi.py). Rows outside it are skipped without being parsed.
+        sidecar (bool): If True, keep a binary copy of the full array next to
+                        the file ('<fn>.npy') and read from it while it is
+                        newer than the file.
+        reference (str): Reference flux estimate: 'mean', 'poly' or 'gauss'
+                         (see reference.py).
+        dtype (str): Float dtype of the flux arrays, 'float64' or 'float32'
+                     (default: see precision.py). The sidecar always keeps
+                     the full float64 values.
 
     Outputs:
         flux2D (array): Numpy 2D array of proton flux at the detector
@@ -21,10 +93,49 @@ def readtxt(fn, delimiter=None):
         flux2D_ref (array): REFERENCE proton flux at the detector (counts/bin).
                             Equals what flux2D would be in the
                             absence of magnetic fields.
+                            (Estimated from the flux in the region read.)
     """
-    # Open up the file for reading.
-    flux2D = np.loadtxt(fn, delimiter=delimiter)
-    flux2D_ref = np.zeros(flux2D.shape)
-    flux2D_ref[:] = np.mean(flux2D)
+    if delimiter == 'auto':
+        delimiter = sniffDelimiter(fn)
+    dtype = getDtype(dtype)
+
+    flux2D = _loadSidecar(fn) if sidecar else None
+    if flux2D is not None:
+        print("Note: Using the NumPy sidecar file '" + sidecarName(fn) + "' (fast)...")
+        if roi is not None:
+            y0, y1, x0, x1 = roi
+            flux2D = flux2D[y0:y1, x0:x1]
+        flux2D = np.array(flux2D, dtype=dtype) # Copy out of the memory map
+    elif roi is None or sidecar:
+        flux2D = _parse(fn, delimiter, dtype=np.float64 if sidecar else dtype)
+        if sidecar:
+            _saveSidecar(fn, flux2D)
+            if roi is not None:
+                y0, y1, x0, x1 = roi
+                flux2D = flux2D[y0:y1, x0:x1]
+            flux2D = flux2D.astype(dtype, copy=roi is not None) # A cropped region must not hold the whole array
+    else:
+        y0, y1, x0, x1 = roi
+        nskip, line = _firstDataLine(fn) # Comment lines at the top count as rows for skiprows, not for the ROI
+        ncols = 0 if line is None else len(line.split(delimiter)) # Row length, to resolve the column range
+        cols = range(*slice(x0, x1).indices(ncols))
+        if len(cols) == 0:
+            raise(ValueError("Region of interest has no columns inside the " + str(ncols) + " column(s) of the file"))
+        flux2D = _parse(fn, delimiter, usecols=list(cols), skiprows=nskip + (y0 or 0),
+                        nrows=None if y1 is None else max(y1 - (y0 or 0), 0), dtype=dtype)
+
+    flux2D_ref = referenceFlux(flux2D, method=reference)
 
     return(flux2D, flux2D_ref)
+
+def _parse(fn, delimiter, usecols=None, skiprows=0, nrows=None, dtype=np.float64):
+    """ (Private) Parse a delimited text file of floats into a 2D array, in bulk (C parser) """
+    if nrows == 0:
+        return np.zeros((0, len(usecols)), dtype=dtype)
+    if _LOADTXT_IN_C:
+        return np.loadtxt(fn, delimiter=delimiter, ndmin=2, usecols=usecols, skiprows=skiprows, max_rows=nrows,
+                          dtype=dtype)
+    df = pd.read_csv(fn, header=None, sep=r'\s+' if delimiter is None else delimiter,
+                     comment='#', usecols=usecols, skiprows=skiprows, nrows=nrows,
+                     dtype=np.float64, float_precision='round_trip', engine='c') # Same values as np.loadtxt
+    return df.values.astype(dtype, copy=False)
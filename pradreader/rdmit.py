@@ -8,16 +8,26 @@ TODO:
 """
 
 import csv
+from itertools import islice
 import numpy as np
 import re
+from .roi import roiBounds
+from .reference import referenceFlux
+from .precision import getDtype
 
-def readmitcsv(fn):
+def readmitcsv(fn, roi=None, reference='mean', dtype=None):
     """
     Read in a CSV file in the MIT format and return the proton histogram and
     the bin size.
 
     Inputs:
         fn (str): Full file name.
+        roi (tuple): Optional region of interest (y0, y1, x0, x1) of the image
+                     to read (see roi.py). File rows outside it are not parsed.
+        reference (str): Reference flux estimate: 'mean', 'poly' or 'gauss'
+                         (see reference.py).
+        dtype (str): Float dtype of the flux arrays, 'float64' or 'float32'
+                     (default: see precision.py).
 
     Outputs:
         flux2D (array): Numpy 2D array of proton flux at the detector
@@ -25,6 +35,7 @@ def readmitcsv(fn):
         flux2D_ref (array): REFERENCE proton flux at the detector (counts/bin).
                             Equals what flux2D would be in the 
                             absence of magnetic fields.
+                            (Estimated from the flux in the region read.)
         bin_um (float): Pixel size in um.
     """
     # Open up the file for reading.
@@ -43,7 +54,8 @@ def readmitcsv(fn):
         # Note: dim1 is the vert dim, dim2 is the horiz dim.
         dim2 = int(re.search('(?<=\= )\w+', dim_str).group(0))
         dim1 = int(re.search('(?<=x )\w+', dim_str).group(0))
-        flux2D = np.zeros((dim1, dim2))
+        y0, y1, x0, x1 = roiBounds(roi, (dim1, dim2))
+        flux2D = np.zeros((y1 - y0, x1 - x0), dtype=getDtype(dtype))
 
         # Grab the first value from the 3rd line, which will be a string
         # specifying the pixel size.
@@ -57,9 +69,13 @@ def readmitcsv(fn):
             next(reader)
 
         # Read in the rest of the file as a numpy array.
-        for i, row in enumerate(reader):
-            for j, word in enumerate(row):
-                flux2D[i,j] = float(word)
+        # The file is stored bottom row first, so image rows y0..y1 are file rows dim1-y1..dim1-y0.
+        # File rows before the region are skipped as raw lines, without csv parsing
+        # (the csv reader pulls one line from the file per row, so it resumes after them).
+        for _ in islice(csvfile, dim1 - y1):
+            pass
+        for k, row in enumerate(islice(reader, y1 - y0)):
+            flux2D[k,:] = np.array(row[x0:x1], dtype=float)
 
         # Flip the array upside down, since the top row of the array
         # in the file corresponds to the bottom row of the image, and the left
@@ -67,9 +83,7 @@ def readmitcsv(fn):
         flux2D = np.flipud(flux2D)
 
         # Calculate the reference flux image.
-        # TODO: Get a better reference flux image.
-        flux2D_ref = np.zeros((dim1, dim2))
-        flux2D_ref[:] = np.mean(flux2D)
+        flux2D_ref = referenceFlux(flux2D, method=reference)
         
     return(flux2D, flux2D_ref, bin_um)
 
@@ -9,7 +9,9 @@ Created by Scott Feister, J.T. Laune, and Alemayehu Bogale on Fri Jul 28 18:11:4
 
 import sys
 import os
-import datetime
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 # Python3 style input commmand even in Python2; get via "pip install future"
 from builtins import input
 from re import match
@@ -21,8 +23,33 @@ except:
 from .rdflash import readFlash4
 from .rdmit import readmitcsv
 from .rdcarlo import readCarlo
-from .fluxmap import fluxPlot
+from .fluxmap import fluxPlot, fluenceContrast
+from .contrast import contrastMap
 from .rdgeneric import readtxt
+from .sparse import sparseflux
+from . import cache as resultcache
+from . import shmem
+from .validate import validate as validatePrad
+from .prr import writePRR
+from .roi import roiBounds, crop
+from .mask import fluxmask, genmask
+from .precision import getDtype, checkDtype
+
+class _floatattr(object):
+    """
+    (Private) Descriptor for an optional float attribute of a prad object, kept in a slot.
+    Values are stored as Python floats (or None), whatever numeric type is assigned.
+    """
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj, self.slot)
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, None if value is None else float(value))
 
 class prad(object):
     """
@@ -44,11 +71,42 @@ class prad(object):
         bin_um (float): Pixel size of radiograph (in um)
         flux2D (array): 2D array of flux values
         flux2D_ref (array): 2D array of reference flux values
+            (either flux array may be held internally as a sparseflux object;
+             it is converted to a dense array when first accessed)
+        mask (array): 2D boolean array of the pixels to use (True), or None
+            for all pixels; see genmask()
 
     Outputs:
 
     """
+    # Public attributes, in the order they are pickled and shown
+    _fields = ('filename', 'rtype', 's2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um',
+               'flux2D', 'flux2D_ref', 'mask')
+
+    # Per-instance storage; no instance __dict__, to keep many prad handles cheap
+    __slots__ = ('filename', 'rtype', '_s2r_cm', '_s2d_cm', '_Ep_MeV', '_bin_um',
+                 '_flux2D', '_flux2D_ref', '_mask',
+                 '_versions', # Number of times flux2D, flux2D_ref and mask were set (for cached results)
+                 '_contrast') # Cached (versions, map, stats) of contrast()
+
+    s2r_cm = _floatattr('_s2r_cm')
+    s2d_cm = _floatattr('_s2d_cm')
+    Ep_MeV = _floatattr('_Ep_MeV')
+    bin_um = _floatattr('_bin_um')
+
+    # Prompts (shared by all instances).
+    prompts = {
+            'rtype'  : 'Type of file? Options are "prr", "carlo",' \
+                        '"mitcsv", "csv", "flash4": ',
+            's2r_cm' : 'Distance from the source to the plasma (in cm): ',
+            's2d_cm' : 'Distance from the source to the screen (in cm): ' ,
+            'Ep_MeV' : 'Proton energy (in MeV): ',
+            'bin_um' : 'Pixel size of radiograph (in um): ',
+            }
+
     def __init__(self, ifile=None):
+        self._versions = {'flux2D': 0, 'flux2D_ref': 0, 'mask': 0}
+        self._contrast = None
         # Attributes.
         self.filename = ifile
         self.rtype = None
@@ -58,16 +116,28 @@ class prad(object):
         self.s2d_cm = None
         self.Ep_MeV = None
         self.bin_um = None
-
-        # Prompts.
-        self.prompts = {
-                'rtype'  : 'Type of file? Options are "prr", "carlo",' \
-                            '"mitcsv", "csv", "flash4": ',
-                's2r_cm' : 'Distance from the source to the plasma (in cm): ',
-                's2d_cm' : 'Distance from the source to the screen (in cm): ' ,
-                'Ep_MeV' : 'Proton energy (in MeV): ',
-                'bin_um' : 'Pixel size of radiograph (in um): ',
-                }
+        self.mask = None
+
+    def __getstate__(self):
+        """ Pickle only the attribute values; flux maps are pickled in their stored (dense or sparse) form """
+        state = {}
+        for k in self._fields:
+            val = self._stored(k)
+            if val is not None:
+                state[k] = val
+        return state
+
+    def _stored(self, k):
+        """ (Private) Value of attribute k as stored, without densifying sparse flux maps """
+        return getattr(self, '_' + k) if k.startswith('flux2D') or k == 'mask' else getattr(self, k)
+
+    def __setstate__(self, state):
+        """ Restore from pickled attribute values (also accepts pickles of older, __dict__-based prad objects) """
+        self.__init__()
+        for k, val in state.items():
+            if k == 'prompts': # Older pickles carried the prompts along
+                continue
+            setattr(self, k, val)
 
     def __str__(self):
         return ("Prad object from '"
@@ -77,12 +147,111 @@ class prad(object):
     def show(self):
         """ Display details of the prad object """
         print("~~~~~~~ PRAD OBJECT CONTENTS ~~~~~~~")
-        keys = vars(self).keys()
-        goodkeys = set(keys) - {'prompts'} # Don't show the 'prompts'
-        for k in sorted(goodkeys, key=str.lower):
-            print(k + ": " + str(getattr(self, k)))
+        for k in sorted(self._fields, key=str.lower):
+            print(k + ": " + str(self._stored(k)))
         print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
+    @property
+    def flux2D(self):
+        """ 2D array of flux values (a stored sparse map is made dense on first access) """
+        if isinstance(self._flux2D, sparseflux):
+            self._flux2D = self._flux2D.todense()
+        return self._flux2D
+
+    @flux2D.setter
+    def flux2D(self, value):
+        self._flux2D = value
+        self._versions['flux2D'] += 1
+
+    @property
+    def flux2D_ref(self):
+        """ 2D array of reference flux values (a stored sparse map is made dense on first access) """
+        if isinstance(self._flux2D_ref, sparseflux):
+            self._flux2D_ref = self._flux2D_ref.todense()
+        return self._flux2D_ref
+
+    @flux2D_ref.setter
+    def flux2D_ref(self, value):
+        self._flux2D_ref = value
+        self._versions['flux2D_ref'] += 1
+
+    @property
+    def flux2D_sparse(self):
+        """ Flux values as a sparseflux object (without densifying the stored map) """
+        return _asSparse(self._flux2D)
+
+    @property
+    def flux2D_ref_sparse(self):
+        """ Reference flux values as a sparseflux object (without densifying the stored map) """
+        return _asSparse(self._flux2D_ref)
+
+    @property
+    def mask(self):
+        """ 2D boolean array of the pixels to use (True), or None if no mask is set """
+        return None if self._mask is None else self._mask.bits
+
+    @mask.setter
+    def mask(self, value):
+        if value is None or isinstance(value, fluxmask):
+            self._mask = value
+        else:
+            self._mask = fluxmask(value)
+        self._versions['mask'] += 1
+
+    def genmask(self, xrange=None, yrange=None, circles=None, polygons=None):
+        """
+        Generate the mask of pixels to use from simple geometry (see mask.py).
+        A pixel is used if its center lies within the x/y ranges and inside any
+        of the circles or polygons (or anywhere, if none are given).
+        Inputs:
+            xrange, yrange: Tuples (low, high), ranges of pixel coordinates to keep
+                        (x along axis 1, y along axis 0); None for no limit
+            circles: List of (xc, yc, radius) tuples, in pixels
+            polygons: List of polygons, each a list of (x, y) vertices, in pixels
+        Masks with the same geometry and shape are reused, not rebuilt.
+        """
+        flux = self._stored('flux2D')
+        if flux is None:
+            raise(Exception("Cannot generate a mask before the flux map is read"))
+        self.mask = genmask(flux.shape, xrange=xrange, yrange=yrange,
+                            circles=circles, polygons=polygons)
+        print("Mask generated: " + str(self._mask.npix) + " of "
+              + str(flux.shape[0] * flux.shape[1]) + " pixels used.")
+
+    def maskedStats(self, k='flux2D'):
+        """
+        Sum, mean, min and max of a flux map over the pixels in the mask (dict),
+        without densifying sparse maps or touching pixels outside the mask's
+        bounding box. Without a mask, all pixels are used.
+        Inputs:
+            k: String, 'flux2D' or 'flux2D_ref'
+        """
+        flux = self._stored(k)
+        mask = self._mask if self._mask is not None else fluxmask(np.ones(flux.shape, dtype=bool))
+        return mask.reduce(flux)
+
+    def contrast(self, percentiles=(1, 50, 99)):
+        """
+        Fluence contrast map, (flux2D - flux2D_ref) / flux2D_ref, and its statistics (wrapper for contrast.contrastMap)
+        Computed in one pass over the arrays; pixels outside the mask or with no
+        positive reference flux are NaN and left out of the statistics.
+        The result is kept and returned again until flux2D, flux2D_ref or mask is
+        set anew (after changing a flux array in place, set it again, e.g.
+        pr.flux2D = pr.flux2D, to have the contrast recomputed).
+        Inputs:
+            percentiles: Sequence of percentiles (0 to 100) of the contrast to report
+        Outputs:
+            contrast: 2D NumPy array (read-only), the fluence contrast map
+            stats: dict with 'pixels', 'min', 'max', 'mean' and 'percentiles' (dict of percentile => value)
+        """
+        key = (self._versions['flux2D'], self._versions['flux2D_ref'], self._versions['mask'],
+               tuple(percentiles))
+        if self._contrast is None or self._contrast[0] != key:
+            cmap, stats = contrastMap(self.flux2D, self.flux2D_ref, mask=self._mask, percentiles=percentiles)
+            cmap.setflags(write=False) # Shared by every caller
+            self._contrast = (key, cmap, stats)
+        return self._contrast[1], self._contrast[2]
+
     # TODO: Make the prompting more general, to handle strings AND numbers
     def prompt(self):
         """
@@ -101,6 +270,16 @@ class prad(object):
                 setattr(self, key, tuple(map(float, input(self.prompts[key]).split())))
 
 
+    def promptRead(self):
+        """
+        If not set, prompt the user for what read() needs: the file type, and the
+        bin size of proton lists (flash4, carlo). read() calls this itself.
+        """
+        if self.rtype is None:
+            self.rtype = input(self.prompts['rtype'])
+        if self.rtype in ('flash4', 'carlo') and self.bin_um == None:
+            self.bin_um = float(input(self.prompts['bin_um']))
+
     # TODO: Expand this to make a labeled plot the geometry of the target/detector
     # TODO: Test this function works
     def plot(self, plotdir='plots'):
@@ -126,52 +305,118 @@ class prad(object):
         fluxPlot(os.path.join(plotdir, "reference_flux.png"), self.flux2D_ref, self.bin_um)
         print("Plots saved into directory '" + plotdir + "'")
 
-    def read(self):
+    def plotContrast(self, plotdir='plots', vmin=None, vmax=None, cmap='viridis'):
+        """
+        Save a fluence contrast plot (wrapper for fluxmap.fluenceContrast), reusing contrast()
+        Inputs:
+            plotdir: string, Desired output folder for the output plot (created if not existing)
+            vmin, vmax: Floats, color scale limits (default: the contrast min and max)
+            cmap: Colormap for the plot
+        Output files:
+            PNG of the fluence contrast map
+        """
+        try: # Python2&3 equivalent of os.makedirs(plotdir, exist_ok=True)
+            os.makedirs(plotdir)
+        except OSError:
+            if not os.path.isdir(plotdir):
+                raise
+        fluenceContrast(os.path.join(plotdir, "contrast.png"), None, None, self.bin_um,
+                        vmin=vmin, vmax=vmax, cmap=cmap, contrast=self.contrast())
+        print("Contrast plot saved into directory '" + plotdir + "'")
+
+    def read(self, sparse=False, cache=None, roi=None, directbin=False, sidecar=False,
+             outofcore=False, workers=1, reference='mean', dtype=None):
         """
         Read in a proton radiography input file
+        Inputs:
+            sparse: Boolean, if True, keep the flux maps in sparse form until
+                        they are accessed as arrays. List-based formats (flash4,
+                        carlo) are histogrammed straight into sparse form.
+            cache: cache.resultcache object to look up and store the read
+                        results in, or False to bypass caching. Defaults to the
+                        cache set by cache.enable() (no caching if none).
+            roi: Tuple (y0, y1, x0, x1), region of interest of the flux maps to
+                        keep (see roi.py). Text grids (prr, csv, mitcsv) parse only
+                        the rows and columns inside it; proton lists (flash4,
+                        carlo) are histogrammed in full and then cropped.
+            directbin: Boolean, if True, proton lists (flash4, carlo) in fixed-width
+                        text are histogrammed block by block straight from the file,
+                        without loading the proton coordinates (see directbin.py).
+                        Results are identical, so cached results are shared.
+            sidecar: Boolean, if True, csv files keep a binary '.npy' copy of their
+                        array next to them, which later reads use while it is
+                        newer than the file (see rdgeneric.py).
+            outofcore: Boolean, if True, proton lists (flash4, carlo) are histogrammed
+                        in partitions within a fixed memory budget, for files larger
+                        than memory (see outofcore.py).
+            workers: Integer, number of processes used in out-of-core mode
+            reference: String, reference flux estimate for gridded formats (csv,
+                        mitcsv): 'mean' (constant), 'poly' (smooth polynomial fit)
+                        or 'gauss' (wide Gaussian smoothing); see reference.py
+            dtype: String, float dtype of the flux maps, 'float64' or 'float32'
+                        (half the memory; see precision.py). Defaults to the dtype
+                        set by precision.setDtype(), or else float64; PRR files
+                        written as float32 are read as float32.
         """
-        if self.rtype is None:
-            self.rtype = input(self.prompts['rtype'])
+        self.promptRead()
+
+        self.mask = None # Any previous mask may not fit the new flux maps (PRR files carry their own)
+
+        if cache is None:
+            cache = resultcache.getDefault()
+        if cache and self.rtype != 'prr': # PRR files are already a finished result
+            params = {'bin_um': self.bin_um, 'sparse': sparse, 'roi': roi}
+            if reference != 'mean': # Keeps the keys of earlier cache entries valid
+                params['reference'] = reference
+            if getDtype(dtype) != np.float64:
+                params['dtype'] = getDtype(dtype).name
+            key = cache.key(self.filename, self.rtype, **params)
+            if cache.restore(key, self):
+                print("Read results of file '" + self.filename + "' loaded from cache.")
+                return
+        else:
+            cache = None
 
         print("Reading contents of file: " + self.filename)
 
         if self.rtype == 'prr':
-            self.readPRR() # Intermediate file format; replace everything
+            self.readPRR(roi=roi, dtype=dtype) # Intermediate file format; replace everything
 
         elif self.rtype == 'flash4':
-            if self.bin_um == None:
-                self.bin_um = float(input(self.prompts['bin_um']))
             s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref = readFlash4(
                                                             self.filename,
-                                                            self.bin_um)
-            self.flux2D = flux2D
-            self.flux2D_ref = flux2D_ref
+                                                            self.bin_um,
+                                                            sparse=sparse,
+                                                            directbin=directbin,
+                                                            outofcore=outofcore,
+                                                            workers=workers,
+                                                            dtype=dtype)
+            self.flux2D = crop(flux2D, roi)
+            self.flux2D_ref = crop(flux2D_ref, roi)
             self.s2r_cm = s2r_cm
             self.s2d_cm = s2d_cm
             self.Ep_MeV = Ep_MeV
 
         elif self.rtype == 'mitcsv':
-            flux2D, flux2D_ref, bin_um = readmitcsv(self.filename)
+            flux2D, flux2D_ref, bin_um = readmitcsv(self.filename, roi=roi, reference=reference, dtype=dtype)
             self.flux2D = flux2D
             self.flux2D_ref = flux2D_ref
             self.bin_um = bin_um
 
         elif self.rtype == 'csv':
-            try:
-                flux2D, flux2D_ref = readtxt(self.filename, delimiter=',')
-            except(ValueError):
-                flux2D, flux2D_ref = readtxt(self.filename)
+            # Comma or whitespace delimiter, guessed from the first line (one parse only)
+            flux2D, flux2D_ref = readtxt(self.filename, delimiter='auto', roi=roi, sidecar=sidecar,
+                                         reference=reference, dtype=dtype)
 
             self.flux2D = flux2D
             self.flux2D_ref = flux2D_ref
 
         elif self.rtype == 'carlo':
-            if self.bin_um == None:
-                self.bin_um = float(input(self.prompts['bin_um']))
-            s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref= readCarlo(self.filename,self.bin_um)
+            s2r_cm, s2d_cm, Ep_MeV, flux2D, flux2D_ref= readCarlo(self.filename,self.bin_um,sparse=sparse,directbin=directbin,
+                                                                outofcore=outofcore,workers=workers,dtype=dtype)
 
-            self.flux2D = flux2D
-            self.flux2D_ref = flux2D_ref
+            self.flux2D = crop(flux2D, roi)
+            self.flux2D_ref = crop(flux2D_ref, roi)
             self.s2r_cm = s2r_cm
             self.s2d_cm = s2d_cm
             self.Ep_MeV = Ep_MeV
@@ -180,19 +425,41 @@ class prad(object):
             raise(Exception("Proton radiography type "
                             + str(self.rtype) + " not recognized"))
 
+        if sparse: # Gridded formats are read dense; compact them afterwards
+            self.flux2D = _asSparse(self._flux2D)
+            self.flux2D_ref = _asSparse(self._flux2D_ref)
+
+        if cache:
+            cache.store(key, self)
+
         print("File read complete.")
 
-    def validate(self):
-        """ Ensure the validity of the elements """
+    def validate(self, mode='full', strict=False):
+        """ Ensure the validity of the elements (wrapper for validate.validate)
+        Inputs:
+            mode: String, 'full' to check every pixel (threaded), or 'sample'
+                    to check an evenly spaced subset of rows (fast, for huge images)
+            strict: Boolean, if True, raise a ValueError when errors are found
+        Outputs:
+            report: validate.validationreport object listing errors and warnings
+        """
         print("Validating elements of the prad object...")
-        #TODO: Validate the object here!
-        pass
-        print("[No validation function written! Continuing...]")
+        report = validatePrad(self, mode=mode)
+        print(report)
+        if strict and not report.ok:
+            raise(ValueError("Invalid prad object from '" + str(self.filename) + "':\n" + str(report)))
+        return report
 
-    def write(self, ofile='input.txt'):
+    def write(self, ofile='input.txt', sparse=False, workers=1):
         """ Create an intermediate text file
         Inputs:
             ofile: Desired output filepath (e.g. "input.txt")
+            sparse: Boolean, if True, store the flux arrays as lists of non-zero
+                        pixels ("row,col,value" lines; PRR v1.02a). Otherwise,
+                        write dense arrays (PRR v1.01a).
+            workers: Integer, number of processes formatting rows in parallel (opt-in;
+                        None for prr.autoWorkers' choice). Starting processes needs an
+                        "if __name__ == '__main__':" guard in scripts on macOS and Windows.
         Output file:
             input.txt (file): the intermediate file for every file input
                 e.g. contains s2r_cm, s2d_cm, Ep_MeV, bin_um,
@@ -202,43 +469,55 @@ class prad(object):
         """
 
         print("Writing intermediate prad object file.")
-        with open(ofile, 'w') as out:
-            out.write('# PRadReader (PRR) Generated Input File v1.01a\n')
-            out.write('# Date generated: '
-                      +str(datetime.datetime.now().date()) + ' '
-                      +str(datetime.datetime.now().time()) + '\n')
-            out.write("# s2r_cm " + str(self.s2r_cm) + "\n")
-            out.write("# s2d_cm " + str(self.s2d_cm) + "\n")
-            out.write("# Ep_MeV " + str(self.Ep_MeV) + "\n")
-            out.write("# bin_um " + str(self.bin_um) + "\n")
-
-            out.write("# flux2D " + str(self.flux2D.shape) + "\n")
-            out.write("# flux2D_ref " + str(self.flux2D_ref.shape) + "\n")
-
-        with open(ofile, 'ab') as out:
-            np.savetxt(out, self.flux2D, delimiter=',', newline='\n')
-            np.savetxt(out, self.flux2D_ref, delimiter=',', newline='\n')
+        writePRR(ofile, self, sparse=sparse, workers=workers)
 
         print("Intermediate prad object file written to '" + ofile + "'.")
 
+    def share(self, backend='shm', folder=None):
+        """
+        Copy the flux maps into shared memory for zero-copy use by other processes (wrapper for shmem.share)
+        Inputs:
+            backend: String, 'shm' (multiprocessing.shared_memory) or 'mmap' (memory-mapped temporary files)
+            folder: String, folder for the 'mmap' backend's files
+        Outputs:
+            handle: Small picklable shmem.pradhandle; workers call shmem.attach(handle)
+                        to get a prad object viewing the same memory. Call
+                        handle.release() when all workers are done.
+        """
+        return shmem.share(self, backend=backend, folder=folder)
+
     def pickle(self, ofile="input.p"):
         """
         Write a pickled pradreader object. Use for only quick-and-dirty cases.
         """
         print("Writing pickled prad object file.")
-        pickle.dump(self, open(ofile, 'wb'))
+        with open(ofile, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL) # Binary protocol; arrays are stored as raw buffers
         print("Pickled prad object file written to '" + ofile + "'.")
 
-    def readPRR(self):
+    def readPRR(self, roi=None, dtype=None):
         """
         (Private) Read the pradreader intermediate file format
+        Inputs:
+            roi: Tuple (y0, y1, x0, x1), optional region of interest to read;
+                    rows outside it are skipped without being parsed
+            dtype: String, float dtype of the flux maps (default: the dtype the
+                    file was written in, if given in its header; else see precision.py)
         """
         # TODO here: Check the PRR file version is appropriate!
+        blocks = [] # (name, shape, nnz) for each array in the file; nnz is None for dense arrays
+        mask = None
+        filedtype = None
         with open(self.filename) as f:
             # TODO here: Read in the file contents!
             line = f.readline()
             while match('#', line):
 
+                m = match(r'# (flux2D\w*) \((\d+), (\d+)\)(?: sparse (\d+))?', line)
+                if m:
+                    nnz = None if m.group(4) is None else int(m.group(4))
+                    blocks.append((m.group(1), (int(m.group(2)), int(m.group(3))), nnz))
+
                 if match('# s2r_cm', line):
                     self.s2r_cm = float(line.split()[2])
 
@@ -251,12 +530,41 @@ class prad(object):
                 if match('# bin_um', line):
                     self.bin_um = float(line.split()[2])
 
+                if match('# dtype', line):
+                    filedtype = line.split()[2]
+
+                m = match(r'# mask \((\d+), (\d+)\) (\S+)', line)
+                if m:
+                    mask = fluxmask.decode(m.group(3), (int(m.group(1)), int(m.group(2))))
+
 
                 line = f.readline()
 
-        tot_arr = np.loadtxt(self.filename, comments="#", delimiter=",")
+            dtype = getDtype(dtype) if dtype is not None or filedtype is None else checkDtype(filedtype)
+            if roi is not None or any(nnz is not None for _, _, nnz in blocks):
+                arrays = {}
+                lines = chain([line], f) # Data lines, starting with the one already read
+                for name, shape, nnz in blocks:
+                    if nnz is None:
+                        y0, y1, x0, x1 = roiBounds(roi, shape)
+                        deque(islice(lines, y0), maxlen=0) # Skip rows above the region
+                        arrays[name] = np.loadtxt(islice(lines, y1 - y0), delimiter=",", ndmin=2,
+                                                  usecols=range(x0, x1), dtype=dtype)
+                        deque(islice(lines, shape[0] - y1), maxlen=0) # Skip rows below the region
+                    elif nnz == 0:
+                        arrays[name] = crop(sparseflux(shape, [], np.zeros(0, dtype=dtype)), roi)
+                    else:
+                        coo = np.loadtxt(islice(lines, nnz), delimiter=",", ndmin=2)
+                        arrays[name] = crop(sparseflux.fromcoords(shape, coo[:,0], coo[:,1], coo[:,2].astype(dtype)), roi)
+                self.flux2D, self.flux2D_ref = arrays['flux2D'], arrays['flux2D_ref']
+                if mask is not None:
+                    self.mask = mask.crop(roi) if roi is not None else mask
+                return
+
+        tot_arr = np.loadtxt(self.filename, comments="#", delimiter=",", dtype=dtype)
         print(tot_arr.shape)
         self.flux2D, self.flux2D_ref = np.split(tot_arr, 2, axis=0)
+        self.mask = mask
 
 
 def loadPRR(ifile='input.txt'):
@@ -280,6 +588,107 @@ def loadPRRp(ifile='input.p'):
     pr = pickle.load(open(ifile, 'rb'))
     return pr
 
+def _asSparse(flux):
+    """
+    (Private) View a stored flux map (dense array, sparseflux, or None) as a sparseflux object
+    """
+    if flux is None or isinstance(flux, sparseflux):
+        return flux
+    return sparseflux.fromdense(flux)
+
+def _loadOne(ifile, rtype, bin_um):
+    """
+    (Private) Load and validate a single file into a prad object (worker for iter_prads)
+    """
+    pr = prad(ifile)
+    pr.rtype = rtype
+    pr.bin_um = bin_um
+    pr.read()
+    if rtype == 'prr':
+        pr.validate()
+    return pr
+
+def _pradBytes(pr):
+    """
+    (Private) Approximate in-memory size of the arrays held by a prad object, in bytes
+    """
+    return sum(arr.nbytes for arr in (pr._flux2D, pr._flux2D_ref) if arr is not None)
+
+def iter_prads(paths, prefetch=2, workers=1, rtype='prr', bin_um=None,
+               max_bytes=None, processes=False):
+    """
+    Iterate over prad objects loaded from many files, reading ahead in the background
+
+    While the caller works on one radiograph, the next files are read (and
+    parsed/histogrammed) by a thread or process pool. Results are yielded in
+    the same order as 'paths'.
+
+    Inputs:
+        paths: Iterable of strings, filenames to load (may be a generator)
+        prefetch: Integer, maximum number of files loaded ahead of the one
+                    currently handed to the caller
+        workers: Integer, number of pool workers doing the loading
+        rtype: String, file format of every file, e.g. "prr", "flash4", "carlo" (no prompting is done)
+        bin_um: Float, bin size used by the list-based formats (flash4, carlo); required for them
+        max_bytes: Integer or None, memory budget in bytes for radiographs
+                    loaded but not yet yielded. Read-ahead is throttled to fit
+                    the budget, estimated from the largest radiograph seen so far;
+                    until the first one is loaded, only one file is read at a time.
+                    At least one file is always in flight.
+        processes: Boolean, use a process pool instead of a thread pool (useful
+                    when text parsing dominates and holds the GIL)
+    Outputs:
+        Yields prad objects, one per path, in order
+
+    Example:
+        for pr in iter_prads(glob.glob("runs/*.txt"), prefetch=4, workers=2):
+            myalgorithm(pr)
+    """
+    # Pool workers cannot answer prompts, so everything read() would ask for must be given
+    if rtype is None:
+        raise(Exception("iter_prads needs the file type 'rtype'"))
+    if rtype in ('flash4', 'carlo') and bin_um is None:
+        raise(Exception("iter_prads needs 'bin_um' for file type '" + rtype + "'"))
+
+    prefetch = max(int(prefetch), 1)
+    paths = iter(paths)
+    Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    pending = deque() # Futures in submission (= output) order
+    itemsize = [0] # Largest radiograph seen so far, in bytes
+
+    def budgetAllows():
+        if not pending:
+            return True
+        if max_bytes is None:
+            return True
+        if not itemsize[0]: # No radiograph loaded yet, so no estimate: one read at a time until then
+            return False
+        return (len(pending) + 1) * itemsize[0] <= max_bytes
+
+    with Executor(max_workers=max(int(workers), 1)) as pool:
+        exhausted = False
+        while True:
+            # Top up the read-ahead queue
+            while not exhausted and len(pending) < prefetch + 1 and budgetAllows():
+                try:
+                    ifile = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append(pool.submit(_loadOne, ifile, rtype, bin_um))
+
+            if not pending:
+                break
+
+            pr = pending.popleft().result()
+            itemsize[0] = max(itemsize[0], _pradBytes(pr))
+            try:
+                yield pr
+            except GeneratorExit: # Caller stopped early; drop the read-ahead work
+                for future in pending:
+                    future.cancel()
+                raise
+
 if __name__ == "__main__":
     # Note! Executable features previously found here have been moved into the "PRadReader/bin" directory
     pass
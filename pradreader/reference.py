@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+reference.py: Estimating a smooth reference (undeflected) flux from a measured flux map
+
+Gridded formats (csv, mitcsv) carry no beam geometry, so their reference flux
+must come from the measured flux itself. Methods:
+* 'mean': a constant array at the mean flux (the long-standing default)
+* 'poly': a least-squares 2D polynomial surface of low order
+* 'gauss': a wide Gaussian smoothing, applied in Fourier space (O(N log N))
+
+The 'poly' and 'gauss' methods work on a block-averaged (downsampled) copy of
+the flux map and interpolate the result back to full resolution, so even very
+large scans get a smooth reference at a small fraction of their read time.
+"""
+
+import numpy as np
+
+REFERENCE_METHODS = ('mean', 'poly', 'gauss')
+
+def downsample(flux2D, factor):
+    """ Block-average a 2D array by an integer factor (edge blocks average the pixels they hold) """
+    if factor <= 1:
+        return np.asarray(flux2D, dtype=np.float64)
+    ny, nx = flux2D.shape
+    py, px = -ny % factor, -nx % factor
+    sums = np.pad(np.asarray(flux2D, dtype=np.float64), ((0, py), (0, px)), mode='constant')
+    sums = sums.reshape(sums.shape[0] // factor, factor, sums.shape[1] // factor, factor).sum(axis=(1, 3))
+    counts = np.pad(np.ones((ny, nx)), ((0, py), (0, px)), mode='constant')
+    counts = counts.reshape(sums.shape[0], factor, sums.shape[1], factor).sum(axis=(1, 3))
+    return sums / counts
+
+def _interpAxis(small, n, factor, axis):
+    """ (Private) Linear interpolation of block values back to n pixels along one axis """
+    pos = (np.arange(n) + 0.5) / factor - 0.5 # Pixel centers in units of block index
+    i0 = np.clip(np.floor(pos).astype(int), 0, small.shape[axis] - 1)
+    i1 = np.clip(i0 + 1, 0, small.shape[axis] - 1)
+    w = np.clip(pos - i0, 0.0, 1.0)
+    shape = [1, 1]
+    shape[axis] = n
+    w = w.reshape(shape)
+    return np.take(small, i0, axis=axis) * (1.0 - w) + np.take(small, i1, axis=axis) * w
+
+def upsample(small, shape, factor):
+    """ Interpolate a block-averaged array (see downsample) back to the full shape, bilinearly """
+    if factor <= 1:
+        return small
+    return _interpAxis(_interpAxis(small, shape[0], factor, 0), shape[1], factor, 1)
+
+def polySurface(flux2D, order=2):
+    """ Least-squares 2D polynomial surface (terms x^i y^j with i + j <= order) fitted to a 2D array """
+    ny, nx = flux2D.shape
+    y = np.linspace(-1.0, 1.0, ny) # Scaled coordinates keep the fit well conditioned
+    x = np.linspace(-1.0, 1.0, nx)
+    terms = [(i, j) for i in range(order + 1) for j in range(order + 1 - i)]
+    Vx = np.vander(x, order + 1, increasing=True) # nx by (order + 1): x^0, x^1, ...
+    Vy = np.vander(y, order + 1, increasing=True)
+    A = np.column_stack([np.outer(Vy[:, j], Vx[:, i]).ravel() for i, j in terms])
+    coef = np.linalg.lstsq(A, np.asarray(flux2D, dtype=np.float64).ravel(), rcond=None)[0]
+    return A.dot(coef).reshape(ny, nx)
+
+def gaussSmooth(flux2D, sigma_px):
+    """ Gaussian smoothing of a 2D array (standard deviation sigma_px pixels), by FFT with mirrored edges """
+    ny, nx = flux2D.shape
+    py = min(int(np.ceil(3 * sigma_px)), ny - 1) # Mirror padding, so the image does not wrap around
+    px = min(int(np.ceil(3 * sigma_px)), nx - 1)
+    padded = np.pad(np.asarray(flux2D, dtype=np.float64), ((py, py), (px, px)), mode='reflect')
+    fy = np.fft.fftfreq(padded.shape[0])
+    fx = np.fft.rfftfreq(padded.shape[1])
+    transfer = np.exp(-2 * np.pi**2 * sigma_px**2 * (fy[:, np.newaxis]**2 + fx[np.newaxis, :]**2))
+    smooth = np.fft.irfft2(np.fft.rfft2(padded) * transfer, s=padded.shape)
+    return smooth[py:py + ny, px:px + nx]
+
+def referenceFlux(flux2D, method='mean', order=2, sigma_px=None, factor=None, dtype=None):
+    """
+    Estimate the reference (undeflected) flux of a measured flux map
+    Inputs:
+        flux2D: 2D NumPy array of proton flux (counts/bin)
+        method: String, 'mean', 'poly' or 'gauss' (see module docstring)
+        order: Integer, polynomial order for 'poly'
+        sigma_px: Float, Gaussian width for 'gauss', in full-resolution pixels
+                    (default: an eighth of the larger image dimension)
+        factor: Integer, block size for downsampling before 'poly' and 'gauss'
+                    (default: so that the smaller grid is about 256 pixels across)
+        dtype: NumPy float dtype of the output (default: that of flux2D); the
+                    estimate itself is always computed in float64
+    Outputs:
+        flux2D_ref: 2D NumPy array, REFERENCE proton flux (counts/bin), same shape as flux2D
+    """
+    flux2D = np.asarray(flux2D)
+    if method not in REFERENCE_METHODS:
+        raise(Exception("Reference flux method '" + str(method) + "' not recognized; options are "
+                        + ", ".join(REFERENCE_METHODS)))
+    if dtype is None:
+        dtype = flux2D.dtype if np.issubdtype(flux2D.dtype, np.floating) else np.float64
+    if method == 'mean' or flux2D.size == 0:
+        flux2D_ref = np.zeros(flux2D.shape, dtype=dtype)
+        flux2D_ref[:] = np.mean(flux2D, dtype=np.float64)
+        return flux2D_ref
+
+    if factor is None:
+        factor = max(1, max(flux2D.shape) // 256)
+    small = downsample(flux2D, factor)
+    if method == 'poly':
+        small = polySurface(small, order=order)
+    else:
+        if sigma_px is None:
+            sigma_px = max(flux2D.shape) / 8.0
+        small = gaussSmooth(small, sigma_px / float(factor))
+    return upsample(small, flux2D.shape, factor).astype(dtype, copy=False)
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+roi.py: Regions of interest (rectangular sub-images) of flux maps
+
+A region of interest is given as a tuple (y0, y1, x0, x1) of non-negative pixel indices into
+the 'xy'-indexed flux array (axis 0 is y, axis 1 is x), with the usual Python
+slice meaning: rows y0 to y1-1 and columns x0 to x1-1. None stands for the
+start or end of an axis, as in slicing.
+"""
+
+from .sparse import sparseflux
+
+def roiBounds(roi, shape):
+    """ Clamp a region of interest to an array shape
+    Inputs:
+        roi: Tuple (y0, y1, x0, x1), or None for the whole array
+        shape: Tuple (ny, nx), shape of the full array
+    Outputs:
+        (y0, y1, x0, x1): Tuple of integers with 0 <= y0 <= y1 <= ny and 0 <= x0 <= x1 <= nx
+    """
+    if roi is None:
+        return 0, shape[0], 0, shape[1]
+    y0, y1, x0, x1 = roi
+    ys = slice(y0, y1).indices(shape[0])
+    xs = slice(x0, x1).indices(shape[1])
+    return ys[0], max(ys[0], ys[1]), xs[0], max(xs[0], xs[1])
+
+def crop(flux, roi):
+    """ Cut a region of interest out of a flux map (2D array or sparseflux object), as a copy """
+    if roi is None or flux is None:
+        return flux
+    y0, y1, x0, x1 = roiBounds(roi, flux.shape)
+    if not isinstance(flux, sparseflux):
+        return flux[y0:y1, x0:x1].copy() # Not a view, which would keep the full-size map in memory
+
+    rows, cols = flux.rows, flux.cols
+    inside = (rows >= y0) & (rows < y1) & (cols >= x0) & (cols < x1)
+    shape = (y1 - y0, x1 - x0)
+    index = (rows[inside] - y0) * shape[1] + (cols[inside] - x0) # Still sorted, as row-major order is kept
+    return sparseflux(shape, index, flux.values[inside])
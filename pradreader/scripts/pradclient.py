@@ -0,0 +1,66 @@
+import sys
+import json
+import argparse
+from pradreader.client import pradclient, defaultAddress
+
+def get_input():
+    parser = argparse.ArgumentParser(
+                description="Send a request to a running pradreader server "
+                            "(see pradreader-server).")
+
+    parser.add_argument("command",
+                        action="store", type=str,
+                        choices=["convert", "ping", "shutdown"],
+                        help="Request to send.")
+
+    parser.add_argument("input_file",
+                        action="store", type=str, nargs="?",
+                        help="Input file (for convert).")
+
+    parser.add_argument("--rtype", "-t",
+                        action="store", type=str,
+                        help='Type of file: "prr", "carlo", "mitcsv", "csv", "flash4".')
+
+    parser.add_argument("--outname", "-o",
+                        action="store", type=str,
+                        default=None,
+                        help="PRR file to write (default: <input_file>_prr.txt).")
+
+    for name, helptext in (("bin-um", "Pixel size of radiograph (in um)."),
+                           ("s2r-cm", "Distance from the source to the plasma (in cm)."),
+                           ("s2d-cm", "Distance from the source to the screen (in cm)."),
+                           ("Ep-MeV", "Proton energy (in MeV).")):
+        parser.add_argument("--" + name,
+                            action="store", type=float,
+                            default=None,
+                            help=helptext)
+
+    parser.add_argument("--address", "-a",
+                        action="store", type=str,
+                        default=defaultAddress(),
+                        help="Server address (default: %(default)s).")
+
+    args = parser.parse_args()
+
+    return(args)
+
+
+def request():
+    args = get_input()
+    try:
+        with pradclient(args.address) as c:
+            if args.command == "convert":
+                if args.input_file is None or args.rtype is None:
+                    sys.exit("convert needs an input file and --rtype")
+                print(c.convert(args.input_file, args.rtype, out=args.outname,
+                                bin_um=args.bin_um, s2r_cm=args.s2r_cm,
+                                s2d_cm=args.s2d_cm, Ep_MeV=args.Ep_MeV))
+            elif args.command == "ping":
+                print(json.dumps(c.ping()))
+            else:
+                c.shutdown()
+    except Exception as e:
+        sys.exit(str(e))
+
+if __name__=="__main__":
+    request()
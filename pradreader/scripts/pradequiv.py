@@ -0,0 +1,62 @@
+import sys
+import argparse
+import tempfile
+
+def get_input():
+    parser = argparse.ArgumentParser(
+                description="Check that the read engines (standard, direct-bin, out-of-core, "
+                            "sparse, float32, sidecar, and Carlo's path_parse) give the same "
+                            "results as the original readers, and compare their read times.")
+
+    parser.add_argument("--file", "-f",
+                        action="append", nargs=2, metavar=("FILE", "RTYPE"),
+                        default=[],
+                        help="Input file and its type (flash4, carlo, csv, mitcsv, prr); may be repeated. "
+                             "Without any, synthetic inputs of every type are generated.")
+
+    parser.add_argument("--folder",
+                        action="store", type=str,
+                        default=None,
+                        help="Folder for the generated inputs (default: a temporary folder).")
+
+    parser.add_argument("--nprot",
+                        action="store", type=int,
+                        default=200000,
+                        help="Number of protons in the generated proton lists.")
+
+    parser.add_argument("--bin-um",
+                        action="store", type=float,
+                        default=100.0,
+                        help="Bin size for proton lists, in um.")
+
+    parser.add_argument("--engines", "-e",
+                        action="store", type=str,
+                        default=None,
+                        help="Comma-separated engines to check (default: all).")
+
+    parser.add_argument("--repeat", "-r",
+                        action="store", type=int,
+                        default=1,
+                        help="Timed reads per engine; the fastest is reported.")
+
+    args = parser.parse_args()
+
+    return(args)
+
+
+def check():
+    args = get_input()
+    from pradreader import equivalence # Heavy imports only once arguments are fine
+    engines = None
+    if args.engines:
+        engines = dict((name, equivalence.ENGINES[name]) for name in args.engines.split(','))
+    cases = [tuple(pair) for pair in args.file]
+    if not cases:
+        folder = args.folder or tempfile.mkdtemp(prefix='pradreader-equivalence-')
+        print("Generating synthetic inputs in '" + folder + "'...")
+        cases = equivalence.generate(folder, nprot=args.nprot)
+    results = equivalence.runHarness(cases, bin_um=args.bin_um, engines=engines, repeat=args.repeat)
+    sys.exit(0 if all(r['ok'] for r in results) else 1)
+
+if __name__=="__main__":
+    check()
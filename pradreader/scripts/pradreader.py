@@ -1,5 +1,6 @@
 import pradreader
 import argparse
+from pradreader.profiling import profiler
 
 def get_input():
     parser = argparse.ArgumentParser(
@@ -14,6 +15,19 @@ def get_input():
                         default="input.txt",
                         help="")
 
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="Run under the profiler and print the top hot spots.")
+
+    parser.add_argument("--profile-out",
+                        action="store", type=str,
+                        default="pradreader.prof",
+                        help="File for the profile statistics (with --profile).")
+
+    parser.add_argument("--profile-memory",
+                        action="store_true",
+                        help="With --profile, also trace memory allocations (slower).")
+
     args = parser.parse_args()
 
     return(args)
@@ -22,11 +36,25 @@ def get_input():
 def read_into_PRR():
     args = get_input()
     print(args)
-    prad = pradreader.reader.prad(args.input_file)
-    prad.read()
-    prad.prompt()
-    prad.show()
-    prad.write(ofile=args.outname)
+
+    def pipeline(prof=None):
+        # With a profiler, only the non-interactive steps are profiled (not time spent at prompts)
+        run = prof.runcall if prof is not None else (lambda func, *a, **kw: func(*a, **kw))
+        prad = pradreader.reader.prad(args.input_file)
+        prad.promptRead()
+        run(prad.read)
+        prad.prompt()
+        prad.show()
+        run(prad.write, ofile=args.outname)
+
+    if args.profile:
+        prof = profiler(out=args.profile_out, memory=args.profile_memory)
+        try:
+            pipeline(prof)
+        finally:
+            prof.report()
+    else:
+        pipeline()
 
 if __name__=="__main__":
     read_into_PRR()
@@ -0,0 +1,37 @@
+import argparse
+from pradreader.client import defaultAddress
+
+def get_input():
+    parser = argparse.ArgumentParser(
+                description="Run a pradreader server, which reads and converts "
+                            "files for pradreader-client with warm caches.")
+
+    parser.add_argument("--address", "-a",
+                        action="store", type=str,
+                        default=defaultAddress(),
+                        help="Unix socket path, or host:port for TCP on 127.0.0.1, ::1 "
+                             "or localhost (default: %(default)s).")
+
+    parser.add_argument("--workers", "-j",
+                        action="store", type=int,
+                        default=4,
+                        help="Number of files read at the same time.")
+
+    parser.add_argument("--max-mb",
+                        action="store", type=float,
+                        default=2048,
+                        help="Memory budget for read results kept in memory, in MB.")
+
+    args = parser.parse_args()
+
+    return(args)
+
+
+def serve():
+    args = get_input()
+    from pradreader.server import pradserver # Heavy imports only once arguments are fine
+    pradserver(address=args.address, workers=args.workers,
+               max_bytes=int(args.max_mb * 1024**2)).serve_forever()
+
+if __name__=="__main__":
+    serve()
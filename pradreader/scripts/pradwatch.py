@@ -0,0 +1,53 @@
+import argparse
+from pradreader.watch import watcher
+
+def get_input():
+    parser = argparse.ArgumentParser(
+                description="Convert FLASH4 proton detector files to PRR files "
+                            "as they appear in a run folder.")
+
+    parser.add_argument("folder",
+                        action="store", type=str,
+                        help="FLASH4 run folder to watch.")
+
+    parser.add_argument("--outdir", "-o",
+                        action="store", type=str,
+                        default=None,
+                        help="Folder for the PRR files (default: the run folder).")
+
+    parser.add_argument("--bin-um", "-b",
+                        action="store", type=float,
+                        default=320,
+                        help="Bin size for histogramming the protons, in microns.")
+
+    parser.add_argument("--plots",
+                        action="store_true",
+                        help="Also save flux plots of each file.")
+
+    parser.add_argument("--workers", "-j",
+                        action="store", type=int,
+                        default=1,
+                        help="Number of conversion processes.")
+
+    parser.add_argument("--interval",
+                        action="store", type=float,
+                        default=10.0,
+                        help="Seconds between polls of the folder.")
+
+    parser.add_argument("--once",
+                        action="store_true",
+                        help="Convert the files present now, then exit.")
+
+    args = parser.parse_args()
+
+    return(args)
+
+
+def watch_dir():
+    args = get_input()
+    w = watcher(args.folder, outdir=args.outdir, bin_um=args.bin_um,
+                plots=args.plots, workers=args.workers, interval=args.interval)
+    w.run(once=args.once)
+
+if __name__=="__main__":
+    watch_dir()
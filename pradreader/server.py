@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+server.py: Long-running conversion server that keeps pradreader warm
+
+Starting Python and importing NumPy, pandas and matplotlib costs more than
+reading many radiographs does. A 'pradserver' pays for it once: it listens on a
+Unix socket (or a localhost TCP port), reads files on a pool of worker threads,
+and keeps recent results in memory (and file digests, so unchanged files are
+not re-hashed), alongside the on-disk result cache if one is enabled.
+
+Only the user running the server can talk to it: the Unix socket is made
+private to that user, and TCP servers (on a local host only) require the token
+they write to client.tokenFile(address) with every request. PRR files are only
+written into the folder of the file converted.
+
+Protocol: one JSON object per line in each direction (see client.py).
+Requests have an 'op', the 'token' (TCP only) and parameters:
+    ping                            => {'pid', 'results', 'handles'}
+    convert  file, rtype, out, ...  => {'output': PRR filename written (next to 'file')}
+    load     file, rtype, backend, ... => {'handle': pradhandle dict, 'id': handle id}
+    release  id                     => {} (frees the shared memory of a load)
+    shutdown                        => {}
+Read parameters: sparse, roi, reference, dtype (as in prad.read), bin_um (the
+histogram bin size for flash4 and carlo files), and the geometry s2r_cm,
+s2d_cm, Ep_MeV (and bin_um for other formats), which fill in values the file
+does not have.
+Every response has 'ok' (true/false) and, on failure, 'error'.
+"""
+
+import os
+import sys
+import copy
+import hmac
+import socket
+import json
+import uuid
+import binascii
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import socketserver
+except ImportError: # Python 2
+    import SocketServer as socketserver
+from .reader import prad, _pradBytes
+from . import cache as resultcache
+from . import shmem
+from .client import defaultAddress, parseAddress, tokenFile
+
+_READ_PARAMS = ('bin_um', 'sparse', 'roi', 'reference', 'dtype')
+_GEOMETRY = ('s2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um')
+
+class _handler(socketserver.StreamRequestHandler):
+    """ (Private) Serves the requests of one client connection, one line each """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.app.dispatch(json.loads(line.decode('utf-8')))
+            except Exception as e: # Report any failure to the client; keep serving
+                response = {'ok': False, 'error': repr(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+class _unixserver(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _tcpserver(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _tcp6server(_tcpserver):
+    address_family = socket.AF_INET6
+
+class pradserver(object):
+    """
+    Conversion server holding warm worker threads and an in-memory result cache.
+
+    Inputs:
+        address: String, Unix socket path, or 'host:port' for TCP, where host is 127.0.0.1,
+                    ::1 or localhost (default: client.defaultAddress())
+        workers: Integer, number of files read at the same time
+        max_bytes: Integer, memory budget for results kept in memory
+        cache: cache.resultcache object (on-disk results), or False for none
+                    (default: the cache set by cache.enable() or PRADREADER_CACHE)
+
+    Example:
+        pradserver(workers=4).serve_forever()
+    """
+    def __init__(self, address=None, workers=4, max_bytes=2*1024**3, cache=None):
+        self.address = address or defaultAddress()
+        self.max_bytes = int(max_bytes)
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._results = OrderedDict() # Read key => future of a prad object, least recently used first
+        self._handles = {} # Handle id => pradhandle of a load not yet released
+        self._token = None # Required in every request to a TCP server
+
+        family, addr = parseAddress(self.address)
+        if family == socket.AF_UNIX:
+            folder = os.path.dirname(os.path.abspath(addr))
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            if os.path.exists(addr): # Left over from a server that did not shut down cleanly
+                os.remove(addr)
+            umask = os.umask(0o177) # Socket private to this user from the start
+            try:
+                self._server = _unixserver(addr, _handler)
+            finally:
+                os.umask(umask)
+        else:
+            self._server = (_tcp6server if family == socket.AF_INET6 else _tcpserver)(addr, _handler)
+            self._token = binascii.hexlify(os.urandom(16)).decode('ascii')
+            fn = tokenFile(self.address)
+            if not os.path.isdir(os.path.dirname(fn)):
+                os.makedirs(os.path.dirname(fn))
+            if os.path.exists(fn):
+                os.remove(fn)
+            with os.fdopen(os.open(fn, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+                f.write(self._token + '\n')
+        self._server.app = self
+
+    def serve_forever(self):
+        """ Serve requests until a 'shutdown' request (or Ctrl-C) """
+        print("pradreader server listening on '" + self.address + "' (pid " + str(os.getpid()) + ")")
+        sys.stdout.flush()
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        """ Stop listening and free all shared memory still handed out """
+        self._server.server_close()
+        family, addr = parseAddress(self.address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.remove(addr)
+        if self._token is not None and os.path.exists(tokenFile(self.address)):
+            os.remove(tokenFile(self.address))
+        with self._lock:
+            handles, self._handles = list(self._handles.values()), {}
+        for handle in handles:
+            handle.release()
+        self._pool.shutdown(wait=True)
+
+    def dispatch(self, req):
+        """ Run one request (dict) and return its response (dict) """
+        if self._token is not None and not hmac.compare_digest(str(req.get('token')).encode('utf-8'),
+                                                                 self._token.encode('ascii')):
+            return {'ok': False, 'error': "Missing or wrong token (see client.tokenFile)"}
+        op = req.get('op')
+        if op == 'ping':
+            with self._lock:
+                return {'ok': True, 'pid': os.getpid(), 'results': len(self._results), 'handles': len(self._handles)}
+        elif op == 'convert':
+            out = os.path.abspath(req.get('out') or req['file'] + '_prr.txt')
+            folder = os.path.dirname(os.path.realpath(req['file']))
+            if os.path.dirname(os.path.realpath(out)) != folder:
+                return {'ok': False, 'error': "Output file '" + out + "' must be in the folder of the input file, '"
+                                              + folder + "'"}
+            if os.path.realpath(out) == os.path.realpath(req['file']):
+                return {'ok': False, 'error': "Output file '" + out + "' would overwrite the input file"}
+            pr = self._get(req)
+            pr.write(ofile=out, sparse=bool(req.get('sparse')))
+            return {'ok': True, 'output': out}
+        elif op == 'load':
+            handle = shmem.share(self._get(req), backend=req.get('backend', 'shm'))
+            hid = uuid.uuid4().hex
+            with self._lock:
+                self._handles[hid] = handle
+            return {'ok': True, 'handle': handle.todict(), 'id': hid}
+        elif op == 'release':
+            with self._lock:
+                handle = self._handles.pop(req['id'], None)
+            if handle is None:
+                return {'ok': False, 'error': "No handle with id '" + str(req['id']) + "'"}
+            handle.release()
+            return {'ok': True}
+        elif op == 'shutdown':
+            threading.Thread(target=self._server.shutdown).start() # Cannot stop from a serving thread
+            return {'ok': True}
+        return {'ok': False, 'error': "Request op '" + str(op) + "' not recognized"}
+
+    def _get(self, req):
+        """ (Private) prad object for a request: from memory, or read on the worker pool """
+        filename, rtype = req['file'], req.get('rtype')
+        if rtype is None:
+            raise(Exception("Request is missing the file type 'rtype'"))
+        params = dict((k, req[k]) for k in _READ_PARAMS if req.get(k) is not None)
+        if rtype in ('flash4', 'carlo'):
+            if 'bin_um' not in params:
+                raise(Exception("Request is missing 'bin_um', needed for file type '" + rtype + "'"))
+        else: # Only metadata for gridded formats; the same read serves any value
+            params.pop('bin_um', None)
+        if 'roi' in params:
+            params['roi'] = tuple(params['roi'])
+        key = resultcache.readKey(filename, rtype, **params)
+
+        with self._lock: # Concurrent requests for the same result share one read
+            future = self._results.pop(key, None)
+            if future is None:
+                future = self._pool.submit(self._read, filename, rtype, params)
+            self._results[key] = future
+        try:
+            pr = future.result()
+        except Exception:
+            with self._lock:
+                if self._results.get(key) is future:
+                    del self._results[key]
+            raise
+        self._evict()
+
+        pr = copy.copy(pr) # Shares the arrays; geometry below applies to this request only
+        for k in _GEOMETRY:
+            if req.get(k) is not None and getattr(pr, k) is None:
+                setattr(pr, k, req[k])
+        return pr
+
+    def _read(self, filename, rtype, params):
+        """ (Private) Read one file (runs on the worker pool) """
+        pr = prad(filename)
+        pr.rtype = rtype
+        pr.bin_um = params.get('bin_um')
+        pr.read(sparse=params.get('sparse', False), cache=self.cache, roi=params.get('roi'),
+                reference=params.get('reference', 'mean'), dtype=params.get('dtype'))
+        return pr
+
+    def _evict(self):
+        """ (Private) Drop the least recently used results beyond the memory budget """
+        with self._lock:
+            done = [(k, f.result()) for k, f in self._results.items() if f.done() and not f.exception()]
+            total = sum(_pradBytes(pr) for _, pr in done)
+            for k, pr in done:
+                if total <= self.max_bytes:
+                    break
+                del self._results[k]
+                total -= _pradBytes(pr)
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+shmem.py: Zero-copy handoff of prad flux maps between processes
+
+A prad object's flux maps are copied once into shared memory (or into
+memory-mapped temporary files), and a small picklable 'pradhandle' describes
+where they are. Worker processes re-attach to the same memory with attach(handle),
+so fanning a radiograph out to many workers costs the same whatever its size.
+
+Usage (parent process):
+    handle = pr.share() # or share(pr, backend='mmap')
+    pool.map(work, [handle] * nworkers)
+    handle.release() # Free the shared memory once all workers are done
+
+Usage (worker process):
+    def work(handle):
+        pr = attach(handle) # Flux maps are read-only views of the shared memory
+"""
+
+import os
+import uuid
+import tempfile
+import threading
+import numpy as np
+from .sparse import sparseflux
+from .mask import fluxmask
+
+try:
+    from multiprocessing import shared_memory # Python 3.8+
+except ImportError:
+    shared_memory = None
+
+_FLUX_FIELDS = ('flux2D', 'flux2D_ref')
+
+_trackerLock = threading.Lock()
+
+class pradhandle(object):
+    """
+    Picklable description of a prad object whose flux maps live in shared memory.
+
+    Attributes:
+        backend (string): 'shm' (multiprocessing.shared_memory) or 'mmap' (memory-mapped .npy files)
+        meta (dict): Non-array prad attributes (filename, rtype, s2r_cm, ...)
+        arrays (dict): Flux map name => dict with the location ('shm' segment name or
+                        'mmap' file path), shape and dtype of each shared array.
+                        Sparse maps are shared as their 'index' and 'values' arrays.
+    """
+    def __init__(self, backend, meta, arrays):
+        self.backend = backend
+        self.meta = meta
+        self.arrays = arrays
+        self._segments = [] # SharedMemory objects owned by the creating process (not pickled)
+
+    def __repr__(self):
+        return "pradhandle(backend='" + self.backend + "', arrays=" + str(sorted(self.arrays)) + ")"
+
+    def __getstate__(self):
+        return {'backend': self.backend, 'meta': self.meta, 'arrays': self.arrays}
+
+    def __setstate__(self, state):
+        self.__init__(state['backend'], state['meta'], state['arrays'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def todict(self):
+        """ JSON-serializable form of the handle (e.g. for sending over a socket) """
+        return self.__getstate__()
+
+    @classmethod
+    def fromdict(cls, d):
+        """ Rebuild a handle from its todict() form """
+        return cls(d['backend'], d['meta'], d['arrays'])
+
+    def release(self):
+        """ Free the shared memory or temporary files. Call once, from the creating process, after all workers are done. """
+        for seg in self._segments:
+            seg.close()
+            seg.unlink()
+        self._segments = []
+        if self.backend == 'mmap':
+            for spec in _specs(self.arrays):
+                try:
+                    os.remove(spec['location'])
+                except OSError:
+                    pass
+
+def _specs(arrays):
+    """ (Private) All array specifications of a handle, including the parts of sparse maps """
+    for spec in arrays.values():
+        if spec.get('kind') == 'sparse':
+            yield spec['index']
+            yield spec['values']
+        else:
+            yield spec
+
+def share(pr, backend='shm', folder=None):
+    """
+    Copy the flux maps of a prad object into shared memory, and return a handle to them.
+
+    Inputs:
+        pr: prad object to share
+        backend: String, 'shm' for multiprocessing.shared_memory (Python 3.8+), or
+                    'mmap' for memory-mapped temporary files
+        folder: String, folder for the 'mmap' backend's files (default: /dev/shm if
+                    present, otherwise the system temporary folder)
+    Outputs:
+        handle: pradhandle object; pickle it (or send its todict()) to the workers,
+                    and call handle.release() when everyone is done
+    """
+    if backend == 'shm' and shared_memory is None:
+        raise(Exception("Shared memory backend requires Python 3.8+; use backend='mmap'"))
+    if backend not in ('shm', 'mmap'):
+        raise(Exception("Shared memory backend '" + str(backend) + "' not recognized"))
+    if backend == 'mmap' and folder is None:
+        folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+    handle = pradhandle(backend, {}, {})
+    for k in pr._fields:
+        if k == 'mask': # Small; travels in the metadata as its compact text form
+            mask = pr._stored(k)
+            handle.meta[k] = None if mask is None else {'shape': list(mask.shape), 'bits': mask.encode()}
+        elif k not in _FLUX_FIELDS:
+            handle.meta[k] = getattr(pr, k)
+
+    for k in _FLUX_FIELDS:
+        flux = pr._stored(k)
+        if flux is None:
+            continue
+        if isinstance(flux, sparseflux):
+            handle.arrays[k] = {'kind': 'sparse', 'shape': list(flux.shape),
+                                'index': _put(handle, flux.index, folder),
+                                'values': _put(handle, flux.values, folder)}
+        else:
+            handle.arrays[k] = _put(handle, flux, folder)
+    return handle
+
+def _put(handle, arr, folder):
+    """ (Private) Copy one array into a new shared segment or file; returns its specification """
+    arr = np.ascontiguousarray(arr)
+    if handle.backend == 'shm':
+        seg = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=seg.buf)[...] = arr
+        handle._segments.append(seg)
+        location = seg.name
+    else:
+        location = os.path.join(folder, 'pradreader-' + uuid.uuid4().hex + '.npy')
+        out = np.lib.format.open_memmap(location, mode='w+', dtype=arr.dtype, shape=arr.shape)
+        out[...] = arr
+        out.flush()
+        del out
+    spec = {'location': location, 'shape': list(arr.shape), 'dtype': arr.dtype.str}
+    if handle.backend == 'shm':
+        spec['tracker'] = _trackerId()
+    return spec
+
+def _trackerId():
+    """ (Private) Identity of the resource tracker that shared memory segments of this process register
+    with, or None if there is none. Children started by fork, spawn or forkserver inherit their parent's
+    tracker, and with it the pipe to it, so the pipe's [device, inode] identifies the tracker. """
+    try:
+        from multiprocessing import resource_tracker
+    except ImportError: # Windows: segments are not tracked
+        return None
+    fd = getattr(resource_tracker._resource_tracker, '_fd', None)
+    if fd is None:
+        return None
+    st = os.fstat(fd)
+    return [st.st_dev, st.st_ino]
+
+def _get(spec, backend):
+    """ (Private) Read-only array view of one shared array """
+    if backend == 'shm':
+        seg = _attachSegment(spec['location'], spec.get('tracker'))
+        # The array keeps the segment's mapping (not the SharedMemory object, whose close() would unmap
+        # it under the array) alive for as long as it, or any view of it, is in use
+        mapping, seg._mmap = seg._mmap, None
+        seg._buf.release()
+        seg._buf = None
+        seg.close()
+        shape = tuple(spec['shape'])
+        arr = np.frombuffer(mapping, dtype=np.dtype(spec['dtype']), count=int(np.prod(shape))).reshape(shape)
+    else:
+        arr = np.load(spec['location'], mmap_mode='r')
+    arr.flags.writeable = False
+    return arr
+
+def _attachSegment(name, tracker=None):
+    """ (Private) Open an existing shared memory segment without taking over its cleanup
+    Inputs:
+        name: String, segment name
+        tracker: Identity of the resource tracker of the creating process (see _trackerId)
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        pass
+
+    # Older Pythons register attached segments with the attaching process's resource tracker, which
+    # deletes them when that process tree exits. Workers started by the creating process share its
+    # tracker, where registering again changes nothing, and unregistering would withdraw the creator's
+    # own registration. Only a process with a tracker of its own (e.g. a client of the server) withdraws
+    # the registration it just made, so that the creator alone deletes the segment.
+    from multiprocessing import resource_tracker
+    with _trackerLock:
+        seg = shared_memory.SharedMemory(name=name)
+        if tracker is None or _trackerId() != list(tracker):
+            resource_tracker.unregister(seg._name, 'shared_memory')
+    return seg
+
+def attach(handle):
+    """
+    Re-create a prad object from a handle made by share(), without copying the flux maps.
+
+    Inputs:
+        handle: pradhandle object (or its todict() form)
+    Outputs:
+        pr: prad object whose flux maps are read-only views of the shared memory.
+            The views stay valid as long as they are in use, even after the creating
+            process calls handle.release() (which only removes the segments' names).
+    """
+    from .reader import prad # Late import (reader imports this module)
+
+    if isinstance(handle, dict):
+        handle = pradhandle.fromdict(handle)
+
+    pr = prad()
+    for k, val in handle.meta.items():
+        if k == 'mask' and val is not None:
+            val = fluxmask.decode(val['bits'], tuple(val['shape']))
+        setattr(pr, k, val)
+
+    for k, spec in handle.arrays.items():
+        if spec.get('kind') == 'sparse':
+            flux = sparseflux(spec['shape'], _get(spec['index'], handle.backend),
+                              _get(spec['values'], handle.backend))
+        else:
+            flux = _get(spec, handle.backend)
+        setattr(pr, k, flux)
+    return pr
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+sparse.py: Sparse (coordinate-list) storage for mostly-empty flux maps
+
+Fine bins on low-statistics proton lists give flux maps that are mostly zeros.
+A 'sparseflux' stores only the non-zero pixels, as flat pixel indices and values,
+and is converted to a dense NumPy array only when needed.
+"""
+
+import numpy as np
+
+class sparseflux(object):
+    """
+    Sparse 2D flux map, holding only the non-zero pixels.
+
+    Attributes:
+        shape (tuple): (ny, nx) shape of the equivalent dense array ('xy' indexing)
+        index (array): 1D int64 array of flat (row-major) pixel indices, sorted ascending
+        values (array): 1D array of flux values at those pixels
+    """
+    def __init__(self, shape, index, values):
+        self.shape = tuple(int(n) for n in shape)
+        self.index = np.asarray(index, dtype=np.int64)
+        self.values = np.asarray(values)
+        if self.index.shape != self.values.shape:
+            raise(ValueError("Sparse flux index and values must have the same length"))
+
+    def __repr__(self):
+        return ("sparseflux(shape=" + str(self.shape)
+                + ", nnz=" + str(self.nnz) + ")")
+
+    @classmethod
+    def fromdense(cls, arr):
+        """ Build a sparse flux map from a dense 2D array """
+        arr = np.asarray(arr)
+        index = np.flatnonzero(arr)
+        return cls(arr.shape, index, arr.ravel()[index])
+
+    @classmethod
+    def fromcoords(cls, shape, rows, cols, values):
+        """ Build a sparse flux map from row (y) and column (x) pixel coordinates """
+        index = np.ravel_multi_index((np.asarray(rows, dtype=np.int64),
+                                      np.asarray(cols, dtype=np.int64)), shape)
+        order = np.argsort(index, kind='mergesort')
+        return cls(shape, index[order], np.asarray(values)[order])
+
+    @property
+    def nnz(self):
+        """ Number of stored (non-zero) pixels """
+        return self.index.size
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        """ Memory held by the index and value arrays, in bytes """
+        return self.index.nbytes + self.values.nbytes
+
+    @property
+    def rows(self):
+        """ Row (y) coordinate of each stored pixel """
+        return self.index // self.shape[1]
+
+    @property
+    def cols(self):
+        """ Column (x) coordinate of each stored pixel """
+        return self.index % self.shape[1]
+
+    def todense(self):
+        """ Convert into a dense 2D NumPy array """
+        arr = np.zeros(self.shape, dtype=self.values.dtype)
+        arr.ravel()[self.index] = self.values
+        return arr
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+validate.py: Checks that a prad object holds sensible data before reconstruction
+
+Covers:
+* Metadata checks (distances, energy, bin size)
+* Flux array checks (shapes, NaN/inf values, negative counts, zero reference pixels)
+
+The flux arrays are scanned in blocks of rows, spread over a thread pool ("full" mode),
+or only on an evenly spaced subset of rows ("sample" mode, for a quick look at huge images).
+"""
+
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .sparse import sparseflux
+
+class validationreport(object):
+    """
+    Result of validating a prad object.
+
+    Attributes:
+        mode (string): 'full' or 'sample'
+        errors (list): Strings describing problems that will break a reconstruction
+        warnings (list): Strings describing suspicious but usable data
+        stats (dict): Array name => dict of counts (pixels, nan, inf, negative, zero) and min/max.
+                        In 'sample' mode, counts refer to the sampled rows only.
+    """
+    def __init__(self, mode):
+        self.mode = mode
+        self.errors = []
+        self.warnings = []
+        self.stats = {}
+
+    @property
+    def ok(self):
+        """ True if no errors were found """
+        return not self.errors
+
+    def __str__(self):
+        lines = ["Validation (" + self.mode + " mode): "
+                 + ("OK" if self.ok else str(len(self.errors)) + " error(s)")
+                 + ", " + str(len(self.warnings)) + " warning(s)"]
+        lines += ["  ERROR: " + e for e in self.errors]
+        lines += ["  WARNING: " + w for w in self.warnings]
+        return "\n".join(lines)
+
+def _blockStats(block):
+    """ (Private) Counts and extrema of one block of a flux array """
+    finite = np.isfinite(block)
+    nfinite = np.count_nonzero(finite)
+    nnan = np.count_nonzero(np.isnan(block))
+    vals = block if nfinite == block.size else block[finite]
+    return {'pixels': block.size,
+            'nan': nnan,
+            'inf': block.size - nfinite - nnan,
+            'negative': np.count_nonzero(vals < 0),
+            'zero': block.size - np.count_nonzero(vals),
+            'min': vals.min() if vals.size else np.nan,
+            'max': vals.max() if vals.size else np.nan}
+
+def _mergeStats(parts):
+    """ (Private) Combine the statistics of several blocks """
+    out = {}
+    for k in ('pixels', 'nan', 'inf', 'negative', 'zero'):
+        out[k] = int(sum(p[k] for p in parts))
+    out['min'] = float(np.nanmin([p['min'] for p in parts])) if out['pixels'] > out['nan'] + out['inf'] else np.nan
+    out['max'] = float(np.nanmax([p['max'] for p in parts])) if out['pixels'] > out['nan'] + out['inf'] else np.nan
+    return out
+
+def arrayStats(arr, mode='full', nthreads=None, chunk_rows=256, sample_rows=64):
+    """
+    Counts of NaN, inf, negative and zero pixels, plus min/max, of a 2D flux array
+    Inputs:
+        arr: 2D NumPy array or sparseflux object
+        mode: String, 'full' (every pixel, in row blocks across threads) or 'sample'
+                (only 'sample_rows' evenly spaced rows)
+        nthreads: Integer, number of threads for 'full' mode (default: number of CPUs)
+        chunk_rows: Integer, rows per block in 'full' mode
+        sample_rows: Integer, number of rows looked at in 'sample' mode
+    Outputs:
+        stats: dict with keys 'pixels', 'nan', 'inf', 'negative', 'zero', 'min', 'max'
+    """
+    if isinstance(arr, sparseflux): # Only the stored values need checking; everything else is zero
+        stats = _blockStats(arr.values)
+        stats['pixels'] = arr.shape[0] * arr.shape[1]
+        stats['zero'] += stats['pixels'] - arr.nnz
+        if stats['pixels'] > arr.nnz:
+            stats['min'] = np.nanmin([stats['min'], 0.0])
+            stats['max'] = np.nanmax([stats['max'], 0.0])
+        return _mergeStats([stats])
+
+    if mode == 'sample':
+        rows = np.unique(np.linspace(0, arr.shape[0] - 1, min(sample_rows, arr.shape[0])).astype(int))
+        return _mergeStats([_blockStats(arr[rows])])
+    elif mode != 'full':
+        raise(Exception("Validation mode '" + str(mode) + "' not recognized"))
+
+    starts = range(0, arr.shape[0], chunk_rows)
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if len(starts) <= 1 or nthreads <= 1:
+        parts = [_blockStats(arr[i:i + chunk_rows]) for i in starts]
+    else: # NumPy releases the GIL in these reductions, so threads scan blocks in parallel
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            parts = list(pool.map(lambda i: _blockStats(arr[i:i + chunk_rows]), starts))
+    return _mergeStats(parts)
+
+def validate(pr, mode='full', nthreads=None):
+    """
+    Check a prad object for problems that would break or spoil a reconstruction
+    Inputs:
+        pr: prad object
+        mode: String, 'full' or 'sample' (see arrayStats)
+        nthreads: Integer, number of threads used in 'full' mode
+    Outputs:
+        report: validationreport object
+    """
+    report = validationreport(mode)
+
+    # Metadata
+    for k in ('s2r_cm', 's2d_cm', 'Ep_MeV', 'bin_um'):
+        val = getattr(pr, k)
+        if val is None:
+            report.errors.append(k + " is not set")
+        elif not np.isfinite(val) or val <= 0:
+            report.errors.append(k + " must be a positive number (is " + str(val) + ")")
+    if pr.s2r_cm is not None and pr.s2d_cm is not None and pr.s2d_cm <= pr.s2r_cm:
+        report.errors.append("Source-to-detector distance s2d_cm (" + str(pr.s2d_cm)
+                             + ") must be larger than source-to-plasma distance s2r_cm (" + str(pr.s2r_cm) + ")")
+
+    # Flux arrays
+    shapes = {}
+    for k in ('flux2D', 'flux2D_ref'):
+        arr = pr._stored(k)
+        if arr is None:
+            report.errors.append(k + " is not set")
+            continue
+        if len(arr.shape) != 2:
+            report.errors.append(k + " must be a 2D array (has shape " + str(arr.shape) + ")")
+            continue
+        shapes[k] = tuple(arr.shape)
+
+        stats = arrayStats(arr, mode=mode, nthreads=nthreads)
+        report.stats[k] = stats
+        if stats['nan'] or stats['inf']:
+            report.errors.append(k + " has " + str(stats['nan']) + " NaN and "
+                                 + str(stats['inf']) + " infinite pixel(s)")
+        if stats['negative']:
+            report.errors.append(k + " has " + str(stats['negative']) + " negative pixel(s)")
+
+    if len(shapes) == 2 and shapes['flux2D'] != shapes['flux2D_ref']:
+        report.errors.append("flux2D shape " + str(shapes['flux2D'])
+                             + " does not match flux2D_ref shape " + str(shapes['flux2D_ref']))
+
+    mask = pr._stored('mask')
+    if mask is not None and 'flux2D' in shapes and tuple(mask.shape) != shapes['flux2D']:
+        report.errors.append("mask shape " + str(tuple(mask.shape))
+                             + " does not match flux2D shape " + str(shapes['flux2D']))
+
+    if 'flux2D_ref' in report.stats:
+        stats = report.stats['flux2D_ref']
+        if stats['zero'] == stats['pixels']:
+            report.errors.append("flux2D_ref is zero everywhere")
+        elif stats['zero']:
+            report.warnings.append("flux2D_ref is zero in " + str(stats['zero']) + " of "
+                                   + str(stats['pixels']) + " pixel(s); fluence contrast is undefined there")
+
+    return report
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+watch.py: Convert FLASH4 proton detector dumps to PRR files as they appear
+
+While a FLASH simulation runs, '[basename]ProtonDetectorFile[number]_[time]'
+files appear in its run folder. A 'watcher' polls the folder, waits until a new
+file's size and modification time stop changing (the dump is complete), and
+converts it to a PRR file (plus optional flux plots) on a pool of worker processes.
+
+Finished conversions are recorded in a small JSON state file, so a restarted
+watcher skips files it already converted (unless they changed since).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Native (or gzipped) FLASH4 detector dumps; not the .npz files written by readFlash4
+DETECTOR_PATTERN = re.compile(r'^(\w*?)ProtonDetectorFile([0-9]+)_([0-9.Ee+-]+?)(\.gz){0,1}$')
+
+def convertDetectorFile(fn, outfile, bin_um, plotdir=None):
+    """ Convert one FLASH4 detector file to a PRR file (and optionally plots); returns outfile """
+    from .reader import prad # Late import keeps worker start-up light until needed
+    pr = prad(fn)
+    pr.rtype = 'flash4'
+    pr.bin_um = bin_um
+    pr.read()
+    pr.write(ofile=outfile)
+    if plotdir is not None:
+        pr.plot(plotdir=plotdir)
+    return outfile
+
+class watcher(object):
+    """
+    Watches a FLASH4 run folder and converts new proton detector files to PRR files.
+
+    Inputs:
+        folder: String, run folder to watch
+        outdir: String, folder for the PRR files and plots (default: same as folder)
+        bin_um: Float, bin size for histogramming the protons, in microns
+        plots: Boolean, if True, also save flux plots for each file
+        workers: Integer, number of conversion processes
+        interval: Float, seconds between polls of the folder
+        statefile: String, JSON file recording finished conversions
+                    (default: '.pradreader-watch.json' in outdir)
+    """
+    def __init__(self, folder, outdir=None, bin_um=320, plots=False, workers=1,
+                 interval=10.0, statefile=None):
+        self.folder = folder
+        self.outdir = folder if outdir is None else outdir
+        self.bin_um = float(bin_um)
+        self.plots = plots
+        self.workers = int(workers)
+        self.interval = float(interval)
+        self.statefile = statefile or os.path.join(self.outdir, '.pradreader-watch.json')
+        self._seen = {} # Filename => (size, mtime) at the previous poll, for files not yet converted
+        self._inflight = {} # Future => (filename, size, mtime), for conversions in progress
+
+        try: # Python2&3 equivalent of os.makedirs(outdir, exist_ok=True)
+            os.makedirs(self.outdir)
+        except OSError:
+            if not os.path.isdir(self.outdir):
+                raise
+
+        self.state = {} # Filename => {'size', 'mtime', 'output' or 'error'}
+        if os.path.isfile(self.statefile):
+            with open(self.statefile) as f:
+                self.state = json.load(f)
+
+    def saveState(self):
+        """ Write the state file (atomically, so a crash never leaves it half-written) """
+        fd, tmpfn = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.statefile)))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        try:
+            os.replace(tmpfn, self.statefile)
+        except AttributeError: # Python 2
+            os.rename(tmpfn, self.statefile)
+
+    def outputs(self, name):
+        """ PRR filename and plot folder for a given detector file name """
+        return (os.path.join(self.outdir, name + '_prr.txt'),
+                os.path.join(self.outdir, name + '_plots') if self.plots else None)
+
+    def poll(self):
+        """ Look at the folder once; returns detector files that are complete and not yet converted """
+        ready = []
+        for name in sorted(os.listdir(self.folder)):
+            if not DETECTOR_PATTERN.match(name):
+                continue
+            if any(name == job[0] for job in self._inflight.values()):
+                continue # Being converted right now
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError: # Removed meanwhile
+                continue
+            sig = (st.st_size, st.st_mtime)
+            done = self.state.get(name)
+            if done is not None and (done['size'], done['mtime']) == sig:
+                continue # Already converted (or failed) in this exact version
+
+            if self._seen.get(name) == sig: # Unchanged since the previous poll: the dump is complete
+                ready.append(name)
+                del self._seen[name]
+            else:
+                self._seen[name] = sig
+        return ready
+
+    def run(self, once=False):
+        """ Poll and convert until interrupted (or, with once=True, until everything present is converted) """
+        inflight = self._inflight
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        print("Watching '" + self.folder + "' for proton detector files (Ctrl-C to stop)...")
+        sys.stdout.flush()
+        try:
+            while True:
+                for name in self.poll():
+                    fn = os.path.join(self.folder, name)
+                    st = os.stat(fn)
+                    outfile, plotdir = self.outputs(name)
+                    print("Converting '" + name + "'...")
+                    sys.stdout.flush() # Don't let forked workers inherit (and repeat) unwritten output
+                    future = pool.submit(convertDetectorFile, fn, outfile, self.bin_um, plotdir)
+                    inflight[future] = (name, st.st_size, st.st_mtime)
+
+                self._collect(inflight, wait=False)
+                if once and not inflight and not self._seen:
+                    break
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print("Stopping; finishing conversions in progress...")
+        finally:
+            pool.shutdown(wait=True)
+            self._collect(inflight, wait=True)
+
+    def _collect(self, inflight, wait):
+        """ (Private) Record finished conversions in the state file """
+        changed = False
+        for future in list(inflight):
+            if not (wait or future.done()):
+                continue
+            name, size, mtime = inflight.pop(future)
+            entry = {'size': size, 'mtime': mtime}
+            try:
+                entry['output'] = future.result()
+                print("Converted '" + name + "' to '" + entry['output'] + "'.")
+            except Exception as e:
+                entry['error'] = repr(e)
+                print("Failed to convert '" + name + "': " + repr(e))
+            self.state[name] = entry
+            changed = True
+        if changed:
+            self.saveState()
@@ -104,6 +104,10 @@ setup(
     entry_points={
         'console_scripts': [
             'pradreader=pradreader.scripts.pradreader:read_into_PRR',
+            'pradreader-watch=pradreader.scripts.pradwatch:watch_dir',
+            'pradreader-server=pradreader.scripts.pradserver:serve',
+            'pradreader-client=pradreader.scripts.pradclient:request',
+            'pradreader-equivalence=pradreader.scripts.pradequiv:check',
         ],
     },
 )
@@ -0,0 +1,71 @@
+"""
+Tests for pradreader.shmem: handing flux maps to worker processes through shared memory
+"""
+
+import os
+import sys
+import json
+import textwrap
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from multiprocessing import shared_memory
+except ImportError: # Python 2
+    shared_memory = None
+
+def _run(code, *args):
+    """ Run a Python script in a fresh interpreter (with its own resource tracker); returns (returncode, stdout, stderr) """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    proc = subprocess.Popen([sys.executable, '-c', textwrap.dedent(code)] + list(args), env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    out, err = proc.communicate() # Also waits for the resource tracker, which shares stderr
+    return proc.returncode, out, err
+
+_SHARE = """
+    import numpy as np
+    from pradreader.reader import prad
+    from pradreader import shmem
+    pr = prad('test')
+    pr.flux2D = np.arange(20.0).reshape(5, 4)
+    pr.flux2D_ref = np.ones((5, 4))
+    handle = shmem.share(pr)
+"""
+
+@unittest.skipIf(shared_memory is None or os.name != 'posix', "Needs POSIX shared memory (Python 3.8+)")
+class TestShmem(unittest.TestCase):
+
+    def test_spawn_pool_release(self):
+        """ Workers of a spawn-context pool attach, and the creator then releases, without tracker errors """
+        code, out, err = _run(_SHARE + """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn')) as pool:
+        sums = [float(p.flux2D.sum()) for p in pool.map(shmem.attach, [handle] * 4)]
+    handle.release()
+    print(sums)
+    """)
+        self.assertEqual(code, 0, err)
+        self.assertEqual(out.strip(), str([190.0] * 4))
+        self.assertEqual(err, '')
+
+    def test_other_process_attach(self):
+        """ A process with its own resource tracker attaches and exits; the segments stay for the creator """
+        code, out, err = _run(_SHARE + """
+    import sys, json, subprocess
+    reader = "import sys, json; from pradreader import shmem; print(shmem.attach(json.loads(sys.argv[1])).flux2D.sum())"
+    child = subprocess.Popen([sys.executable, '-c', reader, json.dumps(handle.todict())],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    cout, cerr = child.communicate()
+    sys.stderr.write(cerr)
+    print(cout.strip(), shmem.attach(handle).flux2D.sum())
+    handle.release()
+    """)
+        self.assertEqual(code, 0, err)
+        self.assertEqual(out.split(), ['190.0', '190.0'])
+        self.assertEqual(err, '')
+
+if __name__ == '__main__':
+    unittest.main()